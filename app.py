@@ -9,13 +9,25 @@
 3. 确保所有Streamlit方法使用标准英文命名
 """
 
+import time
+_run_started = time.perf_counter()
+
 import streamlit as st
 from datetime import datetime, timedelta
 from utils.database import Database
-from utils.crawler import TwoBuluCrawler
-from utils.poster import PosterGenerator
 from utils.weather import WeatherAPI
-from utils.wechat import WeChatBot
+from utils.wechat import WeChatBot, mask_webhook
+from utils.dispatcher import OutboxDispatcher
+from utils.scheduler import JobScheduler
+from utils.activity_jobs import ActivityJobs, JOB_CLOSE_VOTE
+from utils.asset_store import AssetCompactor, AssetStore
+from utils import lifecycle
+from utils.vote_server import vote_url_for
+from utils.drafts import DraftStore, DRAFT_KEYS
+from utils.recommender import RouteRecommender, DIFFICULTY_LEVELS
+from utils.catalogue import RouteCatalogueCache
+from utils.lazy import LazyTools, StartupTimer
+from utils import metrics, profiler, tracing
 import os
 from dateutil.relativedelta import relativedelta
 
@@ -228,23 +240,18 @@ def get_test_shanghai_routes():
 def insert_test_routes_to_db(db):
     """将测试路线数据插入数据库"""
     all_routes = get_test_suzhou_routes() + get_test_shanghai_routes()
-    success_count = 0
-    skip_count = 0
-    
-    for route in all_routes:
-        try:
-            # 检查是否已存在
-            existing_routes = db.get_routes(location=route.get('location', ''), limit=100)
-            existing_names = [r['name'] for r in existing_routes]
-            
-            if route['name'] in existing_names:
-                skip_count += 1
-            else:
-                route_id = db.insert_route(route)
-                success_count += 1
-        except Exception as e:
-            pass
-    
+
+    # 跳过已存在的路线，其余一次批量写入
+    existing_names = {name for name, _ in db.get_route_names()}
+    new_routes = [route for route in all_routes if route['name'] not in existing_names]
+    skip_count = len(all_routes) - len(new_routes)
+    try:
+        db.insert_routes(new_routes)
+        success_count = len(new_routes)
+    except Exception as e:
+        print(f"插入测试路线失败：{e}")
+        success_count = 0
+
     return {
         'success': success_count,
         'skip': skip_count,
@@ -259,37 +266,144 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
+# 启动耗时记录（进程内共享，各阶段只记录第一次）
+@st.cache_resource
+def init_startup_timer():
+    return StartupTimer()
+
+startup_timer = init_startup_timer()
+startup_timer.record("导入模块", time.perf_counter() - _run_started)
+
 # 初始化数据库
 @st.cache_resource
 def init_db():
-    # 确保数据目录存在
-    os.makedirs("data", exist_ok=True)
-    
-    db = Database("data/hike.db")
-    db.init_faq_data()
-    
-    # 检查是否已有路线数据，如果没有则插入测试数据
-    routes_count = db.get_routes_count()
-    if routes_count == 0:
-        # 插入测试数据（使用内置函数）
-        insert_test_routes_to_db(db)
-    
+    with startup_timer.phase("初始化数据库"):
+        # 确保数据目录存在
+        os.makedirs("data", exist_ok=True)
+
+        db = Database("data/hike.db")
+        db.init_faq_data()
+
+        # 检查是否已有路线数据，如果没有则插入测试数据
+        routes_count = db.get_routes_count()
+        if routes_count == 0:
+            # 插入测试数据（使用内置函数）
+            insert_test_routes_to_db(db)
+
     return db
 
 db = init_db()
 
-# 初始化工具类
+# 初始化工具类：第一次使用时才导入并构造，爬虫（bs4）和海报（PIL、qrcode）不影响首屏
+def _make_crawler():
+    from utils.crawler import TwoBuluCrawler
+    return TwoBuluCrawler()
+
+def _make_poster():
+    from utils.poster import PosterGenerator
+    return PosterGenerator(asset_store=asset_store)
+
 @st.cache_resource
 def init_tools():
-    return {
-        'crawler': TwoBuluCrawler(),
-        'poster': PosterGenerator(),
-        'weather': WeatherAPI(api_key=os.getenv('WEATHER_API_KEY', '')),
-        'wechat': WeChatBot(webhook_url=os.getenv('WECHAT_WEBHOOK_URL', ''))
-    }
+    return LazyTools({
+        'crawler': _make_crawler,
+        'poster': _make_poster,
+        'weather': lambda: WeatherAPI(api_key=os.getenv('WEATHER_API_KEY', '')),
+        'wechat': lambda: WeChatBot(webhook_url=os.getenv('WECHAT_WEBHOOK_URL', '')),
+        'recommender': lambda: RouteRecommender(db),
+        'catalogue': lambda: RouteCatalogueCache(db),
+    }, timer=startup_timer)
 
 tools = init_tools()
 
+# 启动发件箱后台投递
+@st.cache_resource
+def init_dispatcher():
+    with startup_timer.phase("启动发件箱投递"):
+        dispatcher = OutboxDispatcher(db)
+        dispatcher.start()
+    return dispatcher
+
+dispatcher = init_dispatcher()
+
+# 海报文件仓库（后台定期迁移旧版文件、回收未被活动和草稿引用的海报）
+@st.cache_resource
+def init_asset_store():
+    with startup_timer.phase("启动资源文件整理"):
+        store = AssetStore()
+        AssetCompactor(db, store).start()
+    return store
+
+asset_store = init_asset_store()
+
+# 启动定时任务（投票截止自动选定日期并发送结果，活动前发送天气和集合提醒）
+@st.cache_resource
+def init_activity_jobs():
+    with startup_timer.phase("启动定时任务"):
+        scheduler = JobScheduler(db)
+        # 机器人和天气API在任务第一次执行时才构造
+        activity_jobs = ActivityJobs(db, scheduler, lambda: tools['wechat'], dispatcher, lambda: tools['weather'])
+        activity_jobs.backfill()
+        scheduler.start()
+    return activity_jobs
+
+activity_jobs = init_activity_jobs()
+
+# 运行指标导出（设置 METRICS_PORT 时在该端口提供 /metrics）
+@st.cache_resource
+def init_metrics_server():
+    port = os.getenv('METRICS_PORT')
+    return metrics.serve_metrics(int(port)) if port else None
+
+metrics_server = init_metrics_server()
+
+# 采样分析（设置 HIKE_PROFILER=1 时启用，监听触发文件，侧边栏显示开关）
+PROFILER_ENABLED = os.getenv('HIKE_PROFILER') == '1'
+
+@st.cache_resource
+def init_profiler_trigger():
+    return profiler.watch_trigger(os.getenv('HIKE_PROFILE_TRIGGER', 'data/profile.trigger'))
+
+if PROFILER_ENABLED:
+    init_profiler_trigger()
+
+# 草稿仓库（启动时清理过期草稿）
+@st.cache_resource
+def init_drafts():
+    with startup_timer.phase("清理过期草稿"):
+        drafts = DraftStore(db)
+        drafts.prune()
+    return drafts
+
+drafts = init_drafts()
+
+def save_draft():
+    """保存当前进度，草稿ID写入URL，刷新页面后可恢复"""
+    draft_id = drafts.save(st.session_state.get('draft_id'), st.session_state)
+    st.session_state['draft_id'] = draft_id
+    st.query_params['draft'] = str(draft_id)
+
+# 恢复草稿：会话首次运行时按URL中的草稿ID从数据库读取
+if 'draft_id' not in st.session_state:
+    draft_param = st.query_params.get('draft')
+    draft_state = drafts.load(int(draft_param)) if draft_param and draft_param.isdigit() else None
+    if draft_state is not None:
+        st.session_state.update(draft_state)
+        st.session_state['draft_id'] = int(draft_param)
+
+# 路线查询缓存：键中包含路线数据版本，路线写入后自动失效，页面空闲重跑时不查询数据库
+# 推荐结果额外按时间过期（历史活动变化后最多5分钟生效）
+@st.cache_data(max_entries=256, ttl=300, show_spinner=False)
+def recommend_routes(version, location, tags, target_distance, difficulty, exclude_recent, offset):
+    return tools['recommender'].recommend(
+        k=3, offset=offset, location=location, tags=list(tags), target_distance=target_distance,
+        difficulty=difficulty, exclude_recent=exclude_recent
+    )
+
+@st.cache_data(max_entries=256, show_spinner=False)
+def load_themes(name, tags, location):
+    return tools['poster'].generate_themes({'name': name, 'tags': tags, 'location': location})
+
 # ==================== 侧边栏配置 ====================
 st.sidebar.title("🚶 徒步活动组织系统")
 st.sidebar.markdown("---")
@@ -305,8 +419,16 @@ wechat_webhook = st.sidebar.text_input(
     type="password",
     help="企业微信机器人的Webhook地址"
 )
-if wechat_webhook:
-    tools['wechat'].webhook_url = wechat_webhook
+broadcast_webhooks = st.sidebar.text_area(
+    "海报广播群Webhook（每行一个，可选）",
+    help="发布海报时同时发送到这些群"
+)
+
+# 每个会话使用自己的群地址，共享发送通道和队列
+wechat_bot = tools['wechat'].for_webhook(wechat_webhook) if wechat_webhook else tools['wechat']
+broadcast_targets = [wechat_bot.webhook_url] + [
+    line.strip() for line in broadcast_webhooks.splitlines() if line.strip()
+]
 
 # 天气API配置
 st.sidebar.subheader("天气API")
@@ -318,6 +440,19 @@ weather_api_key = st.sidebar.text_input(
 if weather_api_key:
     tools['weather'].api_key = weather_api_key
 
+# 活动草稿
+st.sidebar.subheader("活动草稿")
+if 'draft_id' in st.session_state:
+    st.sidebar.caption(f"当前草稿 #{st.session_state['draft_id']}，进度自动保存，刷新页面不会丢失")
+for draft in drafts.recent(5):
+    if draft['id'] != st.session_state.get('draft_id'):
+        st.sidebar.markdown(f"- [{draft['title'] or '未命名草稿'}](?draft={draft['id']})（{draft['updated_at']}）")
+if st.sidebar.button("新建草稿"):
+    for key in DRAFT_KEYS + ('draft_id', 'tally', 'publish_future', 'route_offset', 'selected_bg_image'):
+        st.session_state.pop(key, None)
+    st.query_params.clear()
+    st.rerun()
+
 st.sidebar.markdown("---")
 st.sidebar.markdown("### 系统说明")
 st.sidebar.markdown("""
@@ -347,22 +482,41 @@ with tab1:
 
     # 加载路线按钮
     if st.button("🔄 刷新路线", type="primary"):
-        with st.spinner("正在从两步路获取最新路线..."):
+        with st.spinner("正在从两步路获取最新路线..."), tracing.trace("刷新路线", location=location):
             routes = tools['crawler'].get_route_list(location=location)
 
-            # 保存到数据库
-            for route in routes:
-                db.insert_route(route)
+            # 批量保存到数据库（路线版本更新，缓存的查询结果随之失效）
+            db.insert_routes(routes)
 
             st.success(f"已获取 {len(routes)} 条路线！")
             st.rerun()
 
-    # 获取路线列表
-    routes = db.get_routes(location=location, limit=3, offset=st.session_state.get('route_offset', 0))
+    # 推荐偏好
+    with st.expander("⚙️ 推荐偏好"):
+        pref_col1, pref_col2 = st.columns([1, 1])
+        with pref_col1:
+            target_distance = st.slider("期望里程（公里）", 3, 15, 10)
+            preferred_difficulty = st.selectbox("期望难度", ["不限"] + list(DIFFICULTY_LEVELS))
+        with pref_col2:
+            preferred_tags = st.multiselect(
+                "偏好标签",
+                ["风景", "山景", "森林", "古道", "文化", "亲子", "轻松", "茶文化", "红叶", "湖景"]
+            )
+            exclude_recent = st.number_input("排除最近几次活动用过的路线", value=3, min_value=0, max_value=20)
+
+    # 获取推荐路线（综合热度、偏好、当季标签和历史参与度，并兼顾路线多样性）
+    routes_version = db.routes_version()
+    # 路线目录快照（路线版本不变时直接复用）
+    catalogue = tools['catalogue'].current()
+    routes = recommend_routes(
+        routes_version, location, tuple(preferred_tags), target_distance,
+        None if preferred_difficulty == "不限" else preferred_difficulty,
+        int(exclude_recent), st.session_state.get('route_offset', 0)
+    )
 
     # 显示路线列表
     if routes:
-        st.subheader(f"推荐路线（按热度排序）")
+        st.subheader(f"推荐路线")
 
         for i, route in enumerate(routes, 1):
             with st.container():
@@ -391,7 +545,7 @@ with tab1:
                 st.markdown("---")
 
         # 分页控制
-        total_count = db.get_routes_count(location=location)
+        total_count = catalogue.count(location=location)
         if total_count > 3:
             col_left, col_center, col_right = st.columns([1, 2, 1])
 
@@ -416,20 +570,86 @@ with tab1:
 
     # 选择路线
     st.subheader("选择路线")
-    all_routes = db.get_routes(location=location, limit=100)
-    if all_routes:
-        route_names = [r['name'] for r in all_routes]
-        selected_route_name = st.selectbox("选择一条路线", route_names)
-
-        if selected_route_name:
-            selected_route = next((r for r in all_routes if r['name'] == selected_route_name), None)
-            if selected_route and st.button("确认选择", type="primary"):
+    # 选项为路线ID（目录重建后选中项不变），名称按ID从目录中查找
+    route_ids = catalogue.ids[catalogue.filter(location=location)[:100]].tolist()
+    if route_ids:
+        selected_route_id = st.selectbox(
+            "选择一条路线", route_ids, format_func=lambda route_id: catalogue.get(route_id).name
+        )
+
+        if selected_route_id is not None:
+            selected_route_name = catalogue.get(selected_route_id).name
+            if st.button("确认选择", type="primary"):
+                # 确认时才读取完整路线（含描述等长文本）
+                selected_route = db.get_route_by_id(selected_route_id)
                 st.session_state['selected_route'] = selected_route
+                save_draft()
                 st.success(f"已选择：{selected_route_name}")
                 st.info("👉 请前往「海报制作」标签页继续")
     else:
         st.warning("请先获取路线数据")
 
+# 首屏（侧边栏和路线页）渲染完成，首次运行时输出启动耗时
+startup_timer.record("首屏渲染", time.perf_counter() - _run_started)
+startup_timer.print_once()
+with st.sidebar.expander("⏱️ 启动耗时"):
+    st.code(startup_timer.report())
+    st.caption(f"已加载工具：{'、'.join(tools.loaded()) or '无'}")
+
+# ==================== 运行指标 ====================
+with st.sidebar.expander("📊 运行指标"):
+    metric_rows = metrics.summary()
+    if metric_rows:
+        st.dataframe(metric_rows, hide_index=True, use_container_width=True)
+    else:
+        st.caption("暂无数据")
+    if metrics_server:
+        st.caption(f"Prometheus：http://127.0.0.1:{metrics_server.server_address[1]}/metrics")
+
+# ==================== 耗时分析 ====================
+with st.sidebar.expander("🔥 操作耗时分析"):
+    recent_traces = tracing.load_traces(limit=20)
+    if recent_traces:
+        trace_index = st.selectbox(
+            "最近的操作",
+            range(len(recent_traces)),
+            format_func=lambda i: (
+                f"{recent_traces[i]['name']} · "
+                f"{datetime.fromtimestamp(recent_traces[i]['start_ns'] / 1e9).strftime('%H:%M:%S')} · "
+                f"{recent_traces[i]['duration_ms']:.0f}ms"
+            ),
+        )
+        st.code(tracing.breakdown(recent_traces[trace_index], width=12, min_ms=0.5), language=None)
+        st.caption(f"完整链路（OTLP/JSON）：{tracing.trace_file()}")
+    else:
+        st.caption("暂无数据" if tracing.trace_file() else "链路追踪已关闭（HIKE_TRACING=0）")
+
+# ==================== 采样分析 ====================
+if PROFILER_ENABLED:
+    with st.sidebar.expander("🩺 采样分析"):
+        profile_status = profiler.status()
+        if profile_status['running']:
+            st.info(f"正在采样，已进行 {profile_status['elapsed']:.0f} 秒")
+            if st.button("⏹️ 结束采样"):
+                profiler.stop_capture()
+                st.rerun()
+        else:
+            profile_seconds = st.number_input("采样时长（秒）", min_value=5, max_value=profiler.MAX_SECONDS, value=30, step=5)
+            if st.button("▶️ 开始采样"):
+                profiler.start_capture(profile_seconds)
+                st.rerun()
+        last_profile = profile_status['last']
+        if last_profile and 'error' not in last_profile:
+            st.caption(f"上次采样：{last_profile['seconds']}秒，{last_profile['samples']} 个样本，"
+                       f"采样开销 {last_profile['overhead']:.2%}")
+            for profile_key, profile_label in (('speedscope', "下载speedscope文件"), ('collapsed', "下载折叠栈")):
+                with open(last_profile[profile_key], 'rb') as profile_file:
+                    st.download_button(profile_label, profile_file.read(),
+                                       file_name=os.path.basename(last_profile[profile_key]),
+                                       key=f"profile_{profile_key}")
+        elif last_profile:
+            st.error(f"采样结果写入失败：{last_profile['error']}")
+
 # ==================== 标签页2：海报制作 ====================
 with tab2:
     st.header("🎨 步骤2：制作海报")
@@ -444,14 +664,34 @@ with tab2:
     # 显示选中的路线信息
     st.info(f"已选择路线：{selected_route['name']}")
 
+    # 每次重跑都会执行所有标签页：点击开始后才构造海报工具（PIL等），只浏览路线的会话不加载
+    # 已有海报进度（含恢复的草稿）时视为已开始；没有进度时标签页3本来也无内容可显示
+    poster_started = st.session_state.get('poster_started') or any(
+        key in st.session_state
+        for key in ('selected_theme', 'searched_images', 'bg_image', 'vote_options', 'poster_path')
+    )
+    if not poster_started:
+        if st.button("🎨 开始制作海报", type="primary"):
+            st.session_state['poster_started'] = True
+            st.rerun()
+        st.stop()
+
     # 步骤2.1：生成主题词
     st.subheader("📝 2.1 选择主题词")
 
     # 生成主题词
-    themes = tools['poster'].generate_themes(selected_route)
-
-    # 显示主题词选择
-    selected_theme = st.selectbox("选择一个主题词", themes + ["自定义"])
+    themes = load_themes(selected_route.get('name'), selected_route.get('tags'), selected_route.get('location'))
+    # 后台预热所有主题词的图片搜索结果
+    tools['poster'].prewarm_image_search(themes, count=3)
+
+    # 显示主题词选择（恢复草稿时默认选中上次的主题词）
+    theme_choices = themes + ["自定义"]
+    saved_theme = st.session_state.get('selected_theme')
+    selected_theme = st.selectbox(
+        "选择一个主题词",
+        theme_choices,
+        index=theme_choices.index(saved_theme) if saved_theme in themes else 0
+    )
 
     # 如果选择自定义
     if selected_theme == "自定义":
@@ -468,35 +708,48 @@ with tab2:
     col1, col2 = st.columns([1, 1])
     with col1:
         if st.button("🔍 搜索图片", type="primary"):
-            with st.spinner("正在搜索图片..."):
+            with st.spinner("正在搜索图片..."), tracing.trace("搜索图片", theme=selected_theme):
                 images = tools['poster'].search_images(selected_theme, count=3)
+                # 后台并发预取原图和缩略图
+                tools['poster'].prefetch_images(images)
                 st.session_state['searched_images'] = images
+                save_draft()
                 st.success(f"找到 {len(images)} 张图片")
 
     with col2:
         uploaded_image = st.file_uploader("或上传自定义图片", type=['jpg', 'jpeg', 'png'])
 
-    # 显示搜索结果或上传的图片
-    background_image = None
+    # 显示搜索结果或上传的图片；会话中只保存图片引用，生成海报时才读取原图
+    background_ref = None
 
     if uploaded_image:
-        background_image = tools['poster'].upload_custom_image(uploaded_image)
-        st.success("已上传自定义图片")
+        background_ref = tools['poster'].upload_custom_image(uploaded_image)
+        if background_ref:
+            st.success("已上传自定义图片")
+        else:
+            st.error("图片无法识别，请换一张")
     elif 'searched_images' in st.session_state:
         st.write("搜索结果：")
         cols = st.columns(3)
         for i, img_url in enumerate(st.session_state['searched_images']):
             with cols[i]:
-                st.image(img_url, use_column_width=True)
+                # 展示本地缩略图，避免浏览器加载原图
+                thumbnail = tools['poster'].get_thumbnail(img_url)
+                st.image(thumbnail or img_url, use_column_width=True)
                 if st.button(f"选择图片 {i+1}", key=f"img_{i}"):
-                    background_image = tools['poster'].download_image(img_url)
-                    st.session_state['selected_bg_image'] = background_image
+                    background_ref = {'url': img_url}
                     st.success(f"已选择图片 {i+1}")
     else:
         st.info("请搜索图片或上传自定义图片")
 
-    if background_image:
-        st.session_state['selected_bg_image'] = background_image
+    if background_ref and background_ref != st.session_state.get('bg_image'):
+        st.session_state['bg_image'] = background_ref
+        save_draft()
+
+    if 'bg_image' in st.session_state:
+        bg_thumbnail = tools['poster'].background_thumbnail(st.session_state['bg_image'])
+        if bg_thumbnail:
+            st.image(bg_thumbnail, caption="当前背景图片", width=240)
 
     # 步骤2.3：选择投票月份
     st.subheader("📅 2.3 选择投票月份")
@@ -518,9 +771,10 @@ with tab2:
     st.subheader("📋 2.4 生成投票选项")
 
     if st.button("🔄 生成投票选项", type="primary"):
-        with st.spinner("正在获取天气信息..."):
+        with st.spinner("正在获取天气信息..."), tracing.trace("生成投票选项", location=location):
             vote_options = tools['weather'].generate_vote_options(vote_year, vote_month, location)
             st.session_state['vote_options'] = vote_options
+            save_draft()
             st.success(f"已生成 {len(vote_options)} 个投票选项")
 
     # 显示投票选项
@@ -546,28 +800,56 @@ with tab2:
     st.subheader("🖼️ 2.6 生成海报")
 
     if all([
-        'selected_bg_image' in st.session_state,
+        'bg_image' in st.session_state,
         'vote_options' in st.session_state
     ]):
         if st.button("✨ 生成海报", type="primary"):
-            with st.spinner("正在生成海报..."):
-                # 创建投票链接（示例）
-                vote_url = f"https://example.com/vote/{int(datetime.now().timestamp())}"
+            with st.spinner("正在生成海报..."), tracing.trace("生成海报"):
+                # 按引用读取背景原图（只在生成时加载，用完即释放）
+                background_image = tools['poster'].load_background(st.session_state['bg_image'])
+                if background_image is None:
+                    st.error("背景图片已失效，请重新选择图片")
+                    st.stop()
+
+                # 重新生成海报时，取消之前创建的投票
+                if 'activity_id' in st.session_state:
+                    try:
+                        lifecycle.transition(db, st.session_state['activity_id'], lifecycle.CANCELLED)
+                    except lifecycle.InvalidTransition as e:
+                        print(f"取消旧活动失败：{e}")
+                    activity_jobs.scheduler.cancel(st.session_state['activity_id'])
+
+                # 创建投票中的活动和投票选项，投票链接指向内置投票服务
+                activity_id = db.insert_activity({
+                    'route_id': selected_route['id'],
+                    'name': f"{selected_route['name']} - {vote_year}年{vote_month}月",
+                    'status': lifecycle.VOTING,
+                    'vote_deadline': vote_deadline,
+                    'vote_month': f"{vote_year}-{vote_month}",
+                })
+                db.insert_vote_options(activity_id, st.session_state['vote_options'])
+                vote_url = vote_url_for(os.getenv('VOTE_BASE_URL', 'http://localhost:8082'), activity_id)
+                activity_jobs.schedule_vote_close(activity_id, vote_deadline)
 
                 # 生成海报
                 poster_path = tools['poster'].generate_poster(
                     selected_route,
                     selected_theme,
-                    st.session_state['selected_bg_image'],
+                    background_image,
                     vote_url,
                     st.session_state['vote_options']
                 )
 
+                db.update_activity(activity_id, {'poster_url': poster_path, 'vote_url': vote_url})
+
+                st.session_state['activity_id'] = activity_id
                 st.session_state['poster_path'] = poster_path
                 st.session_state['vote_url'] = vote_url
                 st.session_state['vote_deadline'] = vote_deadline
                 st.session_state['vote_year'] = vote_year
                 st.session_state['vote_month'] = vote_month
+                st.session_state['selected_theme'] = selected_theme
+                save_draft()
 
                 st.success("海报生成成功！")
                 st.image(poster_path, use_column_width=True)
@@ -576,6 +858,30 @@ with tab2:
         st.warning("请先完成上述步骤：选择背景图片和生成投票选项")
 
 # ==================== 标签页3：投票与建群 ====================
+@st.fragment(run_every=3)
+def vote_monitor(activity_id: int):
+    """投票监控（只重新运行本片段，增量合并票数）"""
+    tally = st.session_state.get('tally')
+    if not tally or tally['activity_id'] != activity_id:
+        tally = {'activity_id': activity_id, 'version': -1, 'options': {}}
+
+    update = db.get_tally_changes(activity_id, tally['version'])
+    for option in update['changes']:
+        tally['options'][option['id']] = option
+    tally['version'] = update['version']
+    st.session_state['tally'] = tally
+
+    options = sorted(tally['options'].values(), key=lambda o: o['vote_date'])
+    total = sum(option['vote_count'] for option in options)
+    st.write(f"当前投票情况（共 {total} 票）：")
+    for i, option in enumerate(options, 1):
+        col1, col2 = st.columns([3, 1])
+        with col1:
+            st.write(f"{i}. {option['vote_date']} - {option['weather']}")
+            st.progress(option['vote_count'] / total if total else 0.0)
+        with col2:
+            st.metric("票数", option['vote_count'], label_visibility="collapsed")
+
 with tab3:
     st.header("📊 步骤3：投票与建群")
 
@@ -591,18 +897,45 @@ with tab3:
     # 步骤3.1：发布海报到微信群
     st.subheader("💬 3.1 发布海报到微信群")
 
+    def publish_poster(targets, poster_path, vote_url):
+        # 在发送线程中开启链路，实际投递的耗时才会记入
+        with tracing.trace("发布海报", targets=len(targets)):
+            return wechat_bot.broadcast_poster_with_qrcode(targets, poster_path, vote_url)
+
     if st.button("📤 发布海报", type="primary"):
-        with st.spinner("正在发布海报..."):
-            success = tools['wechat'].send_poster_with_qrcode(
-                st.session_state['poster_path'],
-                st.session_state['vote_url']
-            )
+        # 记录活动的机器人，投票结果等后续消息发往同一个群
+        db.update_activity(st.session_state['activity_id'], {'webhook_url': wechat_bot.webhook_url})
+        # 后台并发发送到所有群，页面不等待投递结果
+        st.session_state['publish_future'] = wechat_bot.send_in_background(
+            publish_poster,
+            broadcast_targets,
+            st.session_state['poster_path'],
+            st.session_state['vote_url']
+        )
 
-            if success:
-                st.success("海报已发布到微信群！")
-                st.session_state['poster_published'] = True
+    if 'publish_future' in st.session_state:
+        publish_future = st.session_state['publish_future']
+        if not publish_future.done():
+            st.info("海报正在后台发送，可继续操作，稍后刷新查看结果")
+            if st.button("🔄 刷新发送状态"):
+                st.rerun()
+        else:
+            delivery_report = publish_future.result()
+            published = False
+            failed = {t: r for t, r in delivery_report.items() if not r['success']}
+            if delivery_report and not failed:
+                st.success(f"海报已发布到 {len(delivery_report)} 个微信群！")
+                published = True
+            elif len(failed) < len(delivery_report):
+                st.warning(f"海报已发布到 {len(delivery_report) - len(failed)} 个微信群，{len(failed)} 个群发送失败")
+                published = True
             else:
                 st.error("发布失败，请检查微信Webhook配置")
+            for target, result in failed.items():
+                st.caption(f"❌ {mask_webhook(target)}：{result['errmsg']}")
+            if published and not st.session_state.get('poster_published'):
+                st.session_state['poster_published'] = True
+                save_draft()
 
     # 步骤3.2：监控投票
     st.subheader("📊 3.2 投票监控")
@@ -610,42 +943,55 @@ with tab3:
     if 'poster_published' in st.session_state:
         st.info(f"投票截止时间：{st.session_state['vote_deadline'].strftime('%Y-%m-%d %H:%M')}")
 
-        # 显示投票选项
-        if 'vote_options' in st.session_state:
-            st.write("当前投票选项：")
-            for i, option in enumerate(st.session_state['vote_options'], 1):
-                col1, col2 = st.columns([3, 1])
-                with col1:
-                    st.write(f"{i}. {option['date']} - {option['weather']}")
-                with col2:
-                    # 模拟投票数（实际需要从投票平台获取）
-                    vote_count = st.number_input(
-                        "票数",
-                        min_value=0,
-                        value=0,
-                        key=f"vote_{i}",
-                        label_visibility="collapsed"
-                    )
-
-            # 确定日期按钮
-            if st.button("📊 确定活动日期", type="primary"):
-                st.success("活动日期已确定！")
-                st.info("👉 请等待系统自动创建活动群")
+        st.write(f"投票链接：{st.session_state['vote_url']}")
+
+        # 显示投票统计：局部定时刷新，每次只获取上次版本号之后变化的选项
+        vote_monitor(st.session_state['activity_id'])
+
+        activity = db.get_activity(st.session_state['activity_id'])
+        st.caption(f"活动状态：{lifecycle.STATUS_LABELS.get(activity['status'], activity['status'])}")
+        if activity['status'] == lifecycle.VOTING:
+            st.caption("投票截止时系统会自动选定得票最多的日期并在群内公布结果")
+            # 提前截止投票
+            if st.button("📊 立即截止并确定活动日期", type="primary"):
+                # 直接在页面中截止（与定时任务相同的处理，已截止的活动不会重复处理），重跑后即显示结果
+                activity_jobs.scheduler.cancel(activity['id'], [JOB_CLOSE_VOTE])
+                activity_jobs.close_vote({'activity_id': activity['id']})
+                st.rerun()
+        elif activity['selected_date']:
+            st.success(f"活动日期已确定：{activity['selected_date']}")
+            st.info("👉 请继续创建活动群")
 
     # 步骤3.3：创建活动群
     st.subheader("👥 3.3 创建活动群")
 
-    # 获取得票最多的日期
+    # 默认选中得票最多的日期
     if 'vote_options' in st.session_state:
-        # 模拟选择（实际应该从投票结果获取）
         vote_options = st.session_state['vote_options']
+        vote_dates = [opt['date'] for opt in vote_options]
+        activity = db.get_activity(st.session_state['activity_id'])
+        default_date = activity['selected_date'] if activity and activity['selected_date'] else None
+        if default_date is None:
+            top_option = db.get_max_vote_option(st.session_state['activity_id'])
+            default_date = top_option['vote_date'] if top_option else None
         selected_date = st.selectbox(
-            "选择活动日期（如果有平票，请手动选择）",
-            [opt['date'] for opt in vote_options]
+            "选择活动日期（投票截止后默认为选定日期，可手动调整）",
+            vote_dates,
+            index=vote_dates.index(default_date) if default_date in vote_dates else 0
         )
 
+        # 集合时间和地点写入活动，活动前一天晚上的集合提醒使用
+        col1, col2 = st.columns([1, 2])
+        with col1:
+            meeting_time = st.text_input("集合时间", (activity or {}).get('meeting_time') or "08:30")
+        with col2:
+            meeting_place = st.text_input(
+                "集合地点", (activity or {}).get('meeting_place') or "",
+                placeholder="如：地铁站出口，未填写时提醒中显示路线所在地"
+            )
+
         if st.button("🚀 创建活动群并发送欢迎消息", type="primary"):
-            with st.spinner("正在创建活动群..."):
+            with st.spinner("正在创建活动群..."), tracing.trace("创建活动群", activity_id=st.session_state['activity_id']):
                 # 获取天气
                 selected_date_obj = datetime.strptime(selected_date.split('（')[0], "%Y-%m-%d")
                 weather = tools['weather'].get_weather(
@@ -653,55 +999,82 @@ with tab3:
                     st.session_state.get('selected_route', {}).get('location', '苏州')
                 )
 
-                # 发送欢迎消息
-                success = tools['wechat'].send_welcome_message(
-                    st.session_state['selected_route'],
-                    selected_date
-                )
-
-                if success:
-                    st.success("活动群创建成功！")
-                    st.success(f"欢迎消息已发送")
-
-                    # 显示活动信息
-                    st.markdown("---")
-                    st.subheader("🎉 活动创建成功！")
-
-                    col1, col2 = st.columns([1, 1])
-                    with col1:
-                        st.write("**活动信息**")
-                        st.write(f"📍 路线：{st.session_state['selected_route']['name']}")
-                        st.write(f"📅 日期：{selected_date}")
-                        st.write(f"🌤️ 天气：{weather}")
-
-                    with col2:
-                        st.write("**群聊信息**")
-                        st.write(f"👥 群聊：{st.session_state['selected_route']['name']}活动群")
-                        st.write(f"🤖 机器人：已加入并激活")
-
-                    # 保存活动到数据库
-                    activity_data = {
-                        'route_id': st.session_state['selected_route']['id'],
-                        'name': f"{st.session_state['selected_route']['name']} - {selected_date}",
-                        'activity_date': selected_date.split('（')[0],
-                        'status': 'recruiting',
-                        'poster_url': st.session_state['poster_path'],
-                        'vote_url': st.session_state['vote_url'],
-                        'vote_deadline': st.session_state['vote_deadline'],
-                        'vote_month': f"{st.session_state['vote_year']}-{st.session_state['vote_month']}",
-                        'selected_date': selected_date
-                    }
-
-                    activity_id = db.insert_activity(activity_data)
-
-                    # 保存投票选项
-                    db.insert_vote_options(activity_id, st.session_state['vote_options'])
+                # 更新活动（投票阶段已创建），活动进入已成团阶段
+                activity_id = st.session_state['activity_id']
+                activity_data = {
+                    'name': f"{st.session_state['selected_route']['name']} - {selected_date}",
+                    'activity_date': selected_date.split('（')[0],
+                    'selected_date': selected_date,
+                    'meeting_time': meeting_time.strip() or None,
+                    'meeting_place': meeting_place.strip() or None,
+                }
+
+                # 欢迎消息与状态变更在同一事务中写入发件箱，由后台投递
+                # 幂等键包含活动日期：重复提交同一日期只发一次，改期后重新发送
+                outbox_messages = []
+                if wechat_bot.webhook_url:
+                    outbox_messages.extend(wechat_bot.outbox_messages(
+                        wechat_bot.welcome_message(st.session_state['selected_route'], selected_date),
+                        f"welcome:{{activity_id}}:{activity_data['activity_date']}"
+                    ))
+
+                try:
+                    activity = db.get_activity(activity_id)
+                    if activity['status'] == lifecycle.VOTING:
+                        # 投票尚未截止时手动确定日期，不再自动截止
+                        activity_jobs.scheduler.cancel(activity_id, [JOB_CLOSE_VOTE])
+                        lifecycle.transition(db, activity_id, lifecycle.RECRUITING)
+                        activity['status'] = lifecycle.RECRUITING
+                    if activity['status'] == lifecycle.CONFIRMED:
+                        # 已成团的活动再次保存视为改期
+                        db.update_activity(activity_id, activity_data, outbox_messages=outbox_messages)
+                    else:
+                        lifecycle.transition(db, activity_id, lifecycle.CONFIRMED, activity_data, outbox_messages)
+                except lifecycle.InvalidTransition as e:
+                    st.error(f"活动保存失败：{e}")
+                    st.stop()
+
+                activity_jobs.schedule_reminders(activity_id, selected_date)
+                dispatcher.wake()
+                st.session_state['welcome_keys'] = [
+                    m['idempotency_key'].replace('{activity_id}', str(activity_id)) for m in outbox_messages
+                ]
+                save_draft()
+
+                st.success("活动群创建成功！")
+
+                # 显示活动信息
+                st.markdown("---")
+                st.subheader("🎉 活动创建成功！")
 
-                    st.success(f"活动已保存到数据库（ID: {activity_id}）")
+                col1, col2 = st.columns([1, 1])
+                with col1:
+                    st.write("**活动信息**")
+                    st.write(f"📍 路线：{st.session_state['selected_route']['name']}")
+                    st.write(f"📅 日期：{selected_date}")
+                    st.write(f"🌤️ 天气：{weather}")
 
-                    st.info("🎊 现在机器人小助手已经准备好回答群成员的问题了！")
-                else:
-                    st.error("创建活动群失败，请检查微信Webhook配置")
+                with col2:
+                    st.write("**群聊信息**")
+                    st.write(f"👥 群聊：{st.session_state['selected_route']['name']}活动群")
+                    st.write(f"🤖 机器人：已加入并激活")
+
+                st.success(f"活动已保存到数据库（ID: {activity_id}，{lifecycle.STATUS_LABELS[lifecycle.CONFIRMED]}）")
+                st.caption("系统会在活动前3天上午发送天气提醒、前一天晚上发送集合提醒")
+
+                st.info("🎊 现在机器人小助手已经准备好回答群成员的问题了！")
+
+    # 欢迎消息投递状态
+    for welcome_key in st.session_state.get('welcome_keys', []):
+        outbox_message = db.get_outbox_message(welcome_key)
+        if not outbox_message:
+            continue
+        if outbox_message['status'] == 'sent':
+            st.success("欢迎消息已发送")
+        elif outbox_message['status'] == 'dead':
+            st.error(f"欢迎消息发送失败：{outbox_message['last_error']}")
+        else:
+            st.info("欢迎消息等待发送中，服务重启或网络异常后会自动重试")
 
 # ==================== 底部信息 ====================
 st.markdown("---")
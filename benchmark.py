@@ -0,0 +1,485 @@
+"""
+基准测试
+按子系统测量热点路径耗时：数据库（路线/消息/问题库扩展到指定规模）、天气（本地和风天气桩服务）、
+爬虫（生成的列表页）、海报（多种背景尺寸）、机器人（问题匹配、企业微信桩服务），
+结果输出为JSON，可与基线对比发现变慢的子系统
+
+    python benchmark.py                                   # 全部子系统，默认1万条数据
+    python benchmark.py --only database,bot --scale 1000000
+    python benchmark.py --output results.json
+    python benchmark.py --compare baseline.json --threshold 0.2   # 中位数变慢超过20%时退出码为1
+"""
+
+import argparse
+import asyncio
+import calendar
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Tuple
+
+from utils.async_http import AsyncHTTPServer, Request, Response
+from utils.database import Database
+
+SUBSYSTEMS = ('database', 'weather', 'crawler', 'poster', 'bot')
+
+LOCATIONS = ('苏州吴中', '苏州虎丘', '苏州穹窿山', '上海松江', '上海崇明', '上海青浦')
+TAGS = ('风景,轻松', '山景,古道', '森林,亲子', '茶文化,风景', '湖景,骑行', '古镇,人文')
+DIFFICULTIES = ('初级', '中级', '高级')
+FAQ_TOPICS = ('集合', '报名', '费用', '装备', '天气', '交通', '午饭', '保险', '退出', '带娃')
+
+# 天气和海报使用固定的月份，结果不随运行日期变化
+BENCH_YEAR, BENCH_MONTH = 2026, 11
+
+# 海报背景图尺寸（宽, 高）
+POSTER_SIZES = ((720, 1280), (1080, 1920), (2160, 3840))
+
+# 爬虫列表页的路线条数
+CRAWLER_PAGE_SIZES = (20, 200, 2000)
+
+
+# ==================== 计时 ====================
+
+def _percentile(sorted_values: List[float], p: float) -> float:
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * p))]
+
+
+def measure(func: Callable, min_rounds: int = 5, min_time: float = 0.5, max_rounds: int = 2000,
+            warmup: int = 1) -> Dict:
+    """
+    重复执行直到达到最少次数和最短时间，屏蔽被测函数的打印输出
+
+    Returns:
+        耗时统计（毫秒）
+    """
+    timings = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        for _ in range(warmup):
+            func()
+        started = time.perf_counter()
+        while len(timings) < max_rounds and (len(timings) < min_rounds
+                                             or time.perf_counter() - started < min_time):
+            begin = time.perf_counter()
+            func()
+            timings.append(time.perf_counter() - begin)
+
+    timings.sort()
+    mean = sum(timings) / len(timings)
+    return {
+        'rounds': len(timings),
+        'mean_ms': round(mean * 1000, 4),
+        'p50_ms': round(_percentile(timings, 0.50) * 1000, 4),
+        'p99_ms': round(_percentile(timings, 0.99) * 1000, 4),
+        'min_ms': round(timings[0] * 1000, 4),
+        'ops_per_sec': round(1 / mean, 1) if mean else 0,
+    }
+
+
+def measure_once(func: Callable) -> Dict:
+    """只执行一次（写入大量数据等不可重复的步骤）"""
+    return measure(func, min_rounds=1, min_time=0, max_rounds=1, warmup=0)
+
+
+class Results:
+    """测量结果"""
+
+    def __init__(self):
+        self.entries: List[Dict] = []
+
+    def add(self, subsystem: str, name: str, stats: Dict, **params):
+        entry = {'subsystem': subsystem, 'name': name, 'params': params, **stats}
+        self.entries.append(entry)
+        label = ' '.join(f"{k}={v}" for k, v in params.items())
+        print(f"  {name:<28} {label:<24} p50 {stats['p50_ms']:>10.3f}ms  p99 {stats['p99_ms']:>10.3f}ms"
+              f"  ({stats['rounds']}次)")
+
+
+# ==================== 合成数据 ====================
+
+def generate_routes(n: int, seed: int = 0) -> List[Dict]:
+    """生成路线"""
+    rng = random.Random(seed)
+    return [{
+        'name': f"{LOCATIONS[i % len(LOCATIONS)][2:]}路线{i}",
+        'distance': round(rng.uniform(3, 25), 1),
+        'elevation': rng.randint(50, 1200),
+        'duration': round(rng.uniform(1.5, 8), 1),
+        'difficulty': DIFFICULTIES[i % 3],
+        'hot_score': round(rng.uniform(5, 10), 2),
+        'tags': TAGS[rng.randrange(len(TAGS))],
+        'cover_url': '',
+        'description': f"第{i}条合成路线，沿途有山有水。" * 3,
+        'source_url': f"/track/{i}",
+        'location': LOCATIONS[i % len(LOCATIONS)],
+    } for i in range(n)]
+
+
+def generate_faqs(n: int, seed: int = 0) -> List[Tuple[str, str, str]]:
+    """生成问题库：(问题, 答案, 分类)"""
+    rng = random.Random(seed)
+    faqs = []
+    for i in range(n):
+        topic = FAQ_TOPICS[i % len(FAQ_TOPICS)]
+        faqs.append((f"第{i}期活动{topic}怎么安排{rng.choice(('？', '', '呀？'))}",
+                     f"第{i}期的{topic}安排请看群公告。", topic))
+    return faqs
+
+
+def generate_messages(n: int, groups: int = 20, seed: int = 0) -> List[Tuple[str, str, str, bool]]:
+    """生成群消息：(group_chat_id, user_id, message, is_bot)"""
+    rng = random.Random(seed)
+    chatter = ('大家好', '周末天气不错', '收到', '我报名了', '几点出发呀', '需要带午饭吗')
+    return [(f"group-{i % groups}", f"user-{rng.randrange(500)}", rng.choice(chatter), False)
+            for i in range(n)]
+
+
+def seed_database(db: Database, routes: int, messages: int, faqs: int, results: Results):
+    """按规模写入合成数据（大表分批写入，记录写入耗时）"""
+    batch = 50000
+    route_rows = generate_routes(routes)
+    results.add('database', 'insert_routes', measure_once(
+        lambda: [db.insert_routes(route_rows[i:i + batch]) for i in range(0, routes, batch)]
+    ), rows=routes)
+
+    message_rows = generate_messages(messages)
+    results.add('database', 'insert_messages', measure_once(
+        lambda: [db.insert_messages(message_rows[i:i + batch]) for i in range(0, messages, batch)]
+    ), rows=messages)
+
+    # 问题库没有批量写入接口，直接在一个事务中写入
+    conn = db.get_connection()
+    conn.executemany('INSERT INTO faq (question, answer, category) VALUES (?, ?, ?)', generate_faqs(faqs))
+    conn.commit()
+    conn.close()
+
+
+# ==================== 桩服务 ====================
+
+class StubServer:
+    """在后台线程中运行的本地HTTP服务，代替外部接口"""
+
+    def __init__(self, routes: List[Tuple[str, str, Callable]]):
+        self.http = AsyncHTTPServer()
+        for method, path, handler in routes:
+            self.http.route(method, path, handler)
+        self.url = None
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, daemon=True)
+        self._server = None
+
+    def __enter__(self) -> 'StubServer':
+        self._thread.start()
+        self._server = asyncio.run_coroutine_threadsafe(self.http.start('127.0.0.1', 0), self._loop).result()
+        self.url = 'http://127.0.0.1:%d' % self._server.sockets[0].getsockname()[1]
+        return self
+
+    async def _shutdown(self):
+        # 等待客户端关闭keep-alive连接，仍未关闭的连接再取消
+        self._server.close()
+        tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+        if tasks:
+            _, pending = await asyncio.wait(tasks, timeout=1)
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+
+    def __exit__(self, *exc):
+        asyncio.run_coroutine_threadsafe(self._shutdown(), self._loop).result(5)
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(5)
+        self._loop.close()
+
+
+def qweather_stub() -> StubServer:
+    """和风天气桩服务：GET /v7/weather/7d 返回测试月份每天的预报"""
+    days = calendar.monthrange(BENCH_YEAR, BENCH_MONTH)[1]
+    body = json.dumps({'code': '200', 'daily': [
+        {'fxDate': f"{BENCH_YEAR}-{BENCH_MONTH:02d}-{day:02d}", 'tempMin': str(8 + day % 5),
+         'tempMax': str(15 + day % 7), 'textDay': ('晴', '多云', '小雨')[day % 3]}
+        for day in range(1, days + 1)
+    ]}, ensure_ascii=False).encode('utf-8')
+
+    async def forecast(request: Request) -> Response:
+        return Response(body, headers={'Content-Type': 'application/json'})
+
+    return StubServer([('GET', '/v7/weather/7d', forecast)])
+
+
+def wecom_stub() -> StubServer:
+    """企业微信桩服务：POST /cgi-bin/webhook/send 总是返回成功"""
+
+    async def send(request: Request) -> Response:
+        return Response.json({'errcode': 0, 'errmsg': 'ok'})
+
+    return StubServer([('POST', '/cgi-bin/webhook/send', send)])
+
+
+def crawler_page(n: int, seed: int = 0) -> str:
+    """两步路列表页（结构与 TwoBuluCrawler._parse_route_list 解析的一致）"""
+    rng = random.Random(seed)
+    items = []
+    for i in range(n):
+        items.append(
+            f'<div class="route-item"><a href="/track/t{i}.htm"><img src="/img/{i}.jpg"></a>'
+            f'<h3>合成路线{i}</h3><span class="distance">{rng.uniform(3, 20):.1f}公里</span>'
+            f'<span class="elevation">{rng.randint(50, 900)}米</span>'
+            f'<span class="duration">{rng.uniform(1.5, 7):.1f}小时</span>'
+            f'<p class="desc">沿途风景很好，适合周末轻徒步。</p></div>'
+        )
+    return (f'<!DOCTYPE html><html><head><meta charset="utf-8"><title>搜索结果</title></head><body>'
+            f'<div class="nav">导航</div><div class="list">{"".join(items)}</div></body></html>')
+
+
+def crawler_stub(pages: Dict[int, str]) -> StubServer:
+    """两步路桩服务：GET /destination/search 返回 stub.page_size 条路线的列表页"""
+    stub = None
+
+    async def search(request: Request) -> Response:
+        return Response.text(pages[stub.page_size], content_type='text/html; charset=utf-8')
+
+    stub = StubServer([('GET', '/destination/search', search)])
+    stub.page_size = min(pages)
+    return stub
+
+
+# ==================== 子系统 ====================
+
+def bench_database(db: Database, results: Results, scale: Dict[str, int]):
+    from utils.catalogue import RouteCatalogue
+
+    rng = random.Random(1)
+    routes = scale['routes']
+    results.add('database', 'get_routes', measure(lambda: db.get_routes(location='苏州', limit=20)), rows=routes)
+    results.add('database', 'get_routes_deep_page', measure(
+        lambda: db.get_routes(limit=20, offset=routes // 2, max_distance=100, max_elevation=5000,
+                              max_duration=24)), rows=routes)
+    results.add('database', 'get_routes_count', measure(lambda: db.get_routes_count(location='上海')), rows=routes)
+    results.add('database', 'get_route_by_id', measure(
+        lambda: db.get_route_by_id(rng.randint(1, routes))), rows=routes)
+    results.add('database', 'get_routes_by_ids', measure(
+        lambda: db.get_routes_by_ids(rng.sample(range(1, routes + 1), 20))), rows=routes)
+
+    summaries = db.get_route_summaries()
+    results.add('database', 'get_route_summaries', measure(db.get_route_summaries, min_rounds=3), rows=routes)
+    results.add('database', 'catalogue_build', measure(lambda: RouteCatalogue(summaries), min_rounds=3),
+                rows=routes)
+    catalogue = RouteCatalogue(summaries)
+    results.add('database', 'catalogue_filter', measure(lambda: catalogue.filter(location='苏州')), rows=routes)
+
+    results.add('database', 'get_recent_messages', measure(
+        lambda: db.get_recent_messages(f"group-{rng.randrange(20)}", 50)), rows=scale['messages'])
+    results.add('database', 'get_all_faq', measure(db.get_all_faq, min_rounds=3), rows=scale['faqs'])
+
+    activity_id = db.insert_activity({'name': '基准测试活动', 'status': 'voting'})
+    db.insert_vote_options(activity_id, [{'date': f'2026-11-{day:02d}', 'weather': '晴'} for day in (7, 14, 21)])
+    vote_ids = [option['id'] for option in db.get_vote_options(activity_id)]
+    counter = iter(range(10 ** 9))
+    results.add('database', 'cast_ballots', measure(lambda: db.cast_ballots([
+        (activity_id, vote_ids[i % 3], f"voter-{next(counter)}") for i in range(100)
+    ])), batch=100)
+
+
+def bench_weather(results: Results):
+    from utils.weather import WeatherAPI
+
+    with qweather_stub() as stub:
+        weather = WeatherAPI(api_key='bench')
+        weather.base_url = stub.url + '/v7'
+        date = f"{BENCH_YEAR}-{BENCH_MONTH:02d}-15"
+        results.add('weather', 'get_weather', measure(lambda: weather.get_weather(date, '苏州')))
+        results.add('weather', 'generate_vote_options', measure(
+            lambda: weather.generate_vote_options(BENCH_YEAR, BENCH_MONTH, '上海')))
+
+
+def bench_crawler(results: Results):
+    from bs4 import BeautifulSoup
+    from utils.crawler import TwoBuluCrawler
+
+    pages = {n: crawler_page(n) for n in CRAWLER_PAGE_SIZES}
+    crawler = TwoBuluCrawler()
+    for n, html in pages.items():
+        results.add('crawler', 'parse_route_list', measure(
+            lambda: crawler._parse_route_list(BeautifulSoup(html, 'html.parser'), '苏州'), min_rounds=3), items=n)
+
+    with crawler_stub(pages) as stub:
+        crawler.base_url = stub.url
+        for n in CRAWLER_PAGE_SIZES:
+            stub.page_size = n
+            results.add('crawler', 'get_route_list', measure(
+                lambda: crawler.get_route_list('苏州', max_distance=100, max_elevation=5000, max_duration=24),
+                min_rounds=3), items=n)
+        crawler.session.close()
+
+
+def bench_poster(results: Results, workdir: str):
+    from PIL import Image
+    from utils.image_store import ImageStore
+    from utils.poster import PosterGenerator
+
+    poster = PosterGenerator(image_store=ImageStore(os.path.join(workdir, 'images')),
+                             assets_dir=os.path.join(workdir, 'assets'))
+    route = generate_routes(1)[0]
+    options = [{'date': f"{BENCH_YEAR}-{BENCH_MONTH:02d}-{day:02d}（周六）", 'weather': '晴，10-18℃'}
+               for day in (7, 14, 21, 28)]
+    vote_url = 'http://localhost:8082/vote/1'
+
+    results.add('poster', 'generate_qrcode', measure(lambda: poster.generate_qrcode(vote_url)))
+    for width, height in POSTER_SIZES:
+        background = Image.linear_gradient('L').resize((width, height)).convert('RGB')
+        results.add('poster', 'generate_poster', measure(
+            lambda: poster.generate_poster(route, '山野徒步', background, vote_url, options), min_rounds=3),
+            background=f"{width}x{height}")
+
+
+def bench_bot(db: Database, results: Results, scale: Dict[str, int]):
+    from utils.bot_server import FaqIndex, _bench_messages
+    from utils.wechat import WeChatBot
+    from utils.wechat_transport import WeChatTransport
+
+    faqs = db.get_all_faq()
+    results.add('bot', 'faq_index_build', measure(lambda: FaqIndex(faqs), min_rounds=3), faqs=len(faqs))
+    index = FaqIndex(faqs)
+    messages = _bench_messages(random.Random(2).sample(faqs, min(len(faqs), 500)))
+    # 单次匹配只有几微秒，按整批消息计时
+    results.add('bot', 'faq_match', measure(lambda: [index.match(message) for message in messages]),
+                faqs=len(faqs), messages=len(messages))
+
+    with wecom_stub() as stub:
+        transport = WeChatTransport(rate=1e6, burst=10 ** 6)
+        bot = WeChatBot(stub.url + '/cgi-bin/webhook/send?key=bench', transport=transport)
+        results.add('bot', 'send_text', measure(lambda: bot.send_text('周六8:30地铁站集合，别迟到')))
+        long_text = '\n'.join(f"- 第{i}条注意事项：带够饮用水和雨具" for i in range(300))
+        results.add('bot', 'send_markdown_split', measure(lambda: bot.send_markdown(long_text)),
+                    chars=len(long_text))
+        transport.session.close()
+
+
+# ==================== 运行与对比 ====================
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def run(subsystems: List[str], scale: Dict[str, int]) -> Dict:
+    """运行选定子系统的基准测试"""
+    results = Results()
+    started = time.perf_counter()
+    with tempfile.TemporaryDirectory() as workdir:
+        db = None
+        if {'database', 'bot'} & set(subsystems):
+            print(f"写入合成数据：路线 {scale['routes']}，消息 {scale['messages']}，问题 {scale['faqs']}")
+            db = Database(os.path.join(workdir, 'bench.db'))
+            seed_database(db, scale['routes'], scale['messages'], scale['faqs'], results)
+
+        for subsystem in subsystems:
+            print(f"[{subsystem}]")
+            if subsystem == 'database':
+                bench_database(db, results, scale)
+            elif subsystem == 'weather':
+                bench_weather(results)
+            elif subsystem == 'crawler':
+                bench_crawler(results)
+            elif subsystem == 'poster':
+                bench_poster(results, workdir)
+            elif subsystem == 'bot':
+                bench_bot(db, results, scale)
+
+    return {
+        'meta': {
+            'created_at': datetime.now().isoformat(timespec='seconds'),
+            'commit': _git_commit(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'scale': scale,
+            'elapsed': round(time.perf_counter() - started, 1),
+        },
+        'results': results.entries,
+    }
+
+
+def _key(entry: Dict) -> str:
+    return f"{entry['subsystem']}/{entry['name']}/{json.dumps(entry['params'], sort_keys=True, ensure_ascii=False)}"
+
+
+def compare(current: Dict, baseline: Dict, threshold: float) -> List[Dict]:
+    """
+    与基线对比中位数耗时
+
+    Returns:
+        变慢超过阈值的项目
+    """
+    previous = {_key(entry): entry for entry in baseline.get('results', [])}
+    regressions = []
+    for entry in current['results']:
+        old = previous.get(_key(entry))
+        if not old or not old['p50_ms'] or entry['rounds'] < 3:
+            continue
+        ratio = entry['p50_ms'] / old['p50_ms']
+        if ratio > 1 + threshold:
+            regressions.append({'benchmark': _key(entry), 'baseline_ms': old['p50_ms'],
+                                'current_ms': entry['p50_ms'], 'ratio': round(ratio, 2)})
+    return regressions
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="基准测试")
+    parser.add_argument('--only', help=f"逗号分隔的子系统（{','.join(SUBSYSTEMS)}），默认全部")
+    parser.add_argument('--scale', type=int, default=10000, help="路线和消息数量（问题库为十分之一）")
+    parser.add_argument('--routes', type=int, help="路线数量（覆盖 --scale）")
+    parser.add_argument('--messages', type=int, help="消息数量（覆盖 --scale）")
+    parser.add_argument('--faqs', type=int, help="问题数量（覆盖 --scale）")
+    parser.add_argument('--output', help="结果JSON文件（默认输出到标准输出）")
+    parser.add_argument('--compare', help="基线结果JSON文件")
+    parser.add_argument('--threshold', type=float, default=0.2, help="中位数变慢超过该比例视为退化")
+    args = parser.parse_args(argv)
+
+    subsystems = [name.strip() for name in args.only.split(',')] if args.only else list(SUBSYSTEMS)
+    unknown = set(subsystems) - set(SUBSYSTEMS)
+    if unknown:
+        parser.error(f"未知的子系统：{', '.join(sorted(unknown))}")
+    scale = {
+        'routes': args.routes or args.scale,
+        'messages': args.messages or args.scale,
+        'faqs': args.faqs or max(args.scale // 10, 100),
+    }
+
+    # 进度输出到标准错误，标准输出只有结果JSON
+    with contextlib.redirect_stdout(sys.stderr):
+        report = run(subsystems, scale)
+
+    exit_code = 0
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            report['regressions'] = compare(report, json.load(f), args.threshold)
+        for item in report['regressions']:
+            print(f"变慢：{item['benchmark']} {item['baseline_ms']}ms -> {item['current_ms']}ms（{item['ratio']}倍）",
+                  file=sys.stderr)
+        exit_code = 1 if report['regressions'] else 0
+
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text)
+        print(f"结果已保存：{args.output}", file=sys.stderr)
+    else:
+        print(text)
+    return exit_code
+
+
+if __name__ == '__main__':
+    sys.exit(main())
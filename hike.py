@@ -0,0 +1,475 @@
+"""
+徒步活动组织命令行工具
+不打开页面完成爬取路线、导入路线、生成投票选项、生成海报和群发消息；
+organize --batch 读取活动清单，多个活动由线程池并发处理（同城同月的投票选项只查询一次天气）
+
+    python hike.py crawl --location 苏州
+    python hike.py ingest routes.json
+    python hike.py vote-options --location 上海 --year 2026 --month 11
+    python hike.py poster --route-id 3 --year 2026 --month 11
+    python hike.py broadcast --activity-id 12 --webhook https://qyapi.weixin.qq.com/...
+    python hike.py organize --location 苏州 --broadcast
+    python hike.py organize --batch week.json --workers 4
+"""
+
+import argparse
+import csv
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from dateutil.relativedelta import relativedelta
+
+from utils import lifecycle, tracing
+from utils.activity_jobs import JOB_CLOSE_VOTE
+from utils.database import Database
+from utils.lazy import LazyTools
+from utils.message_templates import encode_content
+from utils.vote_server import vote_url_for
+
+NUMERIC_FIELDS = ('distance', 'elevation', 'duration', 'hot_score')
+# 未指定城市且无法从路线判断时使用的城市
+DEFAULT_LOCATION = '苏州'
+
+
+def _make_crawler():
+    from utils.crawler import TwoBuluCrawler
+    return TwoBuluCrawler()
+
+
+def _make_poster():
+    from utils.poster import PosterGenerator
+    return PosterGenerator()
+
+
+def _make_weather():
+    from utils.weather import WeatherAPI
+    return WeatherAPI(api_key=os.getenv('WEATHER_API_KEY', ''))
+
+
+def _make_wechat():
+    from utils.wechat import WeChatBot
+    return WeChatBot(webhook_url=os.getenv('WECHAT_WEBHOOK_URL', ''))
+
+
+def _print_json(data):
+    print(json.dumps(data, ensure_ascii=False, default=str))
+
+
+class Pipeline:
+    """组织流程（各步骤可单独调用，线程安全，可被批量任务并发使用）"""
+
+    def __init__(self, db: Database, vote_base_url: str = None, vote_options_ttl: float = None):
+        """
+        Args:
+            db: 数据库
+            vote_base_url: 投票服务地址
+            vote_options_ttl: 投票选项（天气）的缓存时间（秒），为空时一直有效（命令行一次运行）
+        """
+        self.db = db
+        self.vote_base_url = vote_base_url or os.getenv('VOTE_BASE_URL', 'http://localhost:8082')
+        self.vote_options_ttl = vote_options_ttl
+        # 只构造用到的工具（如只导入路线时不加载PIL）
+        self.tools = LazyTools({
+            'crawler': _make_crawler,
+            'poster': _make_poster,
+            'weather': _make_weather,
+            'wechat': _make_wechat,
+            'recommender': self._make_recommender,
+        })
+        self._lock = threading.Lock()
+        self._vote_options: Dict[Tuple[str, int, int], Tuple[float, Future]] = {}
+        self._claimed_routes = set()
+
+    def _make_recommender(self):
+        from utils.recommender import RouteRecommender
+        return RouteRecommender(self.db)
+
+    def crawl(self, location: str) -> Dict:
+        """爬取路线并保存（跳过已有路线）"""
+        routes = self.tools['crawler'].get_route_list(location=location)
+        return {'location': location, 'fetched': len(routes), **self.ingest(routes)}
+
+    def ingest(self, routes: List[Dict]) -> Dict:
+        """批量导入路线（按名称和地点去重）"""
+        existing = self.db.get_route_names()
+        new_routes = []
+        for route in routes:
+            key = (route['name'], route.get('location'))
+            if key not in existing:
+                existing.add(key)
+                new_routes.append(route)
+        self.db.insert_routes(new_routes)
+        return {'inserted': len(new_routes), 'skipped': len(routes) - len(new_routes)}
+
+    def vote_options(self, location: str, year: int, month: int) -> List[Dict]:
+        """投票选项（同一城市同一月份只查询一次天气，并发请求等待同一次查询）"""
+        key = (location, year, month)
+        with self._lock:
+            created, future = self._vote_options.get(key, (0.0, None))
+            # 查询失败或缓存过期时重新查询
+            owner = (future is None
+                     or (future.done() and future.exception() is not None)
+                     or (self.vote_options_ttl is not None and time.monotonic() - created > self.vote_options_ttl))
+            if owner:
+                future = Future()
+                self._vote_options[key] = (time.monotonic(), future)
+        if owner:
+            try:
+                future.set_result(self.tools['weather'].generate_vote_options(year, month, location))
+            except Exception as e:
+                future.set_exception(e)
+        return future.result()
+
+    def pick_route(self, location: str, month: int, exclude_recent: int = 3) -> Optional[Dict]:
+        """推荐一条路线（同一批次中不重复）"""
+        candidates = self.tools['recommender'].recommend(
+            k=10, location=location, month=month, exclude_recent=exclude_recent
+        )
+        with self._lock:
+            for route in candidates:
+                if route['id'] not in self._claimed_routes:
+                    self._claimed_routes.add(route['id'])
+                    return route
+        return None
+
+    def _background(self, image: Optional[str], theme: str):
+        """背景图：本地文件、图片URL，未指定时按主题词搜索第一张"""
+        poster = self.tools['poster']
+        if image and os.path.isfile(image):
+            with open(image, 'rb') as f:
+                key = poster.image_store.put_upload(f.read())
+            return poster.load_background({'key': key}) if key else None
+        if not image:
+            images = poster.search_images(theme, count=1)
+            image = images[0] if images else None
+        return poster.load_background({'url': image}) if image else None
+
+    def create_activity(self, route: Dict, year: int, month: int, deadline: datetime = None,
+                        vote_options: List[Dict] = None) -> Dict:
+        """
+        创建投票中的活动，投票截止任务写入数据库（由 python -m utils.activity_jobs 执行）
+
+        Args:
+            route: 路线
+            year: 投票年份
+            month: 投票月份
+            deadline: 投票截止时间（默认5天后）
+            vote_options: 投票选项（默认按路线城市生成）
+
+        Returns:
+            活动信息
+        """
+        deadline = deadline or datetime.now() + timedelta(days=5)
+        vote_options = vote_options or self.vote_options(_city(route.get('location')), year, month)
+
+        activity_id = self.db.insert_activity({
+            'route_id': route['id'],
+            'name': f"{route['name']} - {year}年{month}月",
+            'status': lifecycle.VOTING,
+            'vote_deadline': deadline,
+            'vote_month': f"{year}-{month}",
+        })
+        self.db.insert_vote_options(activity_id, vote_options)
+        vote_url = vote_url_for(self.vote_base_url, activity_id)
+        self.db.update_activity(activity_id, {'vote_url': vote_url})
+        self.db.schedule_job(JOB_CLOSE_VOTE, activity_id, deadline.timestamp())
+        return {
+            'activity_id': activity_id,
+            'route': route['name'],
+            'vote_url': vote_url,
+            'vote_deadline': deadline.strftime('%Y-%m-%d %H:%M'),
+        }
+
+    def render_poster(self, activity_id: int, theme: str = None, image: str = None) -> Dict:
+        """
+        为活动生成（或重新生成）海报
+
+        Args:
+            activity_id: 活动ID
+            theme: 主题词（默认取生成的第一个）
+            image: 背景图（本地路径或URL，默认按主题词搜索）
+
+        Returns:
+            海报信息
+        """
+        activity = self.db.get_activity(activity_id)
+        if not activity:
+            raise ValueError(f"活动不存在：{activity_id}")
+        route = self.db.get_route_by_id(activity['route_id']) if activity['route_id'] else None
+        if not route:
+            raise ValueError(f"活动 #{activity_id} 的路线不存在")
+        vote_options = [{'date': option['vote_date'], 'weather': option['weather']}
+                        for option in self.db.get_vote_options(activity_id)]
+        vote_url = activity['vote_url'] or vote_url_for(self.vote_base_url, activity_id)
+
+        poster = self.tools['poster']
+        theme = theme or poster.generate_themes(route)[0]
+        background = self._background(image, theme)
+        if background is None:
+            raise ValueError(f"背景图片获取失败：{image or theme}")
+
+        poster_path = poster.generate_poster(route, theme, background, vote_url, vote_options)
+        self.db.update_activity(activity_id, {'poster_url': poster_path, 'vote_url': vote_url})
+        return {'activity_id': activity_id, 'theme': theme, 'poster_path': poster_path, 'vote_url': vote_url}
+
+    def create_poster(self, route: Dict, year: int, month: int, theme: str = None, image: str = None,
+                      deadline: datetime = None, vote_options: List[Dict] = None) -> Dict:
+        """
+        创建投票中的活动并生成海报（海报生成失败时取消活动）
+
+        Args:
+            route: 路线
+            year: 投票年份
+            month: 投票月份
+            theme: 主题词（默认取生成的第一个）
+            image: 背景图（本地路径或URL，默认按主题词搜索）
+            deadline: 投票截止时间（默认5天后）
+            vote_options: 投票选项（默认按路线城市生成）
+
+        Returns:
+            活动信息
+        """
+        result = self.create_activity(route, year, month, deadline, vote_options)
+        activity_id = result['activity_id']
+        try:
+            result.update(self.render_poster(activity_id, theme, image))
+        except Exception:
+            # 海报生成失败时取消刚创建的活动，避免留下没有海报的投票
+            lifecycle.transition(self.db, activity_id, lifecycle.CANCELLED)
+            self.db.cancel_jobs(activity_id)
+            raise
+        return result
+
+    def broadcast(self, activity_id: int, webhooks: List[str] = None, message: str = None) -> Dict:
+        """
+        发布活动海报和投票链接（或指定的消息）到多个群
+
+        Args:
+            activity_id: 活动ID
+            webhooks: 群机器人地址（默认为环境变量 WECHAT_WEBHOOK_URL）
+            message: 自定义Markdown消息，为空时发送海报和投票链接
+
+        Returns:
+            每个群的发送结果
+        """
+        activity = self.db.get_activity(activity_id)
+        if not activity:
+            raise ValueError(f"活动不存在：{activity_id}")
+        bot = self.tools['wechat']
+        targets = webhooks or [bot.webhook_url]
+        if message:
+            report = bot.broadcast(targets, [encode_content(message)])
+        else:
+            if not activity['poster_url']:
+                raise ValueError(f"活动 #{activity_id} 还没有海报")
+            # 投票结果等后续消息发往第一个群
+            self.db.update_activity(activity_id, {'webhook_url': targets[0]})
+            report = bot.broadcast_poster_with_qrcode(targets, activity['poster_url'], activity['vote_url'])
+        return {
+            'activity_id': activity_id,
+            'sent': sum(1 for r in report.values() if r['success']),
+            'failed': {target: r['errmsg'] for target, r in report.items() if not r['success']},
+        }
+
+    def organize(self, spec: Dict) -> Dict:
+        """
+        按清单完成一个活动：选路线、生成投票选项和海报，可选发布到群
+
+        Args:
+            spec: year、month，可选 location（默认按路线所在城市，推荐路线时默认苏州）、route_id、theme、image、
+                deadline、webhooks、broadcast
+
+        Returns:
+            活动信息
+        """
+        year, month = spec['year'], spec['month']
+        with tracing.trace('组织活动', location=spec.get('location') or '', month=f"{year}-{month:02d}"):
+            if spec.get('route_id'):
+                route = self.db.get_route_by_id(spec['route_id'])
+                if not route:
+                    raise ValueError(f"路线不存在：{spec['route_id']}")
+            else:
+                pick_location = spec.get('location') or DEFAULT_LOCATION
+                route = self.pick_route(pick_location, month, spec.get('exclude_recent', 3))
+                if not route:
+                    raise ValueError(f"没有可推荐的路线：{pick_location}")
+
+            location = spec.get('location') or _city(route.get('location'))
+            deadline = _parse_deadline(spec.get('deadline'))
+            result = self.create_poster(route, year, month, spec.get('theme'), spec.get('image'), deadline,
+                                        self.vote_options(location, year, month))
+            if spec.get('broadcast') or spec.get('webhooks'):
+                result['broadcast'] = self.broadcast(result['activity_id'], spec.get('webhooks'))
+            return result
+
+
+# 组织活动链路中的各步骤
+tracing.trace_methods(
+    Pipeline, 'pipeline',
+    methods=('pick_route', 'vote_options', 'create_activity', 'render_poster', 'broadcast'),
+)
+
+
+def _city(location: Optional[str]) -> str:
+    """路线地点所属城市（用于查询天气）"""
+    for city in ('上海', '苏州'):
+        if location and city in location:
+            return city
+    return location or DEFAULT_LOCATION
+
+
+def _parse_deadline(value) -> Optional[datetime]:
+    """截止时间：时间字符串或天数（带时区的时间转为本地时间）"""
+    if value is None or value == '':
+        return None
+    if isinstance(value, (int, float)):
+        return datetime.now() + timedelta(days=value)
+    deadline = datetime.fromisoformat(str(value))
+    if deadline.tzinfo is not None:
+        deadline = deadline.astimezone().replace(tzinfo=None)
+    return deadline
+
+
+def _default_month() -> Tuple[int, int]:
+    next_month = datetime.now() + relativedelta(months=1)
+    return next_month.year, next_month.month
+
+
+def load_routes_file(path: str) -> List[Dict]:
+    """读取路线文件（JSON数组、每行一个JSON或CSV）"""
+    with open(path, encoding='utf-8') as f:
+        if path.endswith('.csv'):
+            routes = [dict(row) for row in csv.DictReader(f)]
+        else:
+            text = f.read().strip()
+            if text.startswith('['):
+                routes = json.loads(text)
+            else:
+                routes = [json.loads(line) for line in text.splitlines() if line.strip()]
+
+    for route in routes:
+        if not route.get('name'):
+            raise ValueError(f"路线缺少名称：{route}")
+        for field in NUMERIC_FIELDS:
+            if route.get(field) not in (None, ''):
+                route[field] = float(route[field])
+            else:
+                route[field] = None
+    return routes
+
+
+def load_batch(path: str, defaults: Dict) -> List[Dict]:
+    """读取活动清单（JSON数组或 {"activities": [...]}），未填写的字段使用命令行默认值"""
+    with open(path, encoding='utf-8') as f:
+        data = json.load(f)
+    specs = data.get('activities', []) if isinstance(data, dict) else data
+    return [dict(defaults, **spec) for spec in specs]
+
+
+def run_batch(pipeline: Pipeline, specs: List[Dict], workers: int) -> int:
+    """并发处理多个活动，逐个输出结果，返回失败数量"""
+    failed = 0
+    with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="organize") as executor:
+        futures = {executor.submit(pipeline.organize, spec): i for i, spec in enumerate(specs)}
+        for future in as_completed(futures):
+            index = futures[future]
+            try:
+                _print_json({'index': index, 'ok': True, **future.result()})
+            except Exception as e:
+                failed += 1
+                _print_json({'index': index, 'ok': False, 'error': f"{type(e).__name__}: {e}"})
+    return failed
+
+
+def build_parser() -> argparse.ArgumentParser:
+    year, month = _default_month()
+    parser = argparse.ArgumentParser(prog='hike', description="徒步活动组织命令行工具")
+    parser.add_argument('--db', default=os.getenv('HIKE_DB_PATH', 'data/hike.db'), help="数据库路径")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    crawl = sub.add_parser('crawl', help="爬取路线并保存")
+    crawl.add_argument('--location', action='append', help="城市（可重复），默认苏州和上海")
+
+    ingest = sub.add_parser('ingest', help="从文件导入路线（JSON/JSONL/CSV）")
+    ingest.add_argument('path')
+
+    options = sub.add_parser('vote-options', help="生成投票选项（周末日期和天气）")
+    options.add_argument('--location', default='苏州')
+    options.add_argument('--year', type=int, default=year)
+    options.add_argument('--month', type=int, default=month)
+
+    poster = sub.add_parser('poster', help="创建投票活动并生成海报")
+    poster.add_argument('--route-id', type=int, required=True)
+    poster.add_argument('--year', type=int, default=year)
+    poster.add_argument('--month', type=int, default=month)
+    poster.add_argument('--theme', help="主题词（默认自动生成）")
+    poster.add_argument('--image', help="背景图（本地路径或URL，默认按主题词搜索）")
+    poster.add_argument('--deadline', help="投票截止时间（如 2026-11-01T20:00，默认5天后）")
+
+    broadcast = sub.add_parser('broadcast', help="发布海报和投票链接到群")
+    broadcast.add_argument('--activity-id', type=int, required=True)
+    broadcast.add_argument('--webhook', action='append', help="群机器人地址（可重复），默认 WECHAT_WEBHOOK_URL")
+    broadcast.add_argument('--message', help="发送自定义Markdown消息代替海报")
+
+    organize = sub.add_parser('organize', help="完成整个组织流程（单个活动或 --batch 清单）")
+    organize.add_argument('--batch', help="活动清单JSON文件")
+    organize.add_argument('--workers', type=int, default=4, help="并发处理的活动数")
+    organize.add_argument('--location', help="城市，默认为路线所在城市（推荐路线时默认苏州）")
+    organize.add_argument('--year', type=int, default=year)
+    organize.add_argument('--month', type=int, default=month)
+    organize.add_argument('--route-id', type=int)
+    organize.add_argument('--theme')
+    organize.add_argument('--image')
+    organize.add_argument('--deadline')
+    organize.add_argument('--webhook', action='append')
+    organize.add_argument('--broadcast', action='store_true', help="生成后发布到群")
+    return parser
+
+
+def main(argv: List[str] = None) -> int:
+    args = build_parser().parse_args(argv)
+    db = Database(args.db)
+    pipeline = Pipeline(db)
+    started = time.perf_counter()
+
+    try:
+        if args.command == 'crawl':
+            for location in args.location or ['苏州', '上海']:
+                _print_json(pipeline.crawl(location))
+        elif args.command == 'ingest':
+            _print_json(pipeline.ingest(load_routes_file(args.path)))
+        elif args.command == 'vote-options':
+            _print_json(pipeline.vote_options(args.location, args.year, args.month))
+        elif args.command == 'poster':
+            route = db.get_route_by_id(args.route_id)
+            if not route:
+                raise ValueError(f"路线不存在：{args.route_id}")
+            _print_json(pipeline.create_poster(route, args.year, args.month, args.theme, args.image,
+                                               _parse_deadline(args.deadline)))
+        elif args.command == 'broadcast':
+            _print_json(pipeline.broadcast(args.activity_id, args.webhook, args.message))
+        elif args.command == 'organize':
+            defaults = {
+                'location': args.location, 'year': args.year, 'month': args.month,
+                'route_id': args.route_id, 'theme': args.theme, 'image': args.image,
+                'deadline': args.deadline, 'webhooks': args.webhook, 'broadcast': args.broadcast,
+            }
+            specs = load_batch(args.batch, defaults) if args.batch else [defaults]
+            failed = run_batch(pipeline, specs, args.workers)
+            print(f"完成 {len(specs) - failed}/{len(specs)} 个活动，用时 {time.perf_counter() - started:.1f}秒",
+                  file=sys.stderr)
+            return 1 if failed else 0
+    except (ValueError, OSError) as e:
+        print(f"执行失败：{e}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,267 @@
+"""
+活动定时任务
+投票截止时自动选出活动日期、更新活动状态并通过发件箱发送投票结果；
+活动确定日期后安排提醒：活动前3天上午发天气提醒、前一天晚上发集合提醒，活动次日标记为已结束。
+可单独运行，不依赖页面会话：
+    python -m utils.activity_jobs
+"""
+
+import os
+import signal
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional, Union
+
+from utils import lifecycle
+from utils.asset_store import AssetCompactor, AssetStore
+from utils.database import Database
+from utils.dispatcher import OutboxDispatcher
+from utils.scheduler import JobScheduler
+from utils.weather import WeatherAPI
+from utils.wechat import WeChatBot
+
+JOB_CLOSE_VOTE = 'close_vote'
+JOB_WEATHER_REMINDER = 'reminder_weather'
+JOB_MEETING_REMINDER = 'reminder_meeting'
+JOB_COMPLETE = 'complete'
+
+REMINDER_JOBS = [JOB_WEATHER_REMINDER, JOB_MEETING_REMINDER, JOB_COMPLETE]
+
+# 提醒时间：（活动前天数，时，分）
+WEATHER_REMINDER_AT = (3, 9, 0)
+MEETING_REMINDER_AT = (1, 20, 0)
+
+
+def _timestamp(value) -> Optional[float]:
+    """数据库中的时间（datetime或字符串）转为时间戳"""
+    if not value:
+        return None
+    if isinstance(value, datetime):
+        return value.timestamp()
+    return datetime.fromisoformat(str(value)).timestamp()
+
+
+def _activity_day(value) -> Optional[datetime]:
+    """活动日期（如 2024-05-18 或 2024-05-18（周六））转为当天零点"""
+    if not value:
+        return None
+    return datetime.strptime(str(value).split('（')[0].strip()[:10], '%Y-%m-%d')
+
+
+def _reminder_time(day: datetime, at) -> float:
+    """活动前若干天的指定时刻"""
+    days_before, hour, minute = at
+    return (day - timedelta(days=days_before)).replace(hour=hour, minute=minute).timestamp()
+
+
+class ActivityJobs:
+    """活动定时任务"""
+
+    def __init__(self, db: Database, scheduler: JobScheduler, wechat_bot: Union[WeChatBot, Callable[[], WeChatBot]],
+                 dispatcher: Optional[OutboxDispatcher] = None,
+                 weather: Union[WeatherAPI, Callable[[], WeatherAPI], None] = None):
+        """
+        Args:
+            db: 数据库
+            scheduler: 定时任务调度器
+            wechat_bot: 默认机器人（活动未记录webhook时使用），也可以是第一次使用时才调用的构造函数
+            dispatcher: 发件箱投递器，写入消息后唤醒
+            weather: 天气API，天气提醒时查询最新预报，也可以是构造函数
+        """
+        self.db = db
+        self.scheduler = scheduler
+        self._wechat_bot = wechat_bot
+        self.dispatcher = dispatcher
+        self._weather = weather
+        scheduler.register(JOB_CLOSE_VOTE, self.close_vote)
+        scheduler.register(JOB_WEATHER_REMINDER, self.weather_reminder)
+        scheduler.register(JOB_MEETING_REMINDER, self.meeting_reminder)
+        scheduler.register(JOB_COMPLETE, self.complete)
+
+    @property
+    def wechat_bot(self) -> WeChatBot:
+        if callable(self._wechat_bot):
+            self._wechat_bot = self._wechat_bot()
+        return self._wechat_bot
+
+    @property
+    def weather(self) -> Optional[WeatherAPI]:
+        if callable(self._weather):
+            self._weather = self._weather()
+        return self._weather
+
+    def _bot_for(self, activity: Dict) -> WeChatBot:
+        """活动对应的机器人"""
+        if activity.get('webhook_url'):
+            return self.wechat_bot.for_webhook(activity['webhook_url'])
+        return self.wechat_bot
+
+    def schedule_vote_close(self, activity_id: int, deadline) -> int:
+        """
+        安排投票截止任务
+
+        Args:
+            activity_id: 活动ID
+            deadline: 截止时间（datetime、时间字符串或时间戳）
+        """
+        run_at = deadline if isinstance(deadline, (int, float)) else _timestamp(deadline)
+        return self.scheduler.schedule(JOB_CLOSE_VOTE, activity_id, run_at)
+
+    def schedule_reminders(self, activity_id: int, activity_date, now: float = None):
+        """
+        按活动日期安排提醒和结束任务（活动改期时重新调用即可更新执行时间）
+
+        Args:
+            activity_id: 活动ID
+            activity_date: 活动日期
+            now: 当前时间戳（默认为当前时间）
+        """
+        day = _activity_day(activity_date)
+        if day is None:
+            return
+        now = time.time() if now is None else now
+        date = day.strftime('%Y-%m-%d')
+        payload = {'activity_date': date}
+
+        # 天气提醒已错过就不再发送；集合提醒在活动开始前都还有意义，错过时立即发送
+        weather_at = _reminder_time(day, WEATHER_REMINDER_AT)
+        if weather_at > now:
+            self.scheduler.schedule(JOB_WEATHER_REMINDER, activity_id, weather_at, payload)
+        if day.timestamp() > now:
+            meeting_at = max(_reminder_time(day, MEETING_REMINDER_AT), now)
+            self.scheduler.schedule(JOB_MEETING_REMINDER, activity_id, meeting_at, payload)
+        self.scheduler.schedule(JOB_COMPLETE, activity_id, (day + timedelta(days=1)).timestamp(), payload)
+
+    def cancel_reminders(self, activity_id: int):
+        """取消活动的提醒和结束任务"""
+        self.scheduler.cancel(activity_id, REMINDER_JOBS)
+
+    def backfill(self):
+        """为缺少任务的活动补充任务（如升级前创建的活动）"""
+        for activity in self.db.get_activities_by_status(lifecycle.VOTING):
+            if not activity['vote_deadline']:
+                continue
+            if any(job['job_type'] == JOB_CLOSE_VOTE for job in self.db.get_jobs(activity['id'])):
+                continue
+            self.schedule_vote_close(activity['id'], activity['vote_deadline'])
+
+        for status in lifecycle.ACTIVE_STATUSES:
+            for activity in self.db.get_activities_by_status(status):
+                job_types = {job['job_type'] for job in self.db.get_jobs(activity['id'])}
+                if activity['activity_date'] and JOB_COMPLETE not in job_types:
+                    self.schedule_reminders(activity['id'], activity['activity_date'])
+
+    def close_vote(self, job: Dict):
+        """投票截止：选出日期，活动进入招募阶段，投票结果与状态更新在同一事务中写入发件箱"""
+        activity_id = job['activity_id']
+        activity = self.db.get_activity(activity_id)
+        if not activity:
+            return
+        bot = self._bot_for(activity)
+
+        def result_messages(winner: Dict) -> List[Dict]:
+            if not bot.webhook_url:
+                return []
+            content = bot.vote_result_message(winner['vote_date'], winner['weather'] or '暂无数据')
+            return bot.outbox_messages(content, 'vote_result:{activity_id}')
+
+        winner = self.db.close_vote(activity_id, result_messages)
+        if winner is None:
+            return
+        print(f"活动 #{activity_id} 投票截止，选定日期：{winner['vote_date']}（{winner['vote_count']}票）")
+        self.schedule_reminders(activity_id, winner['vote_date'])
+        self._wake()
+
+    def _reminder_target(self, job: Dict) -> Optional[Dict]:
+        """提醒对应的活动：已取消、已结束或已改期的活动返回None"""
+        activity = self.db.get_activity(job['activity_id'])
+        if not activity or activity['status'] not in lifecycle.ACTIVE_STATUSES:
+            return None
+        day = _activity_day(activity['activity_date'])
+        if day is None or day.strftime('%Y-%m-%d') != job['payload'].get('activity_date'):
+            return None
+        return activity
+
+    def _enqueue(self, activity: Dict, content: str, key: str):
+        """提醒写入发件箱（幂等键包含活动日期，改期后会重新提醒）"""
+        bot = self._bot_for(activity)
+        if not bot.webhook_url:
+            return
+        for message in bot.outbox_messages(content, key):
+            self.db.enqueue_outbox(activity_id=activity['id'], **message)
+        self._wake()
+
+    def weather_reminder(self, job: Dict):
+        """活动前天气提醒"""
+        activity = self._reminder_target(job)
+        if activity is None:
+            return
+        date = job['payload']['activity_date']
+        route = self.db.get_route_by_id(activity['route_id']) if activity['route_id'] else None
+        location = (route or {}).get('location') or '苏州'
+        weather = self.weather.get_weather(date, location) if self.weather else '天气暂无数据'
+        content = self._bot_for(activity).weather_reminder_message(date, location, weather)
+        self._enqueue(activity, content, f'reminder_weather:{{activity_id}}:{date}')
+
+    def meeting_reminder(self, job: Dict):
+        """活动前一天晚上的集合提醒"""
+        activity = self._reminder_target(job)
+        if activity is None:
+            return
+        date = job['payload']['activity_date']
+        route = self.db.get_route_by_id(activity['route_id']) if activity['route_id'] else None
+        content = self._bot_for(activity).meeting_reminder_message(date, activity, route or {})
+        self._enqueue(activity, content, f'reminder_meeting:{{activity_id}}:{date}')
+
+    def complete(self, job: Dict):
+        """活动日期已过：已成团的活动标记为已结束，仍在招募（未成团）的活动取消"""
+        activity = self._reminder_target(job)
+        if activity is None:
+            return
+        activity_id = job['activity_id']
+        if activity['status'] == lifecycle.RECRUITING:
+            # 只从招募中取消，同时成团的活动不受影响，由下面标记为已结束
+            if self.db.transition_activity(activity_id, [lifecycle.RECRUITING], lifecycle.CANCELLED):
+                print(f"活动 #{activity_id} 到期未成团，已取消")
+                return
+        try:
+            lifecycle.transition(self.db, activity_id, lifecycle.DONE)
+            print(f"活动 #{activity_id} 已结束")
+        except lifecycle.InvalidTransition as e:
+            print(f"活动未标记为已结束：{e}")
+
+    def _wake(self):
+        if self.dispatcher is not None:
+            self.dispatcher.wake()
+
+
+def main():
+    """后台运行定时任务、发件箱投递和资源文件整理（无需打开页面）"""
+    db = Database(os.getenv('HIKE_DB_PATH', 'data/hike.db'))
+    dispatcher = OutboxDispatcher(db)
+    scheduler = JobScheduler(db)
+    jobs = ActivityJobs(db, scheduler, WeChatBot(webhook_url=os.getenv('WECHAT_WEBHOOK_URL', '')), dispatcher,
+                        WeatherAPI(api_key=os.getenv('WEATHER_API_KEY')))
+    jobs.backfill()
+
+    compactor = AssetCompactor(db, AssetStore())
+
+    dispatcher.start()
+    scheduler.start()
+    compactor.start()
+    print("定时任务已启动")
+
+    stopped = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stopped.set())
+    try:
+        stopped.wait()
+    except KeyboardInterrupt:
+        pass
+    compactor.stop()
+    scheduler.stop()
+    dispatcher.stop()
+
+
+if __name__ == '__main__':
+    main()
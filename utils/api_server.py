@@ -0,0 +1,543 @@
+"""
+API服务
+组织流程的JSON接口，与页面和命令行共用 Database、WeatherAPI、PosterGenerator、WeChatBot（见 hike.Pipeline）：
+
+    GET   /api/routes?location=&max_distance=&max_elevation=&max_duration=&limit=&offset=
+    GET   /api/routes/search?q=关键词（其他参数同上）
+    GET   /api/routes/{路线ID}
+    GET   /api/vote-options?location=苏州&year=2026&month=11
+    POST  /api/activities                    {"route_id", "year", "month", "deadline"}
+    GET   /api/activities/{活动ID}
+    PATCH /api/activities/{活动ID}             {"name", "vote_deadline", "webhook_url", "meeting_time", "meeting_place", "status": "cancelled"}
+    POST  /api/activities/{活动ID}/poster      {"theme", "image"}
+    POST  /api/activities/{活动ID}/broadcast   {"webhooks", "message"}
+
+读接口返回 ETag 和 Cache-Control，请求带 If-None-Match 且内容未变化时返回 304；
+路线接口的 ETag 由路线版本和查询参数得出，路线未变化时直接使用缓存的响应，不查询数据库
+
+POST/PATCH 需要请求头 Authorization: Bearer <HIKE_API_TOKEN>，未配置令牌时写接口关闭；
+群机器人地址只接受企业微信域名或服务端配置的地址，背景图只接受 http(s) 图片URL
+
+运行（默认只监听本机）：
+    HIKE_API_TOKEN=... python -m utils.api_server --port 8083
+压测（临时数据库，单进程服务）：
+    python -m utils.api_server --bench 5000 --concurrency 50
+"""
+
+import argparse
+import asyncio
+import hashlib
+import hmac
+import json
+import os
+import random
+import signal
+import tempfile
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import quote, urlsplit
+
+from utils import lifecycle
+from utils.activity_jobs import JOB_CLOSE_VOTE
+from utils.async_http import AsyncHTTPClient, AsyncHTTPServer, Request, Response, metrics_handler, wait_for_server
+from utils.catalogue import RouteCatalogueCache
+from utils.database import Database
+
+# 列表接口每页最多返回的路线数
+MAX_PAGE_SIZE = 100
+
+# 可通过 PATCH 修改的活动字段
+PATCH_FIELDS = ('name', 'vote_deadline', 'group_chat_id', 'webhook_url', 'meeting_time', 'meeting_place')
+
+ROUTES_CACHE_CONTROL = 'public, max-age=60'
+VOTE_OPTIONS_CACHE_CONTROL = 'public, max-age=3600'
+# 活动和票数随时变化，客户端每次用ETag向服务端确认
+ACTIVITY_CACHE_CONTROL = 'no-cache'
+
+# 企业微信群机器人的域名
+WECOM_HOST = 'qyapi.weixin.qq.com'
+
+
+def _etag(data: bytes) -> str:
+    return f'"{hashlib.blake2b(data, digest_size=8).hexdigest()}"'
+
+
+def _not_modified(request: Request, etag: str) -> bool:
+    """客户端缓存的ETag是否仍然有效"""
+    candidates = request.headers.get('if-none-match', '')
+    return etag in (tag.strip() for tag in candidates.split(',')) or candidates.strip() == '*'
+
+
+def _conditions(request: Request) -> Dict:
+    """路线筛选条件（默认值与 Database.get_routes 一致）"""
+    return {
+        'location': request.query.get('location') or None,
+        'max_distance': float(request.query.get('max_distance', 15)),
+        'max_elevation': float(request.query.get('max_elevation', 800)),
+        'max_duration': float(request.query.get('max_duration', 6)),
+    }
+
+
+def _check_webhook(url, configured: set) -> str:
+    """群机器人地址只能是企业微信域名下的https地址或服务端配置的地址，否则抛出ValueError"""
+    if not isinstance(url, str) or not url:
+        raise ValueError(f"群机器人地址无效：{url}")
+    if url in configured:
+        return url
+    parts = urlsplit(url)
+    if parts.scheme != 'https' or parts.hostname != WECOM_HOST:
+        raise ValueError(f"只能发送到企业微信群机器人：{url}")
+    return url
+
+
+def _check_image_url(image) -> Optional[str]:
+    """接口调用方只能指定 http(s) 图片URL（本地路径仅限命令行）"""
+    if image is None or image == '':
+        return None
+    if not isinstance(image, str) or urlsplit(image).scheme not in ('http', 'https'):
+        raise ValueError(f"背景图只能是 http(s) 图片URL：{image}")
+    return image
+
+
+def _json_object(request: Request) -> Dict:
+    """请求体中的JSON对象（没有请求体时为空字典，其他类型的JSON按参数错误处理）"""
+    data = request.json()
+    if data is None:
+        return {}
+    if not isinstance(data, dict):
+        raise ValueError("请求体应为JSON对象")
+    return data
+
+
+def _parse_deadline(value) -> datetime:
+    """截止时间（ISO格式字符串；带时区时转为本地时间，与数据库中的其他时间一致）"""
+    if not isinstance(value, str):
+        raise ValueError(f"截止时间应为ISO格式字符串：{value}")
+    deadline = datetime.fromisoformat(value)
+    if deadline.tzinfo is not None:
+        deadline = deadline.astimezone().replace(tzinfo=None)
+    return deadline
+
+
+def _page(request: Request) -> Tuple[int, int]:
+    limit = min(max(int(request.query.get('limit', 20)), 1), MAX_PAGE_SIZE)
+    offset = max(int(request.query.get('offset', 0)), 0)
+    return limit, offset
+
+
+class ApiServer:
+    """API服务"""
+
+    def __init__(self, db: Database, vote_base_url: str = None, cache_size: int = 512,
+                 token: Optional[str] = None, webhooks: Optional[List[str]] = None):
+        """
+        Args:
+            db: 数据库（建议启用连接池，见 Database 的 pool_size）
+            vote_base_url: 投票服务地址
+            cache_size: 缓存的路线响应数量
+            token: 写接口的访问令牌，默认为环境变量 HIKE_API_TOKEN，为空时写接口关闭
+            webhooks: 允许的其他群机器人地址，默认为环境变量 WECHAT_WEBHOOK_URL
+        """
+        # 延迟导入，避免与 hike 互相依赖；Pipeline 中的工具在第一次使用时才构造
+        from hike import Pipeline
+
+        self.db = db
+        self.token = token if token is not None else os.getenv('HIKE_API_TOKEN', '')
+        if webhooks is None:
+            webhooks = [os.getenv('WECHAT_WEBHOOK_URL', '')]
+        self.webhooks = {url for url in webhooks if url}
+        self.pipeline = Pipeline(db, vote_base_url, vote_options_ttl=3600)
+        self.catalogue = RouteCatalogueCache(db)
+        self._responses: 'OrderedDict[Tuple, Response]' = OrderedDict()
+        self.cache_size = cache_size
+        # 数据库读取与耗时的组织步骤（查天气、画海报、发消息）使用不同线程池，后者不阻塞查询
+        self._read_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="api-reader")
+        self._work_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="api-worker")
+
+        self.http = AsyncHTTPServer()
+        self.http.route('GET', '/api/routes', self.handle_routes)
+        self.http.route('GET', '/api/routes/search', self.handle_search)
+        self.http.route('GET', '/api/routes/', self.handle_route)
+        self.http.route('GET', '/api/vote-options', self.handle_vote_options)
+        self.http.route('POST', '/api/activities', self._authorized(self.handle_create_activity))
+        self.http.route('GET', '/api/activities/', self.handle_activity)
+        self.http.route('PATCH', '/api/activities/', self._authorized(self.handle_update_activity))
+        self.http.route('POST', '/api/activities/', self._authorized(self.handle_activity_action))
+        self.http.route('GET', '/healthz', self.handle_health)
+        self.http.route('GET', '/metrics', metrics_handler)
+
+    def _authorized(self, handler):
+        """写接口：校验 Authorization: Bearer <令牌>"""
+        async def wrapper(request: Request) -> Response:
+            if not self.token:
+                return Response.json({'error': "写接口未启用（未配置 HIKE_API_TOKEN）"}, 403)
+            scheme, _, supplied = request.headers.get('authorization', '').partition(' ')
+            if scheme.lower() != 'bearer' or not hmac.compare_digest(supplied.strip().encode('utf-8'),
+                                                                     self.token.encode('utf-8')):
+                return Response.json({'error': "未授权"}, 401, {'WWW-Authenticate': 'Bearer'})
+            return await handler(request)
+        wrapper.__name__ = handler.__name__
+        return wrapper
+
+    async def _read(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._read_executor, func, *args)
+
+    async def _work(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._work_executor, func, *args)
+
+    # ---------- 缓存 ----------
+
+    async def _cached_routes(self, request: Request, build) -> Response:
+        """
+        路线类接口：以（路线版本, 路径, 查询参数）为键缓存响应，路线写入后版本变化自动失效
+
+        Args:
+            request: 请求
+            build: 生成响应数据的函数（在读线程池中执行）
+        """
+        key = (self.db.routes_version(), request.path, tuple(sorted(request.query.items())))
+        response = self._responses.get(key)
+        if response is None:
+            data = await self._read(build)
+            if data is None:
+                return Response.json({'error': 'not found'}, 404)
+            response = Response.json(data, headers={'Cache-Control': ROUTES_CACHE_CONTROL})
+            response.headers['ETag'] = _etag(response.body)
+            self._responses[key] = response
+            if len(self._responses) > self.cache_size:
+                self._responses.popitem(last=False)
+        else:
+            self._responses.move_to_end(key)
+
+        if _not_modified(request, response.headers['ETag']):
+            return Response(b'', 304, {'ETag': response.headers['ETag'],
+                                       'Cache-Control': ROUTES_CACHE_CONTROL})
+        return response
+
+    @staticmethod
+    def _conditional(request: Request, data, cache_control: str) -> Response:
+        """按响应内容计算ETag，未变化时返回304"""
+        response = Response.json(data, headers={'Cache-Control': cache_control})
+        etag = _etag(response.body)
+        if _not_modified(request, etag):
+            return Response(b'', 304, {'ETag': etag, 'Cache-Control': cache_control})
+        response.headers['ETag'] = etag
+        return response
+
+    # ---------- 路线 ----------
+
+    async def handle_routes(self, request: Request) -> Response:
+        conditions = _conditions(request)
+        limit, offset = _page(request)
+
+        def build():
+            catalogue = self.catalogue.current()
+            positions = catalogue.filter(**conditions)
+            return {
+                'total': len(positions),
+                'routes': [route.to_dict() for route in catalogue.records(positions[offset:offset + limit])],
+            }
+
+        return await self._cached_routes(request, build)
+
+    async def handle_search(self, request: Request) -> Response:
+        keyword = request.query.get('q', '').strip()
+        conditions = _conditions(request)
+        limit, offset = _page(request)
+
+        def build():
+            catalogue = self.catalogue.current()
+            positions = catalogue.search(keyword, **conditions)
+            return {
+                'total': len(positions),
+                'routes': [route.to_dict() for route in catalogue.records(positions[offset:offset + limit])],
+            }
+
+        return await self._cached_routes(request, build)
+
+    async def handle_route(self, request: Request) -> Response:
+        route_id = int(request.path.rstrip('/').rsplit('/', 1)[-1])
+        return await self._cached_routes(request, lambda: self.db.get_route_by_id(route_id))
+
+    # ---------- 投票选项 ----------
+
+    async def handle_vote_options(self, request: Request) -> Response:
+        location = request.query.get('location', '苏州')
+        year, month = int(request.query['year']), int(request.query['month'])
+        if not 1 <= month <= 12:
+            raise ValueError(f"月份无效：{month}")
+        options = await self._work(self.pipeline.vote_options, location, year, month)
+        return self._conditional(request, {'location': location, 'options': options}, VOTE_OPTIONS_CACHE_CONTROL)
+
+    # ---------- 活动 ----------
+
+    @staticmethod
+    def _activity_path(request: Request) -> Tuple[int, Optional[str]]:
+        """解析 /api/activities/{活动ID}[/动作]"""
+        parts = request.path.strip('/').split('/')[2:]
+        if not parts or len(parts) > 2:
+            raise ValueError(f"路径无效：{request.path}")
+        return int(parts[0]), parts[1] if len(parts) == 2 else None
+
+    def _activity_detail(self, activity_id: int) -> Optional[Dict]:
+        activity = self.db.get_activity(activity_id)
+        if not activity:
+            return None
+        activity['status_label'] = lifecycle.STATUS_LABELS.get(activity['status'], activity['status'])
+        activity['tally'] = self.db.get_vote_tally(activity_id)
+        return activity
+
+    async def handle_activity(self, request: Request) -> Response:
+        activity_id, action = self._activity_path(request)
+        if action:
+            return Response.json({'error': 'not found'}, 404)
+        activity = await self._read(self._activity_detail, activity_id)
+        if not activity:
+            return Response.json({'error': f"活动不存在：{activity_id}"}, 404)
+        return self._conditional(request, activity, ACTIVITY_CACHE_CONTROL)
+
+    def _create_activity(self, data: Dict) -> Dict:
+        route = self.db.get_route_by_id(int(data['route_id']))
+        if not route:
+            raise LookupError(f"路线不存在：{data['route_id']}")
+        year, month = int(data['year']), int(data['month'])
+        deadline = _parse_deadline(data['deadline']) if data.get('deadline') else None
+        return self.pipeline.create_activity(route, year, month, deadline, data.get('vote_options'))
+
+    async def handle_create_activity(self, request: Request) -> Response:
+        try:
+            result = await self._work(self._create_activity, _json_object(request))
+        except LookupError as e:
+            return Response.json({'error': str(e)}, 404)
+        return Response.json(result, 201, {'Location': f"/api/activities/{result['activity_id']}"})
+
+    def _update_activity(self, activity_id: int, data: Dict) -> Optional[Dict]:
+        activity = self.db.get_activity(activity_id)
+        if not activity:
+            return None
+        unknown = set(data) - set(PATCH_FIELDS) - {'status'}
+        if unknown:
+            raise ValueError(f"不能修改的字段：{', '.join(sorted(unknown))}")
+
+        update_data = {field: data[field] for field in PATCH_FIELDS if field in data}
+        if update_data.get('webhook_url'):
+            _check_webhook(update_data['webhook_url'], self.webhooks)
+        if 'vote_deadline' in update_data:
+            deadline = _parse_deadline(update_data['vote_deadline'])
+            update_data['vote_deadline'] = deadline
+            if activity['status'] == lifecycle.VOTING:
+                # 调度器在其他进程中运行，几秒内会发现更早的截止时间
+                self.db.schedule_job(JOB_CLOSE_VOTE, activity_id, deadline.timestamp())
+
+        status = data.get('status')
+        if status and status != activity['status']:
+            # 成团需要选定日期并发送欢迎消息，只能在页面中确认；接口只支持取消
+            if status != lifecycle.CANCELLED:
+                raise lifecycle.InvalidTransition(f"接口只能取消活动，不能变为{status}")
+            lifecycle.transition(self.db, activity_id, lifecycle.CANCELLED, update_data or None)
+            self.db.cancel_jobs(activity_id)
+        elif update_data:
+            self.db.update_activity(activity_id, update_data)
+        return self._activity_detail(activity_id)
+
+    async def handle_update_activity(self, request: Request) -> Response:
+        activity_id, action = self._activity_path(request)
+        if action:
+            return Response.json({'error': 'not found'}, 404)
+        try:
+            activity = await self._work(self._update_activity, activity_id, _json_object(request))
+        except lifecycle.InvalidTransition as e:
+            return Response.json({'error': str(e)}, 409)
+        if not activity:
+            return Response.json({'error': f"活动不存在：{activity_id}"}, 404)
+        return Response.json(activity)
+
+    async def handle_activity_action(self, request: Request) -> Response:
+        """POST /api/activities/{活动ID}/poster 生成海报，/broadcast 发布到群"""
+        activity_id, action = self._activity_path(request)
+        data = _json_object(request)
+        if action == 'poster':
+            image = _check_image_url(data.get('image'))
+            result = await self._work(self.pipeline.render_poster, activity_id, data.get('theme'), image)
+        elif action == 'broadcast':
+            webhooks = data.get('webhooks')
+            if webhooks is not None and not isinstance(webhooks, list):
+                raise ValueError("webhooks 应为列表")
+            webhooks = [_check_webhook(url, self.webhooks) for url in webhooks or []]
+            result = await self._work(self.pipeline.broadcast, activity_id, webhooks or None, data.get('message'))
+        else:
+            return Response.json({'error': 'not found'}, 404)
+        return Response.json(result)
+
+    async def handle_health(self, request: Request) -> Response:
+        return Response.json({'status': 'ok'})
+
+    async def serve(self, host: str = '127.0.0.1', port: int = 8083):
+        """启动服务并一直运行"""
+        loop = asyncio.get_running_loop()
+        server = await self.http.start(host, port)
+        try:
+            loop.add_signal_handler(signal.SIGTERM, server.close)
+        except (NotImplementedError, RuntimeError):
+            pass
+        print(f"API服务已启动：http://{host}:{port}/api/routes")
+        if not self.token:
+            print("未配置 HIKE_API_TOKEN，写接口已关闭")
+        try:
+            async with server:
+                await server.serve_forever()
+        except asyncio.CancelledError:
+            pass
+        finally:
+            self._read_executor.shutdown()
+            self._work_executor.shutdown()
+
+
+# ==================== 压测 ====================
+
+def _percentile(sorted_values: List[float], p: float) -> float:
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * p))]
+
+
+async def run_load(base_url: str, paths: List[str], total: int, concurrency: int,
+                   revalidate: bool = False) -> Dict:
+    """
+    按路径列表随机发起GET请求
+
+    Args:
+        base_url: 服务地址
+        paths: 请求路径
+        total: 请求总数
+        concurrency: 并发连接数（每个连接keep-alive复用）
+        revalidate: 是否像浏览器一样保存ETag并带 If-None-Match 请求
+
+    Returns:
+        压测结果（吞吐量、延迟分位数、各状态码数量）
+    """
+    latencies: List[float] = []
+    statuses: Dict[str, int] = {}
+    remaining = [total]
+
+    async def worker(seed: int):
+        rng = random.Random(seed)
+        client = AsyncHTTPClient(timeout=30)
+        etags: Dict[str, str] = {}
+        try:
+            while remaining[0] > 0:
+                remaining[0] -= 1
+                path = rng.choice(paths)
+                headers = {'If-None-Match': etags[path]} if revalidate and path in etags else None
+                start = time.perf_counter()
+                try:
+                    status, resp_headers, _ = await client.request('GET', base_url + path, headers=headers)
+                    if 'etag' in resp_headers:
+                        etags[path] = resp_headers['etag']
+                    key = str(status)
+                except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError):
+                    key = 'error'
+                latencies.append(time.perf_counter() - start)
+                statuses[key] = statuses.get(key, 0) + 1
+        finally:
+            await client.close()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker(i) for i in range(concurrency)))
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        'requests': len(latencies),
+        'concurrency': concurrency,
+        'elapsed': round(elapsed, 3),
+        'throughput': round(len(latencies) / elapsed, 1) if elapsed else 0,
+        'p50_ms': round(_percentile(latencies, 0.50) * 1000, 2),
+        'p99_ms': round(_percentile(latencies, 0.99) * 1000, 2),
+        'statuses': statuses,
+    }
+
+
+def _serve_process(db_path: str, host: str, port: int):
+    try:
+        asyncio.run(ApiServer(Database(db_path, pool_size=8)).serve(host, port))
+    except KeyboardInterrupt:
+        pass
+
+
+def _seed(db: Database, routes: int) -> Tuple[List[int], List[int]]:
+    """写入压测用的路线和活动"""
+    locations = ('苏州吴中', '苏州虎丘', '上海松江', '上海崇明')
+    route_ids = db.insert_routes([
+        {'name': f'压测路线{i}', 'distance': 3 + i % 20, 'elevation': 100 + i % 900, 'duration': 2 + i % 6,
+         'difficulty': ('初级', '中级', '高级')[i % 3], 'hot_score': (i * 7919) % 100 / 10,
+         'tags': ('风景,轻松', '山景,古道', '森林,亲子', '茶文化,风景')[i % 4], 'location': locations[i % 4],
+         'description': '压测数据'}
+        for i in range(routes)
+    ])
+    activity_ids = []
+    for route_id in route_ids[:5]:
+        activity_id = db.insert_activity({
+            'route_id': route_id, 'name': f'压测活动{route_id}', 'status': lifecycle.VOTING,
+            'vote_deadline': datetime.now() + timedelta(days=1),
+        })
+        db.insert_vote_options(activity_id, [{'date': f'2026-11-{day:02d}', 'weather': '晴'} for day in (7, 14)])
+        activity_ids.append(activity_id)
+    return route_ids, activity_ids
+
+
+def bench(total: int, concurrency: int, routes: int = 2000, host: str = '127.0.0.1', port: int = 18083) -> Dict:
+    """使用临时数据库启动单进程服务，压测读接口（首次请求与带ETag的重复请求）"""
+    import multiprocessing
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db = Database(os.path.join(tmp, 'bench.db'))
+        route_ids, activity_ids = _seed(db, routes)
+        paths = [
+            '/api/routes?location=苏州', '/api/routes?location=上海&limit=50', '/api/routes?offset=20',
+            '/api/routes/search?q=古道', '/api/routes/search?q=茶文化&location=苏州',
+        ]
+        paths += [f'/api/routes/{route_id}' for route_id in route_ids[:20]]
+        paths += [f'/api/activities/{activity_id}' for activity_id in activity_ids]
+        paths = [quote(path, safe='/?=&') for path in paths]
+
+        process = multiprocessing.Process(target=_serve_process, args=(db.db_path, host, port), daemon=True)
+        process.start()
+        try:
+            base_url = f'http://{host}:{port}'
+            asyncio.run(wait_for_server(base_url + '/healthz'))
+            return {
+                'routes': routes,
+                'full': asyncio.run(run_load(base_url, paths, total, concurrency)),
+                'revalidate': asyncio.run(run_load(base_url, paths, total, concurrency, revalidate=True)),
+            }
+        finally:
+            process.terminate()
+            process.join(5)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="API服务")
+    parser.add_argument('--host', default='127.0.0.1', help="监听地址（默认只监听本机，对外提供时放在反向代理之后）")
+    parser.add_argument('--port', type=int, default=8083)
+    parser.add_argument('--db', default=os.getenv('HIKE_DB_PATH', 'data/hike.db'), help="数据库路径")
+    parser.add_argument('--pool-size', type=int, default=8, help="数据库连接池大小")
+    parser.add_argument('--bench', type=int, metavar='N', help="使用临时数据库压测，发起N个请求")
+    parser.add_argument('--concurrency', type=int, default=50, help="压测并发连接数")
+    args = parser.parse_args()
+
+    if args.bench:
+        print(json.dumps(bench(args.bench, args.concurrency), ensure_ascii=False, indent=2))
+        return
+
+    try:
+        asyncio.run(ApiServer(Database(args.db, pool_size=args.pool_size)).serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,275 @@
+"""
+资源文件仓库
+海报按内容哈希存放在分级子目录中（assets/posters/ab/cd/<哈希>.png），相同内容只存一份；
+后台整理任务迁移旧版平铺的 assets/poster_*.png，并按活动和草稿的引用回收文件：
+未被引用且超过保留期的文件删除，总占用超出上限时从最旧的未引用文件开始删除，被引用的文件始终保留
+
+可单独运行一次整理：
+    python -m utils.asset_store --dry-run
+"""
+
+import argparse
+import hashlib
+import os
+import threading
+import time
+import uuid
+from typing import Dict, List, Optional
+
+from utils import lifecycle, metrics
+from utils.database import Database
+
+# 旧版海报文件名前缀（直接写在资源根目录下）
+LEGACY_PREFIX = 'poster_'
+
+EVICTIONS = metrics.counter('hike_asset_evictions_total', '回收的资源文件数', ('reason',))
+
+
+class AssetStore:
+    """按内容哈希分级存放的资源文件仓库"""
+
+    def __init__(self, root: str = "assets", namespace: str = "posters", max_bytes: int = 500 * 1024 * 1024,
+                 max_age_days: float = 30, grace_seconds: float = 3600):
+        """
+        Args:
+            root: 资源根目录
+            namespace: 子目录名
+            max_bytes: 总占用上限（字节），超出后删除最旧的未引用文件
+            max_age_days: 未引用文件的最长保留天数
+            grace_seconds: 新文件的保护期（秒），生成后尚未写入活动的海报不会被回收
+        """
+        self.root = root
+        self.directory = os.path.join(root, namespace)
+        self.max_bytes = max_bytes
+        self.max_age = max_age_days * 86400
+        self.grace = grace_seconds
+        os.makedirs(self.directory, exist_ok=True)
+
+    def path_for(self, digest: str, suffix: str) -> str:
+        """哈希对应的文件路径（两级子目录，每级256个）"""
+        return os.path.join(self.directory, digest[:2], digest[2:4], f"{digest}{suffix}")
+
+    def put(self, content: bytes, suffix: str = '.png') -> str:
+        """
+        保存文件内容（已存在相同内容时只刷新修改时间）
+
+        Args:
+            content: 文件内容
+            suffix: 扩展名
+
+        Returns:
+            文件路径
+        """
+        path = self.path_for(hashlib.sha1(content).hexdigest(), suffix)
+        if os.path.exists(path):
+            try:
+                os.utime(path)
+                return path
+            except OSError:
+                pass  # 刚被整理任务删除，重新写入
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # 先写临时文件再原子替换，读取方不会看到写了一半的文件
+        tmp_path = f"{path}.{uuid.uuid4().hex[:8]}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+        return path
+
+    def _scan(self) -> List[Dict]:
+        """列出仓库中的文件"""
+        entries = []
+        for dirpath, _, filenames in os.walk(self.directory):
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append({'path': path, 'size': stat.st_size, 'mtime': stat.st_mtime,
+                                'tmp': filename.endswith('.tmp')})
+        return entries
+
+    def _legacy_files(self) -> List[str]:
+        """资源根目录下旧版平铺的海报文件"""
+        try:
+            names = os.listdir(self.root)
+        except OSError:
+            return []
+        return [os.path.join(self.root, name) for name in names
+                if name.startswith(LEGACY_PREFIX) and os.path.isfile(os.path.join(self.root, name))]
+
+    def migrate_legacy(self, db: Database, dry_run: bool = False) -> int:
+        """
+        把旧版海报移入分级目录，并更新活动和草稿中的路径（先写新文件、再改引用、最后删旧文件）
+
+        Returns:
+            迁移的文件数
+        """
+        migrated = 0
+        for legacy_path in self._legacy_files():
+            if dry_run:
+                migrated += 1
+                continue
+            try:
+                with open(legacy_path, 'rb') as f:
+                    content = f.read()
+                mtime = os.path.getmtime(legacy_path)
+                path = self.put(content, os.path.splitext(legacy_path)[1])
+                os.utime(path, (mtime, mtime))  # 保留原文件的时间，按原时间计算保留期
+                db.replace_asset_reference(legacy_path, path)
+                os.remove(legacy_path)
+                migrated += 1
+            except OSError as e:
+                print(f"迁移海报失败（{legacy_path}）：{e}")
+        return migrated
+
+    def collect(self, references: set, now: float = None, dry_run: bool = False) -> Dict:
+        """
+        回收未引用的文件
+
+        Args:
+            references: 被引用的文件路径
+            now: 当前时间戳
+            dry_run: 只统计不删除
+
+        Returns:
+            {'files', 'bytes', 'referenced', 'removed', 'freed_bytes'}
+        """
+        now = now or time.time()
+        referenced = {os.path.normpath(path) for path in references if path}
+        entries = self._scan()
+        total_bytes = sum(entry['size'] for entry in entries)
+
+        removals = []
+        candidates = []
+        for entry in entries:
+            age = now - entry['mtime']
+            if age < self.grace or os.path.normpath(entry['path']) in referenced:
+                continue
+            if entry['tmp']:
+                removals.append((entry, 'tmp'))  # 写入中断留下的临时文件
+            elif age > self.max_age:
+                removals.append((entry, 'age'))
+            else:
+                candidates.append(entry)
+
+        # 超出总占用上限时，从最旧的未引用文件开始删除
+        remaining = total_bytes - sum(entry['size'] for entry, _ in removals)
+        for entry in sorted(candidates, key=lambda e: e['mtime']):
+            if remaining <= self.max_bytes:
+                break
+            removals.append((entry, 'size'))
+            remaining -= entry['size']
+
+        freed = 0
+        removed = 0
+        for entry, reason in removals:
+            if not dry_run:
+                try:
+                    os.remove(entry['path'])
+                except OSError:
+                    continue
+                EVICTIONS.inc(reason=reason)
+            removed += 1
+            freed += entry['size']
+
+        if not dry_run:
+            self._remove_empty_dirs()
+        return {
+            'files': len(entries) - removed,
+            'bytes': total_bytes - freed,
+            'referenced': sum(1 for entry in entries if os.path.normpath(entry['path']) in referenced),
+            'removed': removed,
+            'freed_bytes': freed,
+        }
+
+    def _remove_empty_dirs(self):
+        """删除空的分级子目录"""
+        for dirpath, dirnames, filenames in os.walk(self.directory, topdown=False):
+            if dirpath != self.directory and not dirnames and not filenames:
+                try:
+                    os.rmdir(dirpath)
+                except OSError:
+                    pass
+
+    def compact(self, db: Database, dry_run: bool = False) -> Dict:
+        """
+        整理一次：迁移旧版文件，再按引用回收（已取消活动的海报不计入引用）
+
+        Returns:
+            整理结果（collect 的结果加 migrated）
+        """
+        migrated = self.migrate_legacy(db, dry_run)
+        references = db.get_asset_references(exclude_statuses=[lifecycle.CANCELLED])
+        result = self.collect(references, dry_run=dry_run)
+        result['migrated'] = migrated
+        return result
+
+
+class AssetCompactor:
+    """后台定期整理资源文件"""
+
+    def __init__(self, db: Database, store: AssetStore, interval: float = 3600):
+        """
+        Args:
+            db: 数据库
+            store: 资源文件仓库
+            interval: 整理间隔（秒）
+        """
+        self.db = db
+        self.store = store
+        self.interval = interval
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        """启动后台整理线程（启动后立即整理一次）"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name="asset-compactor", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 10):
+        """停止后台整理线程"""
+        self._stopped.set()
+        if self._thread:
+            self._thread.join(timeout)
+
+    def run_once(self) -> Optional[Dict]:
+        """整理一次，出错时返回None"""
+        try:
+            result = self.store.compact(self.db)
+        except Exception as e:
+            print(f"整理资源文件失败：{e}")
+            return None
+        if result['removed'] or result['migrated']:
+            print(f"资源文件整理：迁移 {result['migrated']} 个，删除 {result['removed']} 个，"
+                  f"释放 {result['freed_bytes'] / 1024 / 1024:.1f}MB，剩余 {result['files']} 个")
+        return result
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self.run_once()
+            self._stopped.wait(self.interval)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="整理资源文件")
+    parser.add_argument('--db', default=os.getenv('HIKE_DB_PATH', 'data/hike.db'), help="数据库路径")
+    parser.add_argument('--root', default='assets', help="资源根目录")
+    parser.add_argument('--max-mb', type=float, default=500, help="总占用上限（MB）")
+    parser.add_argument('--max-age-days', type=float, default=30, help="未引用文件的最长保留天数")
+    parser.add_argument('--dry-run', action='store_true', help="只统计不删除")
+    args = parser.parse_args()
+
+    store = AssetStore(args.root, max_bytes=int(args.max_mb * 1024 * 1024), max_age_days=args.max_age_days)
+    result = store.compact(Database(args.db), dry_run=args.dry_run)
+    action = "将" if args.dry_run else "已"
+    print(f"{action}迁移旧版海报 {result['migrated']} 个，{action}删除 {result['removed']} 个"
+          f"（{result['freed_bytes'] / 1024 / 1024:.1f}MB）")
+    print(f"剩余 {result['files']} 个文件，{result['bytes'] / 1024 / 1024:.1f}MB，其中被引用 {result['referenced']} 个")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,349 @@
+"""
+异步HTTP模块
+基于asyncio的轻量HTTP/1.1客户端（按主机复用keep-alive连接）和服务端（不引入额外依赖）
+"""
+
+import asyncio
+import json
+import ssl
+import time
+from http import HTTPStatus
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, unquote, urlsplit
+
+from utils import metrics
+
+SERVER_SECONDS = metrics.histogram('hike_http_server_seconds', '服务端请求处理耗时', ('handler', 'status'))
+
+
+class AsyncHTTPClient:
+    """asyncio HTTP客户端（连接池）"""
+
+    def __init__(self, timeout: float = 10, max_idle_per_host: int = 8):
+        """
+        Args:
+            timeout: 单次请求超时（秒）
+            max_idle_per_host: 每个主机保留的空闲连接数
+        """
+        self.timeout = timeout
+        self.max_idle_per_host = max_idle_per_host
+        self._idle: Dict[Tuple[str, int, bool], List[Tuple[asyncio.StreamReader, asyncio.StreamWriter]]] = {}
+        # 加载证书较慢，用到HTTPS时再创建
+        self._ssl_context: Optional[ssl.SSLContext] = None
+
+    async def _open(self, host: str, port: int, use_ssl: bool):
+        """取一个空闲连接，没有则新建"""
+        idle = self._idle.get((host, port, use_ssl))
+        while idle:
+            reader, writer = idle.pop()
+            if not writer.is_closing() and not reader.at_eof():
+                return reader, writer, True
+            writer.close()
+        if use_ssl and self._ssl_context is None:
+            self._ssl_context = ssl.create_default_context()
+        reader, writer = await asyncio.open_connection(
+            host, port, ssl=self._ssl_context if use_ssl else None
+        )
+        return reader, writer, False
+
+    def _release(self, key, reader, writer):
+        """归还连接"""
+        idle = self._idle.setdefault(key, [])
+        if len(idle) < self.max_idle_per_host:
+            idle.append((reader, writer))
+        else:
+            writer.close()
+
+    @staticmethod
+    async def _read_body(reader: asyncio.StreamReader, headers: Dict[str, str]) -> bytes:
+        """按Content-Length或chunked读取响应体"""
+        if headers.get('transfer-encoding', '').lower() == 'chunked':
+            chunks = []
+            while True:
+                size_line = await reader.readline()
+                size = int(size_line.split(b';')[0].strip() or b'0', 16)
+                if size == 0:
+                    # 跳过trailer
+                    while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                        pass
+                    return b''.join(chunks)
+                chunks.append(await reader.readexactly(size))
+                await reader.readexactly(2)
+        if 'content-length' in headers:
+            return await reader.readexactly(int(headers['content-length']))
+        return await reader.read()
+
+    async def _exchange(self, reader, writer, request: bytes):
+        """发送请求并读取响应"""
+        writer.write(request)
+        await writer.drain()
+
+        status_line = await reader.readline()
+        if not status_line:
+            raise ConnectionResetError("连接已被对端关闭")
+        status = int(status_line.split()[1])
+
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        body = await self._read_body(reader, headers)
+        return status, headers, body
+
+    async def request(self, method: str, url: str, body: bytes = b'',
+                      headers: Optional[Dict[str, str]] = None) -> Tuple[int, Dict[str, str], bytes]:
+        """
+        发送HTTP请求
+
+        Args:
+            method: 请求方法
+            url: 请求地址
+            body: 请求体
+            headers: 额外请求头
+
+        Returns:
+            (状态码, 响应头, 响应体)
+        """
+        parts = urlsplit(url)
+        use_ssl = parts.scheme == 'https'
+        port = parts.port or (443 if use_ssl else 80)
+        key = (parts.hostname, port, use_ssl)
+        target = parts.path or '/'
+        if parts.query:
+            target += '?' + parts.query
+
+        lines = [
+            f"{method} {target} HTTP/1.1",
+            f"Host: {parts.netloc}",
+            f"Content-Length: {len(body)}",
+            "Connection: keep-alive",
+        ]
+        for name, value in (headers or {}).items():
+            lines.append(f"{name}: {value}")
+        request = ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + body
+
+        for attempt in range(2):
+            reader, writer, reused = await self._open(*key)
+            try:
+                status, resp_headers, resp_body = await asyncio.wait_for(
+                    self._exchange(reader, writer, request), self.timeout
+                )
+                break
+            except (ConnectionError, asyncio.IncompleteReadError):
+                writer.close()
+                # 复用的空闲连接可能已被服务端关闭，换新连接重试一次
+                if not reused or attempt:
+                    raise
+            except BaseException:
+                writer.close()
+                raise
+
+        if resp_headers.get('connection', '').lower() == 'close':
+            writer.close()
+        else:
+            self._release(key, reader, writer)
+        return status, resp_headers, resp_body
+
+    async def close(self):
+        """关闭所有空闲连接"""
+        for idle in self._idle.values():
+            for _, writer in idle:
+                writer.close()
+        self._idle.clear()
+
+
+class Request:
+    """HTTP请求"""
+
+    __slots__ = ('method', 'path', 'query', 'headers', 'body')
+
+    def __init__(self, method: str, path: str, query: Dict[str, str], headers: Dict[str, str], body: bytes):
+        self.method = method
+        self.path = path
+        self.query = query
+        self.headers = headers
+        self.body = body
+
+    def json(self):
+        return json.loads(self.body or b'null')
+
+
+class Response:
+    """HTTP响应"""
+
+    __slots__ = ('status', 'body', 'headers')
+
+    def __init__(self, body: bytes = b'', status: int = 200, headers: Optional[Dict[str, str]] = None):
+        self.status = status
+        self.body = body
+        self.headers = headers or {}
+
+    @classmethod
+    def json(cls, data, status: int = 200, headers: Optional[Dict[str, str]] = None) -> 'Response':
+        all_headers = {'Content-Type': 'application/json; charset=utf-8'}
+        all_headers.update(headers or {})
+        return cls(json.dumps(data, ensure_ascii=False).encode('utf-8'), status, all_headers)
+
+    @classmethod
+    def text(cls, text: str, status: int = 200, content_type: str = 'text/plain; charset=utf-8') -> 'Response':
+        return cls(text.encode('utf-8'), status, {'Content-Type': content_type})
+
+
+# 处理函数：接收请求，返回响应（协程）
+Handler = Callable[[Request], Awaitable[Response]]
+
+
+class _BadRequest(Exception):
+    """请求无法解析（回复状态码后关闭连接）"""
+
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+class AsyncHTTPServer:
+    """asyncio HTTP/1.1服务端（支持keep-alive，按方法+路径前缀路由）"""
+
+    max_body_size = 10 * 1024 * 1024
+
+    def __init__(self):
+        self._routes: List[Tuple[str, str, Handler]] = []
+
+    def route(self, method: str, path: str, handler: Handler):
+        """
+        注册路由
+
+        Args:
+            method: 请求方法
+            path: 路径，以 / 结尾时按前缀匹配
+            handler: 处理协程
+        """
+        self._routes.append((method, path, handler))
+
+    def _match(self, method: str, path: str) -> Tuple[Optional[Handler], bool]:
+        """查找处理函数，返回(处理函数, 路径是否存在)"""
+        path_found = False
+        for route_method, route_path, handler in self._routes:
+            if route_path == path or (route_path.endswith('/') and path.startswith(route_path)):
+                path_found = True
+                if route_method == method:
+                    return handler, True
+        return None, path_found
+
+    async def _read_request(self, reader: asyncio.StreamReader) -> Optional[Request]:
+        """读取一个请求，连接关闭时返回None，请求无法解析时抛出 _BadRequest"""
+        try:
+            head = await reader.readuntil(b'\r\n\r\n')
+        except (asyncio.IncompleteReadError, ConnectionError):
+            return None
+        except asyncio.LimitOverrunError:
+            raise _BadRequest(431, "请求头过大")
+
+        try:
+            lines = head.decode('latin-1').split('\r\n')
+            method, target, version = lines[0].split(' ', 2)
+            if not method or not target.startswith('/') or not version.startswith('HTTP/'):
+                raise ValueError(lines[0])
+            headers = {}
+            for line in lines[1:]:
+                if line:
+                    name, sep, value = line.partition(':')
+                    if not sep or not name.strip():
+                        raise ValueError(line)
+                    headers[name.strip().lower()] = value.strip()
+            length = int(headers.get('content-length', 0))
+            if length < 0:
+                raise ValueError(f"Content-Length: {length}")
+            parts = urlsplit(target)
+            query = {k: v[-1] for k, v in parse_qs(parts.query).items()}
+        except ValueError as e:
+            raise _BadRequest(400, f"请求格式错误：{e}")
+
+        if length > self.max_body_size:
+            raise _BadRequest(413, "请求体过大")
+        body = await reader.readexactly(length) if length else b''
+        return Request(method, unquote(parts.path), query, headers, body)
+
+    @staticmethod
+    def _encode(response: Response, keep_alive: bool) -> bytes:
+        lines = [f"HTTP/1.1 {response.status} {HTTPStatus(response.status).phrase}"]
+        headers = {'Content-Length': str(len(response.body)),
+                   'Connection': 'keep-alive' if keep_alive else 'close'}
+        headers.update(response.headers)
+        for name, value in headers.items():
+            lines.append(f"{name}: {value}")
+        return ('\r\n'.join(lines) + '\r\n\r\n').encode('utf-8') + response.body
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                try:
+                    request = await self._read_request(reader)
+                except _BadRequest as e:
+                    writer.write(self._encode(Response.json({'error': str(e)}, e.status), keep_alive=False))
+                    await writer.drain()
+                    break
+                if request is None:
+                    break
+
+                handler, path_found = self._match(request.method, request.path)
+                started = time.perf_counter()
+                if handler is None:
+                    response = Response.json({'error': 'method not allowed' if path_found else 'not found'},
+                                             405 if path_found else 404)
+                else:
+                    try:
+                        response = await handler(request)
+                    except (ValueError, KeyError) as e:
+                        response = Response.json({'error': f"请求参数错误：{e}"}, 400)
+                    except Exception as e:
+                        print(f"请求处理异常：{e}")
+                        response = Response.json({'error': 'internal error'}, 500)
+                # 按处理函数名统计（路径含ID，不适合作为标签）
+                SERVER_SECONDS.observe(time.perf_counter() - started,
+                                       handler=getattr(handler, '__name__', 'unmatched'), status=response.status)
+
+                keep_alive = request.headers.get('connection', '').lower() != 'close'
+                writer.write(self._encode(response, keep_alive))
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def start(self, host: str = '127.0.0.1', port: int = 8080) -> asyncio.AbstractServer:
+        """
+        启动服务（非阻塞）
+
+        Returns:
+            asyncio服务对象，port为0时可从 sockets[0].getsockname() 获取实际端口
+        """
+        return await asyncio.start_server(self._handle_connection, host, port, backlog=1024)
+
+
+async def metrics_handler(request: Request) -> Response:
+    """GET /metrics：本进程的运行指标（Prometheus文本格式）"""
+    return Response(metrics.render().encode('utf-8'), headers={'Content-Type': metrics.CONTENT_TYPE})
+
+
+async def wait_for_server(url: str, timeout: float = 10):
+    """等待服务可以访问（本地启动服务后压测前使用）"""
+    client = AsyncHTTPClient(timeout=1)
+    deadline = time.monotonic() + timeout
+    try:
+        while True:
+            try:
+                await client.request('GET', url)
+                return
+            except OSError:
+                if time.monotonic() > deadline:
+                    raise
+                await asyncio.sleep(0.05)
+    finally:
+        await client.close()
@@ -0,0 +1,431 @@
+"""
+群聊机器人回调服务
+接收群消息回调，按内存索引匹配问题库自动回复，消息批量写入数据库
+
+运行：
+    python -m utils.bot_server --port 8081
+压测（本地启动服务和模拟客户端）：
+    python -m utils.bot_server --bench 20000 --concurrency 64
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import re
+import signal
+import tempfile
+import time
+import unicodedata
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+from utils import metrics
+from utils.async_http import AsyncHTTPClient, AsyncHTTPServer, Request, Response, metrics_handler, wait_for_server
+from utils.database import Database
+
+# 消息开头的@提及（如“@小助手 ”）
+_MENTION_PATTERN = re.compile(r'^(@\S+\s*)+')
+
+# 句末语气词不影响匹配
+_TRAILING_PARTICLES = '吗呢啊呀吧么嘛'
+
+EMPTY_REPLY = b'{}'
+
+REPLY_SECONDS = metrics.histogram('hike_bot_reply_seconds', '机器人回复耗时（匹配问题库）', ('result',),
+                                  buckets=(0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05))
+
+
+def normalize(text: str) -> str:
+    """归一化问题文本：去掉@提及、标点和空白，转小写，去掉句末语气词"""
+    text = _MENTION_PATTERN.sub('', text.strip())
+    text = unicodedata.normalize('NFKC', text).lower()
+    text = ''.join(ch for ch in text if ch.isalnum())
+    return text.rstrip(_TRAILING_PARTICLES)
+
+
+def bigrams(text: str) -> set:
+    """字符二元组（单字文本返回自身）"""
+    if len(text) < 2:
+        return {text} if text else set()
+    return {text[i:i + 2] for i in range(len(text) - 1)}
+
+
+class FaqIndex:
+    """问题库内存索引：归一化精确匹配 + 字符二元组倒排索引相似度匹配"""
+
+    def __init__(self, faqs: List[Dict], threshold: float = 0.5, max_query_length: int = 60):
+        """
+        Args:
+            faqs: 问题列表（get_all_faq 的返回值）
+            threshold: 相似度阈值（Dice系数），低于阈值不回复
+            max_query_length: 超过该长度的消息视为闲聊，不做相似度匹配
+        """
+        self.threshold = threshold
+        self.max_query_length = max_query_length
+        self.faqs: List[Dict] = []
+        self.replies: List[bytes] = []
+        self._exact: Dict[str, int] = {}
+        self._postings: Dict[str, List[int]] = defaultdict(list)
+        self._sizes: List[int] = []
+
+        for faq in faqs:
+            key = normalize(faq['question'])
+            if not key or key in self._exact:
+                continue
+            i = len(self.faqs)
+            self.faqs.append(faq)
+            # 回复消息体在建索引时序列化，请求时直接返回
+            self.replies.append(json.dumps(
+                {"msgtype": "text", "text": {"content": faq['answer']}}, ensure_ascii=False
+            ).encode('utf-8'))
+            self._exact[key] = i
+            grams = bigrams(key)
+            self._sizes.append(len(grams))
+            for gram in grams:
+                self._postings[gram].append(i)
+
+    def __len__(self) -> int:
+        return len(self.faqs)
+
+    def match(self, text: str) -> Optional[int]:
+        """
+        匹配问题
+
+        Returns:
+            问题在索引中的序号，未匹配返回None
+        """
+        key = normalize(text)
+        if not key:
+            return None
+        exact = self._exact.get(key)
+        if exact is not None:
+            return exact
+        if len(key) > self.max_query_length:
+            return None
+
+        grams = bigrams(key)
+        overlaps = Counter()
+        for gram in grams:
+            postings = self._postings.get(gram)
+            if postings:
+                overlaps.update(postings)
+        if not overlaps:
+            return None
+
+        best, best_score = None, 0.0
+        for i, overlap in overlaps.items():
+            score = 2 * overlap / (len(grams) + self._sizes[i])
+            if score > best_score:
+                best, best_score = i, score
+        return best if best_score >= self.threshold else None
+
+
+class MessageWriter:
+    """消息批量写入器：缓冲消息和问题点击数，按批次大小或时间间隔合并写入"""
+
+    def __init__(self, db: Database, max_batch: int = 500, flush_interval: float = 0.2):
+        """
+        Args:
+            db: 数据库
+            max_batch: 缓冲消息数达到该值时立即写入
+            flush_interval: 最长写入间隔（秒）
+        """
+        self.db = db
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval
+        self._messages: List[Tuple[str, str, str, bool]] = []
+        self._clicks: Counter = Counter()
+        # SQLite写入串行执行，避免锁竞争
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="bot-writer")
+        self._full = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    def add(self, group_chat_id: str, user_id: str, message: str, is_bot: bool = False):
+        self._messages.append((group_chat_id, user_id, message, is_bot))
+        if len(self._messages) >= self.max_batch:
+            self._full.set()
+
+    def click(self, faq_id: int):
+        self._clicks[faq_id] += 1
+
+    def _write(self, messages, clicks):
+        try:
+            self.db.insert_messages(messages)
+            self.db.increment_faq_clicks(clicks)
+        except Exception as e:
+            print(f"消息写入失败（{len(messages)}条）：{e}")
+
+    async def flush(self):
+        """写入当前缓冲的数据"""
+        if not self._messages and not self._clicks:
+            return
+        messages, self._messages = self._messages, []
+        clicks, self._clicks = dict(self._clicks), Counter()
+        await asyncio.get_running_loop().run_in_executor(self._executor, self._write, messages, clicks)
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._full.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._full.clear()
+            await self.flush()
+
+    def start(self):
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        await self.flush()
+        self._executor.shutdown()
+
+
+class BotServer:
+    """群聊机器人回调服务"""
+
+    def __init__(self, db: Database, reload_interval: float = 60, threshold: float = 0.5):
+        """
+        Args:
+            db: 数据库
+            reload_interval: 问题库重新加载间隔（秒）
+            threshold: 问题匹配相似度阈值
+        """
+        self.db = db
+        self.reload_interval = reload_interval
+        self.threshold = threshold
+        self.index = FaqIndex(db.get_all_faq(), threshold)
+        self.writer = MessageWriter(db)
+
+        self.http = AsyncHTTPServer()
+        self.http.route('POST', '/callback', self.handle_callback)
+        self.http.route('GET', '/healthz', self.handle_health)
+        self.http.route('GET', '/metrics', metrics_handler)
+
+    @staticmethod
+    def parse_callback(data: Dict) -> Tuple[str, str, str]:
+        """
+        解析回调消息，兼容扁平格式和企业微信机器人回调格式
+
+        扁平格式：{"group_chat_id": ..., "user_id": ..., "content": ...}
+        企业微信格式：{"chatid": ..., "from": {"userid": ...}, "text": {"content": ...}}
+
+        Returns:
+            (群聊ID, 用户ID, 消息内容)
+        """
+        if not isinstance(data, dict):
+            raise ValueError("回调消息应为JSON对象")
+        sender = data.get('from') or {}
+        text = data.get('text') or {}
+        if not isinstance(sender, dict) or not isinstance(text, dict):
+            raise ValueError("from 和 text 应为JSON对象")
+        group_chat_id = data.get('group_chat_id') or data.get('chatid') or ''
+        user_id = data.get('user_id') or sender.get('userid') or ''
+        content = data.get('content')
+        if content is None:
+            content = text.get('content', '')
+        if not all(isinstance(value, str) for value in (group_chat_id, user_id, content)):
+            raise ValueError("群聊ID、用户ID和消息内容必须是字符串")
+        return group_chat_id, user_id, content
+
+    def reply_for(self, group_chat_id: str, user_id: str, content: str) -> bytes:
+        """记录消息并返回回复消息体（无匹配时为空对象）"""
+        started = time.perf_counter()
+        self.writer.add(group_chat_id, user_id, content)
+        matched = self.index.match(content)
+        if matched is None:
+            REPLY_SECONDS.observe(time.perf_counter() - started, result='unmatched')
+            return EMPTY_REPLY
+
+        faq = self.index.faqs[matched]
+        self.writer.click(faq['id'])
+        self.writer.add(group_chat_id, 'bot', faq['answer'], True)
+        REPLY_SECONDS.observe(time.perf_counter() - started, result='matched')
+        return self.index.replies[matched]
+
+    async def handle_callback(self, request: Request) -> Response:
+        group_chat_id, user_id, content = self.parse_callback(request.json())
+        body = self.reply_for(group_chat_id, user_id, content)
+        return Response(body, headers={'Content-Type': 'application/json; charset=utf-8'})
+
+    async def handle_health(self, request: Request) -> Response:
+        return Response.json({'status': 'ok', 'faq_count': len(self.index)})
+
+    async def _reload_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.reload_interval)
+            try:
+                faqs = await loop.run_in_executor(None, self.db.get_all_faq)
+                self.index = FaqIndex(faqs, self.threshold)
+            except Exception as e:
+                print(f"重新加载问题库失败：{e}")
+
+    async def serve(self, host: str = '127.0.0.1', port: int = 8081, ready: Optional[asyncio.Event] = None):
+        """启动服务并一直运行"""
+        loop = asyncio.get_running_loop()
+        server = await self.http.start(host, port)
+        self.writer.start()
+        reload_task = loop.create_task(self._reload_loop())
+        try:
+            # 收到终止信号时先关闭服务，缓冲中的消息在退出前写入
+            loop.add_signal_handler(signal.SIGTERM, server.close)
+        except (NotImplementedError, RuntimeError):
+            pass
+        print(f"机器人回调服务已启动：http://{host}:{port}/callback（问题库{len(self.index)}条）")
+        if ready is not None:
+            ready.set()
+        try:
+            async with server:
+                await server.serve_forever()
+        except asyncio.CancelledError:
+            pass
+        finally:
+            reload_task.cancel()
+            await self.writer.stop()
+
+
+# ==================== 模拟客户端压测 ====================
+
+def _bench_messages(faqs: List[Dict]) -> List[str]:
+    """压测消息：问题原文、改写后的问题和闲聊混合"""
+    messages = []
+    for faq in faqs:
+        question = faq['question']
+        messages.append(question)
+        messages.append('@小助手 ' + question.rstrip('？?') + '呢')
+    messages += ['大家好', '周末天气不错', '收到', '我报名了，带两个朋友', '哈哈哈哈', '几点出发呀']
+    return messages
+
+
+def _percentile(sorted_values: List[float], p: float) -> float:
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * p))]
+
+
+async def run_bench(url: str, messages: List[str], total: int, concurrency: int) -> Dict:
+    """
+    模拟客户端：每个并发使用一条keep-alive连接发送回调
+
+    Returns:
+        压测结果（吞吐量、延迟分位数、命中率）
+    """
+    latencies: List[float] = []
+    replied = 0
+    errors = 0
+    counter = iter(range(total))
+
+    async def worker(worker_id: int):
+        nonlocal replied, errors
+        client = AsyncHTTPClient(timeout=10, max_idle_per_host=1)
+        try:
+            for i in counter:
+                body = json.dumps({
+                    'group_chat_id': f'group-{worker_id % 8}',
+                    'user_id': f'user-{i % 500}',
+                    'content': messages[i % len(messages)],
+                }, ensure_ascii=False).encode('utf-8')
+                start = time.perf_counter()
+                try:
+                    status, _, content = await client.request(
+                        'POST', url, body, {'Content-Type': 'application/json'})
+                except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError):
+                    errors += 1
+                    continue
+                latencies.append(time.perf_counter() - start)
+                if status != 200:
+                    errors += 1
+                elif content != EMPTY_REPLY:
+                    replied += 1
+        finally:
+            await client.close()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker(i) for i in range(concurrency)))
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        'messages': total,
+        'concurrency': concurrency,
+        'elapsed': round(elapsed, 3),
+        'throughput': round(len(latencies) / elapsed, 1) if elapsed else 0,
+        'p50_ms': round(_percentile(latencies, 0.50) * 1000, 2),
+        'p99_ms': round(_percentile(latencies, 0.99) * 1000, 2),
+        'max_ms': round(latencies[-1] * 1000, 2) if latencies else 0,
+        'replied': replied,
+        'errors': errors,
+    }
+
+
+def _serve_process(db_path: str, host: str, port: int):
+    """子进程中运行服务（与压测客户端分开，服务端独占一个核心）"""
+    try:
+        asyncio.run(BotServer(Database(db_path)).serve(host, port))
+    except KeyboardInterrupt:
+        pass
+
+
+def bench(total: int, concurrency: int, host: str = '127.0.0.1', port: int = 18081) -> Dict:
+    """使用临时数据库启动服务并压测"""
+    import multiprocessing
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'bench.db')
+        db = Database(db_path)
+        db.init_faq_data()
+
+        process = multiprocessing.Process(target=_serve_process, args=(db_path, host, port), daemon=True)
+        process.start()
+        try:
+            url = f'http://{host}:{port}'
+            asyncio.run(wait_for_server(url + '/healthz'))
+            result = asyncio.run(run_bench(url + '/callback', _bench_messages(db.get_all_faq()),
+                                           total, concurrency))
+        finally:
+            process.terminate()
+            process.join(5)
+
+        result['stored_messages'] = _count_messages(db)
+        return result
+
+
+def _count_messages(db: Database) -> int:
+    conn = db.get_connection()
+    count = conn.execute('SELECT COUNT(*) FROM messages').fetchone()[0]
+    conn.close()
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description="群聊机器人回调服务")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--db', default='data/hike.db', help="数据库路径")
+    parser.add_argument('--bench', type=int, metavar='N', help="使用临时数据库压测，发送N条消息")
+    parser.add_argument('--concurrency', type=int, default=64, help="压测并发连接数")
+    args = parser.parse_args()
+
+    if args.bench:
+        result = bench(args.bench, args.concurrency)
+        print(json.dumps(result, ensure_ascii=False, indent=2))
+        return
+
+    db = Database(args.db)
+    db.init_faq_data()
+    try:
+        asyncio.run(BotServer(db).serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,246 @@
+"""
+路线目录模块
+路线表的只读内存快照：数值列存为数组，地点、难度、标签等重复字符串驻留后按编号存储，
+按ID常数时间查找，按条件筛选返回位置数组；描述等长文本不进入快照，需要时再查询数据库。
+路线写入后（路线版本变化）自动重建
+
+本地对比内存占用：
+    python -m utils.catalogue --bench 100000
+"""
+
+import argparse
+import sys
+import threading
+import time
+import tracemalloc
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from utils.database import Database
+
+# 快照包含的列（与 Database.get_route_summaries 一致）
+COLUMNS = ('id', 'name', 'distance', 'elevation', 'duration', 'difficulty', 'hot_score', 'tags', 'location')
+
+
+class RouteRecord:
+    """单条路线（只读，支持 route['name'] / route.get('name') 访问）"""
+
+    __slots__ = COLUMNS
+
+    def __init__(self, *values):
+        for column, value in zip(COLUMNS, values):
+            object.__setattr__(self, column, value)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("路线记录为只读")
+
+    def __getitem__(self, key: str):
+        if key not in COLUMNS:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def get(self, key: str, default=None):
+        return getattr(self, key) if key in COLUMNS else default
+
+    def to_dict(self) -> Dict:
+        return {column: getattr(self, column) for column in COLUMNS}
+
+    def __repr__(self):
+        return f"RouteRecord(id={self.id}, name={self.name!r})"
+
+
+class _Interned:
+    """字符串驻留表：相同字符串只保存一份，列中存编号"""
+
+    def __init__(self):
+        self.values: List[Optional[str]] = []
+        self._codes: Dict[Optional[str], int] = {}
+
+    def code(self, value: Optional[str]) -> int:
+        code = self._codes.get(value)
+        if code is None:
+            code = self._codes[value] = len(self.values)
+            self.values.append(sys.intern(value) if isinstance(value, str) else value)
+        return code
+
+
+class RouteCatalogue:
+    """路线目录快照"""
+
+    def __init__(self, rows: Sequence[Tuple], version=None):
+        """
+        Args:
+            rows: 按 COLUMNS 顺序的元组列表
+            version: 对应的路线数据版本
+        """
+        n = len(rows)
+        self.version = version
+        self.size = n
+        columns = list(zip(*rows)) if rows else [()] * len(COLUMNS)
+
+        self.ids = np.array(columns[0], dtype=np.int64)
+        self.distance = np.array(columns[2], dtype=np.float64)
+        self.elevation = np.array(columns[3], dtype=np.float64)
+        self.duration = np.array(columns[4], dtype=np.float64)
+        self.hot_score = np.array(columns[6], dtype=np.float64)
+
+        # 名称各不相同，只做驻留；难度、标签、地点重复度高，按编号存储
+        self.names: List[str] = [sys.intern(name) for name in columns[1]]
+        self._difficulties = _Interned()
+        self._tags = _Interned()
+        self._locations = _Interned()
+        self.difficulty_codes = np.array([self._difficulties.code(v) for v in columns[5]], dtype=np.int32)
+        self.tag_codes = np.array([self._tags.code(v) for v in columns[7]], dtype=np.int32)
+        self.location_codes = np.array([self._locations.code(v) for v in columns[8]], dtype=np.int32)
+
+        # ID -> 位置（路线ID自增且较为连续，直接用数组下标查找）
+        self._positions = np.full(int(self.ids.max()) + 1 if n else 0, -1, dtype=np.int32)
+        self._positions[self.ids] = np.arange(n, dtype=np.int32)
+
+        # 默认排序：热度从高到低（与 get_routes 一致）
+        self._by_hot = np.argsort(-np.nan_to_num(self.hot_score, nan=-np.inf), kind='stable')
+
+    def __len__(self):
+        return self.size
+
+    def position(self, route_id: int) -> int:
+        """路线ID对应的位置，不存在时返回-1"""
+        if 0 <= route_id < len(self._positions):
+            return int(self._positions[route_id])
+        return -1
+
+    def record(self, position: int) -> RouteRecord:
+        """按位置获取路线"""
+        return RouteRecord(
+            int(self.ids[position]),
+            self.names[position],
+            self._number(self.distance[position]),
+            self._number(self.elevation[position]),
+            self._number(self.duration[position]),
+            self._difficulties.values[self.difficulty_codes[position]],
+            self._number(self.hot_score[position]),
+            self._tags.values[self.tag_codes[position]],
+            self._locations.values[self.location_codes[position]],
+        )
+
+    @staticmethod
+    def _number(value) -> Optional[float]:
+        return None if np.isnan(value) else float(value)
+
+    def get(self, route_id: int) -> Optional[RouteRecord]:
+        """按ID获取路线"""
+        position = self.position(route_id)
+        return self.record(position) if position >= 0 else None
+
+    def name(self, position: int) -> str:
+        return self.names[position]
+
+    def filter(self, location: str = None, max_distance: float = 15, max_elevation: float = 800,
+               max_duration: float = 6) -> np.ndarray:
+        """
+        按条件筛选（条件与 Database.get_routes 一致），按热度从高到低排序
+
+        Returns:
+            位置数组
+        """
+        order = self._by_hot
+        with np.errstate(invalid='ignore'):
+            mask = ((self.distance <= max_distance)
+                    & (self.elevation <= max_elevation)
+                    & (self.duration <= max_duration))
+        if location:
+            allowed = np.array([bool(v) and location in v for v in self._locations.values], dtype=bool)
+            mask &= allowed[self.location_codes]
+        return order[mask[order]]
+
+    def search(self, keyword: str, **conditions) -> np.ndarray:
+        """
+        按关键词搜索（名称、标签或地点包含关键词），其他条件同 filter
+
+        Returns:
+            位置数组（按热度从高到低）
+        """
+        positions = self.filter(**conditions)
+        if not keyword:
+            return positions
+        tag_hit = np.array([bool(v) and keyword in v for v in self._tags.values], dtype=bool)
+        location_hit = np.array([bool(v) and keyword in v for v in self._locations.values], dtype=bool)
+        hit = tag_hit[self.tag_codes[positions]] | location_hit[self.location_codes[positions]]
+        names = self.names
+        for i in np.flatnonzero(~hit):
+            hit[i] = keyword in names[positions[i]]
+        return positions[hit]
+
+    def count(self, **conditions) -> int:
+        """符合条件的路线数量"""
+        return len(self.filter(**conditions))
+
+    def records(self, positions: Iterable[int]) -> List[RouteRecord]:
+        """按位置批量获取路线"""
+        return [self.record(position) for position in positions]
+
+
+class RouteCatalogueCache:
+    """当前路线目录（路线版本变化时重建快照，读取方拿到的快照不会被修改）"""
+
+    def __init__(self, db: Database):
+        self.db = db
+        self._catalogue: Optional[RouteCatalogue] = None
+        self._lock = threading.Lock()
+
+    def current(self) -> RouteCatalogue:
+        """获取最新的路线目录"""
+        version = self.db.routes_version()
+        catalogue = self._catalogue
+        if catalogue is not None and catalogue.version == version:
+            return catalogue
+        with self._lock:
+            if self._catalogue is None or self._catalogue.version != version:
+                self._catalogue = RouteCatalogue(self.db.get_route_summaries(), version)
+            return self._catalogue
+
+
+def _bench(n: int):
+    """对比字典列表与目录快照的内存占用和查询耗时"""
+    rows = [
+        (i + 1, f'路线{i}', 3 + i % 20, 100 + i % 900, 2 + i % 6, ('初级', '中级', '高级')[i % 3],
+         (i * 7919) % 100 / 10, ('风景,轻松', '山景,古道', '森林,亲子', '茶文化,风景')[i % 4],
+         ('苏州吴中', '苏州虎丘', '上海松江', '上海崇明')[i % 4])
+        for i in range(n)
+    ]
+
+    tracemalloc.start()
+    dicts = [dict(zip(COLUMNS, row)) for row in rows]
+    dict_bytes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    tracemalloc.start()
+    catalogue = RouteCatalogue(rows)
+    catalogue_bytes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    print(f"{n} 条路线：字典列表 {dict_bytes / 1e6:.1f}MB，目录快照 {catalogue_bytes / 1e6:.1f}MB")
+
+    started = time.perf_counter()
+    names = [d['name'] for d in sorted(
+        (d for d in dicts if d['distance'] <= 15 and d['elevation'] <= 800 and d['duration'] <= 6
+         and '苏州' in d['location']), key=lambda d: -d['hot_score'])]
+    dict_ms = (time.perf_counter() - started) * 1000
+
+    started = time.perf_counter()
+    positions = catalogue.filter(location='苏州')
+    catalogue_names = [catalogue.names[p] for p in positions]
+    catalogue_ms = (time.perf_counter() - started) * 1000
+    print(f"筛选苏州路线名称：字典列表 {dict_ms:.1f}ms，目录快照 {catalogue_ms:.1f}ms"
+          f"（{len(catalogue_names)} 条，结果{'一致' if sorted(names) == sorted(catalogue_names) else '不一致'}）")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="路线目录")
+    parser.add_argument('--bench', type=int, default=100000, help="对比的路线数量")
+    args = parser.parse_args()
+    _bench(args.bench)
+
+
+if __name__ == '__main__':
+    main()
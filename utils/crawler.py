@@ -10,6 +10,8 @@ import random
 from typing import List, Dict, Optional
 from datetime import datetime
 
+from utils import metrics, tracing
+
 class TwoBuluCrawler:
     """两步路爬虫"""
 
@@ -49,7 +51,9 @@ class TwoBuluCrawler:
                 'page': 1
             }
 
-            response = self.session.get(search_url, params=params, timeout=10)
+            with metrics.track_http('2bulu') as call:
+                response = self.session.get(search_url, params=params, timeout=10)
+                call['status'] = response.status_code
 
             if response.status_code == 200:
                 soup = BeautifulSoup(response.text, 'html.parser')
@@ -322,7 +326,9 @@ class TwoBuluCrawler:
     def get_route_detail(self, route_url: str) -> Optional[Dict]:
         """获取路线详情"""
         try:
-            response = self.session.get(f"{self.base_url}{route_url}", timeout=10)
+            with metrics.track_http('2bulu') as call:
+                response = self.session.get(f"{self.base_url}{route_url}", timeout=10)
+                call['status'] = response.status_code
 
             if response.status_code == 200:
                 soup = BeautifulSoup(response.text, 'html.parser')
@@ -346,12 +352,18 @@ class TwoBuluCrawler:
         return detail
 
     def save_routes_to_db(self, routes: List[Dict], db):
-        """将路线保存到数据库"""
+        """将路线保存到数据库（跳过已存在的路线，新路线批量写入）"""
+        existing = db.get_route_names()
+        new_routes = []
         for route in routes:
-            # 检查是否已存在
-            existing = db.get_routes(location=route['location'], limit=1)
-            existing_names = [r['name'] for r in existing]
+            key = (route['name'], route.get('location'))
+            if key not in existing:
+                existing.add(key)
+                new_routes.append(route)
+
+        db.insert_routes(new_routes)
+        for route in new_routes:
+            print(f"已保存路线：{route['name']}")
+
 
-            if route['name'] not in existing_names:
-                db.insert_route(route)
-                print(f"已保存路线：{route['name']}")
+tracing.trace_methods(TwoBuluCrawler, 'crawler', methods=('get_route_list', 'get_route_detail', 'save_routes_to_db'))
@@ -5,22 +5,69 @@
 
 import sqlite3
 import json
+import queue
 from datetime import datetime
-from typing import List, Dict, Optional
+from typing import Callable, List, Dict, Optional, Tuple
 import os
 
+from utils import metrics, tracing
+
+
+def _local_datetime(value) -> datetime:
+    """数据库中的时间（带时区的旧数据转为本地时间，与 datetime.now() 可比较）"""
+    moment = datetime.fromisoformat(str(value))
+    if moment.tzinfo is not None:
+        moment = moment.astimezone().replace(tzinfo=None)
+    return moment
+
+
+class _PooledConnection(sqlite3.Connection):
+    """连接池中的连接：close() 时回滚未提交的事务并放回连接池，池满时才真正关闭"""
+
+    pool: Optional[queue.LifoQueue] = None
+
+    def close(self):
+        if self.pool is None:
+            return super().close()
+        if self.in_transaction:
+            self.rollback()
+        try:
+            self.pool.put_nowait(self)
+        except queue.Full:
+            super().close()
+
+
 class Database:
     """数据库管理类"""
 
-    def __init__(self, db_path: str = "data/hike.db"):
-        """初始化数据库"""
+    def __init__(self, db_path: str = "data/hike.db", pool_size: int = 0):
+        """
+        初始化数据库
+
+        Args:
+            db_path: 数据库文件路径
+            pool_size: 复用的空闲连接数（常驻服务使用，避免每次查询都重新打开数据库），0 表示不复用
+        """
         self.db_path = db_path
+        self._pool = queue.LifoQueue(maxsize=pool_size) if pool_size > 0 else None
         # 确保数据目录存在
         os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        # 路线数据版本：本进程写入计数 + 标记文件修改时间（其他进程写入路线时更新）
+        self._routes_version = 0
+        self._routes_stamp_path = f"{db_path}.routes"
         self.init_database()
 
     def get_connection(self):
-        """获取数据库连接"""
+        """获取数据库连接（启用连接池时优先取空闲连接）"""
+        if self._pool is not None:
+            try:
+                return self._pool.get_nowait()
+            except queue.Empty:
+                # 连接会在线程池的不同线程间复用
+                conn = sqlite3.connect(self.db_path, factory=_PooledConnection, check_same_thread=False)
+                conn.pool = self._pool
+                conn.row_factory = sqlite3.Row
+                return conn
         conn = sqlite3.connect(self.db_path)
         conn.row_factory = sqlite3.Row
         return conn
@@ -30,6 +77,9 @@ class Database:
         conn = self.get_connection()
         cursor = conn.cursor()
 
+        # WAL模式下读写互不阻塞（投票高峰时统计查询不影响写入），设置对数据库文件持久生效
+        cursor.execute('PRAGMA journal_mode=WAL')
+
         # 路线表
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS routes (
@@ -81,6 +131,20 @@ class Database:
             )
         ''')
 
+        # 选票表（每个投票人在每个活动中只有一张选票）
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS ballots (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                activity_id INTEGER NOT NULL,
+                vote_id INTEGER NOT NULL,
+                voter_id TEXT NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                UNIQUE (activity_id, voter_id),
+                FOREIGN KEY (activity_id) REFERENCES activities(id),
+                FOREIGN KEY (vote_id) REFERENCES votes(id)
+            )
+        ''')
+
         # 问题库表
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS faq (
@@ -116,21 +180,105 @@ class Database:
             )
         ''')
 
+        # 消息发件箱表（持久化待发送的微信消息）
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS outbox (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                idempotency_key TEXT UNIQUE NOT NULL,
+                webhook_url TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                activity_id INTEGER,
+                status TEXT DEFAULT 'pending',
+                attempts INTEGER DEFAULT 0,
+                next_attempt_at REAL DEFAULT 0,
+                locked_until REAL,
+                last_error TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                sent_at TIMESTAMP,
+                FOREIGN KEY (activity_id) REFERENCES activities(id)
+            )
+        ''')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_outbox_due ON outbox (status, next_attempt_at)
+        ''')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_outbox_webhook ON outbox (webhook_url, status)
+        ''')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_ballots_vote ON ballots (vote_id)
+        ''')
+
+        # 票数版本号：活动每次票数变化递增，选项记录最后一次变化时的版本，用于增量获取票数
+        self._ensure_column(cursor, 'activities', 'tally_version', 'INTEGER DEFAULT 0')
+        self._ensure_column(cursor, 'votes', 'version', 'INTEGER DEFAULT 0')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_votes_version ON votes (activity_id, version)
+        ''')
+
+        # 活动消息发往的机器人webhook（定时任务发送投票结果、提醒时使用）
+        self._ensure_column(cursor, 'activities', 'webhook_url', 'TEXT')
+
+        # 集合时间和地点（活动前一天的集合提醒使用）
+        self._ensure_column(cursor, 'activities', 'meeting_time', 'TEXT')
+        self._ensure_column(cursor, 'activities', 'meeting_place', 'TEXT')
+
+        # 定时任务表（同一活动的同类任务只有一条，重新安排时更新执行时间）
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS scheduled_jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                job_type TEXT NOT NULL,
+                activity_id INTEGER NOT NULL,
+                run_at REAL NOT NULL,
+                payload TEXT,
+                status TEXT DEFAULT 'pending',
+                attempts INTEGER DEFAULT 0,
+                locked_until REAL,
+                last_error TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                finished_at TIMESTAMP,
+                UNIQUE (job_type, activity_id),
+                FOREIGN KEY (activity_id) REFERENCES activities(id)
+            )
+        ''')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_jobs_due ON scheduled_jobs (status, run_at)
+        ''')
+
+        # 活动草稿表（组织流程进度，JSON中只保存路线ID、图片存储键等引用）
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS drafts (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                state TEXT NOT NULL,
+                title TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_drafts_updated ON drafts (updated_at)
+        ''')
+
         conn.commit()
         conn.close()
 
+    @staticmethod
+    def _ensure_column(cursor, table: str, column: str, definition: str):
+        """为已有数据库补充新增的列"""
+        cursor.execute(f'PRAGMA table_info({table})')
+        if column not in [row['name'] for row in cursor.fetchall()]:
+            cursor.execute(f'ALTER TABLE {table} ADD COLUMN {column} {definition}')
+
     # ==================== 路线相关操作 ====================
 
-    def insert_route(self, route_data: Dict) -> int:
-        """插入路线"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
+    _INSERT_ROUTE_SQL = '''
+        INSERT INTO routes (name, distance, elevation, duration, difficulty,
+                          hot_score, tags, cover_url, description, source_url, location)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    '''
 
-        cursor.execute('''
-            INSERT INTO routes (name, distance, elevation, duration, difficulty,
-                              hot_score, tags, cover_url, description, source_url, location)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (
+    @staticmethod
+    def _route_values(route_data: Dict) -> Tuple:
+        return (
             route_data['name'],
             route_data.get('distance'),
             route_data.get('elevation'),
@@ -142,13 +290,80 @@ class Database:
             route_data.get('description'),
             route_data.get('source_url'),
             route_data.get('location')
-        ))
+        )
+
+    def routes_version(self) -> Tuple[int, int]:
+        """
+        路线数据版本（不查询数据库），路线写入后变化，可作为查询缓存的键
+
+        Returns:
+            （本进程写入次数, 标记文件修改时间）
+        """
+        try:
+            stamp = os.stat(self._routes_stamp_path).st_mtime_ns
+        except OSError:
+            stamp = 0
+        return self._routes_version, stamp
+
+    def _bump_routes_version(self):
+        """路线写入后更新版本，使缓存失效"""
+        self._routes_version += 1
+        try:
+            with open(self._routes_stamp_path, 'a'):
+                pass
+            os.utime(self._routes_stamp_path)
+        except OSError as e:
+            print(f"更新路线版本标记失败：{e}")
+
+    def insert_route(self, route_data: Dict) -> int:
+        """插入路线"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+
+        cursor.execute(self._INSERT_ROUTE_SQL, self._route_values(route_data))
 
         route_id = cursor.lastrowid
         conn.commit()
         conn.close()
+        self._bump_routes_version()
         return route_id
 
+    def insert_routes(self, routes: List[Dict]) -> List[int]:
+        """
+        批量插入路线（一个事务，路线版本只更新一次）
+
+        Args:
+            routes: 路线列表
+
+        Returns:
+            路线ID列表
+        """
+        if not routes:
+            return []
+        conn = self.get_connection()
+        cursor = conn.cursor()
+
+        route_ids = []
+        for route_data in routes:
+            cursor.execute(self._INSERT_ROUTE_SQL, self._route_values(route_data))
+            route_ids.append(cursor.lastrowid)
+
+        conn.commit()
+        conn.close()
+        self._bump_routes_version()
+        return route_ids
+
+    def get_route_names(self) -> set:
+        """已有路线的（名称, 地点）集合，用于导入时去重"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+
+        cursor.execute('SELECT name, location FROM routes')
+        names = {(row['name'], row['location']) for row in cursor.fetchall()}
+
+        conn.close()
+        return names
+
     def get_routes(self, location: str = None, limit: int = 3, offset: int = 0,
                    max_distance: float = 15, max_elevation: float = 800, max_duration: float = 6) -> List[Dict]:
         """获取路线列表"""
@@ -189,6 +404,99 @@ class Database:
         conn.close()
         return dict(row) if row else None
 
+    def get_routes_by_ids(self, route_ids: List[int]) -> List[Dict]:
+        """按ID批量获取路线（保持传入顺序，不存在的ID忽略）"""
+        if not route_ids:
+            return []
+        conn = self.get_connection()
+        cursor = conn.cursor()
+
+        cursor.execute(
+            f"SELECT * FROM routes WHERE id IN ({', '.join('?' * len(route_ids))})",
+            list(route_ids)
+        )
+        routes = {row['id']: dict(row) for row in cursor.fetchall()}
+
+        conn.close()
+        return [routes[route_id] for route_id in route_ids if route_id in routes]
+
+    def get_route_summaries(self) -> List[Tuple]:
+        """
+        获取全部路线的摘要（不含描述等长文本，按ID排序）
+
+        Returns:
+            (id, name, distance, elevation, duration, difficulty, hot_score, tags, location) 元组列表
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor()
+
+        cursor.execute('''
+            SELECT id, name, distance, elevation, duration, difficulty, hot_score, tags, location
+            FROM routes ORDER BY id
+        ''')
+        rows = [tuple(row) for row in cursor.fetchall()]
+
+        conn.close()
+        return rows
+
+    def get_route_features(self) -> List[Tuple]:
+        """
+        获取全部路线的推荐特征（按ID排序）
+
+        Returns:
+            (id, distance, elevation, duration, difficulty, hot_score, tags, location) 元组列表
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor()
+
+        cursor.execute('''
+            SELECT id, distance, elevation, duration, difficulty, hot_score, tags, location
+            FROM routes ORDER BY id
+        ''')
+        rows = [tuple(row) for row in cursor.fetchall()]
+
+        conn.close()
+        return rows
+
+    def get_route_usage(self) -> List[Tuple[int, int, int]]:
+        """
+        获取路线的历史活动情况（不含已取消的活动）
+
+        Returns:
+            [(route_id, 活动次数, 总票数)]
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor()
+
+        cursor.execute('''
+            SELECT a.route_id, COUNT(DISTINCT a.id) AS times,
+                   (SELECT COUNT(*) FROM ballots b
+                    JOIN activities x ON x.id = b.activity_id
+                    WHERE x.route_id = a.route_id AND x.status != 'cancelled') AS ballots
+            FROM activities a
+            WHERE a.route_id IS NOT NULL AND a.status != 'cancelled'
+            GROUP BY a.route_id
+        ''')
+        usage = [tuple(row) for row in cursor.fetchall()]
+
+        conn.close()
+        return usage
+
+    def get_recent_route_ids(self, limit: int) -> List[int]:
+        """最近limit个活动（不含已取消的活动）使用的路线ID"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+
+        cursor.execute('''
+            SELECT route_id FROM activities
+            WHERE route_id IS NOT NULL AND status != 'cancelled'
+            ORDER BY id DESC LIMIT ?
+        ''', (limit,))
+        route_ids = [row['route_id'] for row in cursor.fetchall()]
+
+        conn.close()
+        return route_ids
+
     def get_routes_count(self, location: str = None,
                         max_distance: float = 15, max_elevation: float = 800, max_duration: float = 6) -> int:
         """获取路线总数"""
@@ -210,8 +518,18 @@ class Database:
 
     # ==================== 活动相关操作 ====================
 
-    def insert_activity(self, activity_data: Dict) -> int:
-        """插入活动"""
+    def insert_activity(self, activity_data: Dict, outbox_messages: List[Dict] = None) -> int:
+        """
+        插入活动
+
+        Args:
+            activity_data: 活动信息
+            outbox_messages: 与活动在同一事务中写入发件箱的消息（见 enqueue_outbox），
+                idempotency_key 中的 {activity_id} 会替换为新活动的ID
+
+        Returns:
+            活动ID
+        """
         conn = self.get_connection()
         cursor = conn.cursor()
 
@@ -233,12 +551,22 @@ class Database:
         ))
 
         activity_id = cursor.lastrowid
+        for message in outbox_messages or []:
+            self._enqueue_outbox(cursor, activity_id=activity_id, **message)
+
         conn.commit()
         conn.close()
         return activity_id
 
-    def update_activity(self, activity_id: int, update_data: Dict):
-        """更新活动"""
+    def update_activity(self, activity_id: int, update_data: Dict, outbox_messages: List[Dict] = None):
+        """
+        更新活动
+
+        Args:
+            activity_id: 活动ID
+            update_data: 要更新的字段
+            outbox_messages: 与更新在同一事务中写入发件箱的消息
+        """
         conn = self.get_connection()
         cursor = conn.cursor()
 
@@ -247,9 +575,47 @@ class Database:
         values.append(activity_id)
 
         cursor.execute(f'UPDATE activities SET {set_clause} WHERE id = ?', values)
+        for message in outbox_messages or []:
+            self._enqueue_outbox(cursor, activity_id=activity_id, **message)
+
         conn.commit()
         conn.close()
 
+    def transition_activity(self, activity_id: int, from_statuses: List[str], to_status: str,
+                            update_data: Dict = None, outbox_messages: List[Dict] = None) -> bool:
+        """
+        变更活动状态（仅当当前状态在from_statuses中时更新，并发变更只有一个成功）
+
+        Args:
+            activity_id: 活动ID
+            from_statuses: 允许的当前状态
+            to_status: 新状态
+            update_data: 同时更新的其他字段
+            outbox_messages: 与状态变更在同一事务中写入发件箱的消息
+
+        Returns:
+            是否变更成功
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor()
+
+        update_data = dict(update_data or {}, status=to_status)
+        set_clause = ', '.join([f'{k} = ?' for k in update_data.keys()])
+        values = list(update_data.values()) + [activity_id] + list(from_statuses)
+
+        cursor.execute(
+            f"UPDATE activities SET {set_clause} WHERE id = ? AND status IN ({', '.join('?' * len(from_statuses))})",
+            values
+        )
+        changed = cursor.rowcount > 0
+        if changed:
+            for message in outbox_messages or []:
+                self._enqueue_outbox(cursor, activity_id=activity_id, **message)
+
+        conn.commit()
+        conn.close()
+        return changed
+
     def get_activity(self, activity_id: int) -> Optional[Dict]:
         """获取活动"""
         conn = self.get_connection()
@@ -261,6 +627,17 @@ class Database:
         conn.close()
         return dict(row) if row else None
 
+    def get_activities_by_status(self, status: str) -> List[Dict]:
+        """获取指定状态的活动"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+
+        cursor.execute('SELECT * FROM activities WHERE status = ? ORDER BY id', (status,))
+        rows = cursor.fetchall()
+
+        conn.close()
+        return [dict(row) for row in rows]
+
     def get_latest_activity(self) -> Optional[Dict]:
         """获取最新活动"""
         conn = self.get_connection()
@@ -309,23 +686,223 @@ class Database:
         cursor = conn.cursor()
 
         cursor.execute('UPDATE votes SET vote_count = ? WHERE id = ?', (count, vote_id))
+        self._bump_tally_version(cursor, vote_id)
         conn.commit()
         conn.close()
 
-    def get_max_vote_option(self, activity_id: int) -> Optional[Dict]:
-        """获取得票最多的选项"""
+    @staticmethod
+    def _bump_tally_version(cursor, vote_id: int):
+        """递增选项所属活动的票数版本号，并记到该选项上"""
+        cursor.execute('''
+            UPDATE activities SET tally_version = tally_version + 1
+            WHERE id = (SELECT activity_id FROM votes WHERE id = ?)
+        ''', (vote_id,))
+        cursor.execute('''
+            UPDATE votes SET version = (SELECT tally_version FROM activities WHERE id = votes.activity_id)
+            WHERE id = ?
+        ''', (vote_id,))
+
+    def cast_ballot(self, activity_id: int, vote_id: int, voter_id: str) -> str:
+        """
+        投票（原子操作：写入选票并累加票数，同一投票人重复投票无效）
+
+        Args:
+            activity_id: 活动ID
+            vote_id: 投票选项ID
+            voter_id: 投票人标识
+
+        Returns:
+            ok：投票成功；duplicate：已投过票；invalid：选项不属于该活动；closed：投票未开放或已截止
+        """
+        return self.cast_ballots([(activity_id, vote_id, voter_id)])[0]
+
+    def cast_ballots(self, ballots: List[Tuple[int, int, str]]) -> List[str]:
+        """
+        批量投票（一个事务中逐张处理，投票高峰时合并提交，结果同 cast_ballot）
+
+        Args:
+            ballots: (activity_id, vote_id, voter_id) 列表
+
+        Returns:
+            每张选票的结果
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        results = []
+        activities = {}
+
+        try:
+            # 立即取得写锁，并发投票依次执行
+            cursor.execute('BEGIN IMMEDIATE')
+            now = datetime.now()
+
+            for activity_id, vote_id, voter_id in ballots:
+                if activity_id not in activities:
+                    cursor.execute('SELECT status, vote_deadline FROM activities WHERE id = ?', (activity_id,))
+                    activity = cursor.fetchone()
+                    activities[activity_id] = bool(activity) and activity['status'] == 'voting' and not (
+                        activity['vote_deadline'] and _local_datetime(activity['vote_deadline']) < now
+                    )
+                if not activities[activity_id]:
+                    results.append('closed')
+                    continue
+
+                cursor.execute('SELECT 1 FROM votes WHERE id = ? AND activity_id = ?', (vote_id, activity_id))
+                if not cursor.fetchone():
+                    results.append('invalid')
+                    continue
+
+                cursor.execute('''
+                    INSERT OR IGNORE INTO ballots (activity_id, vote_id, voter_id)
+                    VALUES (?, ?, ?)
+                ''', (activity_id, vote_id, voter_id))
+                if cursor.rowcount == 0:
+                    results.append('duplicate')
+                    continue
+
+                cursor.execute('UPDATE votes SET vote_count = vote_count + 1 WHERE id = ?', (vote_id,))
+                self._bump_tally_version(cursor, vote_id)
+                results.append('ok')
+
+            conn.commit()
+            return results
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+    def get_ballot(self, activity_id: int, voter_id: str) -> Optional[Dict]:
+        """获取投票人的选票"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+
+        cursor.execute('SELECT * FROM ballots WHERE activity_id = ? AND voter_id = ?', (activity_id, voter_id))
+        row = cursor.fetchone()
+
+        conn.close()
+        return dict(row) if row else None
+
+    def get_vote_tally(self, activity_id: int) -> Dict:
+        """
+        获取投票统计（读取 votes.vote_count 中实时累加的票数）
+
+        Returns:
+            {'options': 各选项（含vote_count）, 'total': 总票数}
+        """
+        options = self.get_vote_options(activity_id)
+        return {'options': options, 'total': sum(option['vote_count'] or 0 for option in options)}
+
+    def recount_votes(self, activity_id: int):
+        """按选票表重新汇总票数（修正手动改动或历史数据）"""
         conn = self.get_connection()
         cursor = conn.cursor()
 
         cursor.execute('''
-            SELECT * FROM votes WHERE activity_id = ?
-            ORDER BY vote_count DESC, id ASC LIMIT 1
+            UPDATE votes SET vote_count = (
+                SELECT COUNT(*) FROM ballots WHERE ballots.vote_id = votes.id
+            )
+            WHERE activity_id = ?
         ''', (activity_id,))
+        cursor.execute('UPDATE activities SET tally_version = tally_version + 1 WHERE id = ?', (activity_id,))
+        cursor.execute('''
+            UPDATE votes SET version = (SELECT tally_version FROM activities WHERE id = ?)
+            WHERE activity_id = ?
+        ''', (activity_id, activity_id))
+        conn.commit()
+        conn.close()
+
+    def get_tally_changes(self, activity_id: int, since: int = -1) -> Dict:
+        """
+        增量获取票数：只返回版本号大于since的选项（版本号未变时只查一行）
+
+        Args:
+            activity_id: 活动ID
+            since: 上次获取到的版本号，-1表示获取全部选项
+
+        Returns:
+            {'version': 当前版本号, 'changes': 变化的选项（id、vote_date、weather、vote_count）}
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor()
+
+        cursor.execute('SELECT tally_version FROM activities WHERE id = ?', (activity_id,))
+        row = cursor.fetchone()
+        version = row['tally_version'] if row else 0
+        changes = []
+        if version != since:
+            cursor.execute('''
+                SELECT id, vote_date, weather, vote_count FROM votes
+                WHERE activity_id = ? AND version > ?
+                ORDER BY vote_date
+            ''', (activity_id, since))
+            changes = [dict(row) for row in cursor.fetchall()]
+
+        conn.close()
+        return {'version': version, 'changes': changes}
+
+    def get_max_vote_option(self, activity_id: int) -> Optional[Dict]:
+        """获取得票最多的选项"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+
+        cursor.execute(self._MAX_VOTE_OPTION_SQL, (activity_id,))
         row = cursor.fetchone()
 
         conn.close()
         return dict(row) if row else None
 
+    # 平票时选日期最早的选项，日期也相同时选先创建的
+    _MAX_VOTE_OPTION_SQL = '''
+        SELECT * FROM votes WHERE activity_id = ?
+        ORDER BY vote_count DESC, vote_date ASC, id ASC LIMIT 1
+    '''
+
+    def close_vote(self, activity_id: int,
+                   outbox_messages_for: Callable[[Dict], List[Dict]] = None) -> Optional[Dict]:
+        """
+        截止投票：选出得票最多的日期，活动进入招募阶段（已截止的活动不会重复处理）
+
+        Args:
+            activity_id: 活动ID
+            outbox_messages_for: 根据获胜选项生成发件箱消息的函数，消息与状态更新在同一事务中写入
+
+        Returns:
+            获胜选项，活动不在投票中或没有选项时返回None
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor()
+
+        try:
+            cursor.execute('BEGIN IMMEDIATE')
+            cursor.execute('SELECT status FROM activities WHERE id = ?', (activity_id,))
+            activity = cursor.fetchone()
+            if not activity or activity['status'] != 'voting':
+                conn.rollback()
+                return None
+
+            cursor.execute(self._MAX_VOTE_OPTION_SQL, (activity_id,))
+            row = cursor.fetchone()
+            if not row:
+                conn.rollback()
+                return None
+            winner = dict(row)
+
+            cursor.execute('''
+                UPDATE activities SET status = 'recruiting', selected_date = ?, activity_date = ?
+                WHERE id = ?
+            ''', (winner['vote_date'], winner['vote_date'].split('（')[0], activity_id))
+            for message in (outbox_messages_for(winner) if outbox_messages_for else []):
+                self._enqueue_outbox(cursor, activity_id=activity_id, **message)
+
+            conn.commit()
+            return winner
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+
     # ==================== 问题库相关操作 ====================
 
     def insert_faq(self, question: str, answer: str, category: str = None) -> int:
@@ -383,6 +960,18 @@ class Database:
         conn.commit()
         conn.close()
 
+    def increment_faq_clicks(self, counts: Dict[int, int]):
+        """批量增加问题点击次数（问题ID -> 增量）"""
+        if not counts:
+            return
+        conn = self.get_connection()
+        cursor = conn.cursor()
+
+        cursor.executemany('UPDATE faq SET click_count = click_count + ? WHERE id = ?',
+                           [(count, faq_id) for faq_id, count in counts.items()])
+        conn.commit()
+        conn.close()
+
     # ==================== 用户相关操作 ====================
 
     def insert_user(self, user_id: str, name: str = None, role: str = 'participant') -> int:
@@ -433,6 +1022,25 @@ class Database:
         conn.close()
         return msg_id
 
+    def insert_messages(self, messages: List[Tuple[str, str, str, bool]]):
+        """
+        批量插入消息（一个事务）
+
+        Args:
+            messages: (group_chat_id, user_id, message, is_bot) 列表
+        """
+        if not messages:
+            return
+        conn = self.get_connection()
+        cursor = conn.cursor()
+
+        cursor.executemany('''
+            INSERT INTO messages (group_chat_id, user_id, message, is_bot)
+            VALUES (?, ?, ?, ?)
+        ''', messages)
+        conn.commit()
+        conn.close()
+
     def get_recent_messages(self, group_chat_id: str, limit: int = 50) -> List[Dict]:
         """获取最近消息"""
         conn = self.get_connection()
@@ -451,6 +1059,445 @@ class Database:
         conn.close()
         return messages
 
+    # ==================== 消息发件箱相关操作 ====================
+
+    @staticmethod
+    def _enqueue_outbox(cursor, webhook_url: str, payload, idempotency_key: str,
+                        activity_id: int = None) -> bool:
+        """在给定游标的事务中写入发件箱，幂等键重复时忽略"""
+        if isinstance(payload, bytes):
+            payload = payload.decode('utf-8')
+        if activity_id is not None:
+            idempotency_key = idempotency_key.replace('{activity_id}', str(activity_id))
+
+        cursor.execute('''
+            INSERT OR IGNORE INTO outbox (idempotency_key, webhook_url, payload, activity_id)
+            VALUES (?, ?, ?, ?)
+        ''', (idempotency_key, webhook_url, payload, activity_id))
+        return cursor.rowcount > 0
+
+    def enqueue_outbox(self, webhook_url: str, payload, idempotency_key: str,
+                       activity_id: int = None) -> bool:
+        """
+        写入发件箱
+
+        Args:
+            webhook_url: 机器人webhook地址
+            payload: 已序列化的消息体
+            idempotency_key: 幂等键，同一个键只会发送一次
+            activity_id: 关联的活动ID
+
+        Returns:
+            是否新写入（幂等键已存在时返回False）
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor()
+
+        inserted = self._enqueue_outbox(cursor, webhook_url, payload, idempotency_key, activity_id)
+
+        conn.commit()
+        conn.close()
+        return inserted
+
+    def claim_outbox_batch(self, limit: int = 50, lease_seconds: float = 120) -> List[Dict]:
+        """
+        领取一批到期的待发送消息
+
+        领取后状态改为 sending 并加租约，进程崩溃未确认的消息在租约过期后会被重新领取
+
+        Args:
+            limit: 最多领取条数
+            lease_seconds: 租约时长（秒）
+
+        Returns:
+            消息列表（按写入顺序）
+        """
+        now = datetime.now().timestamp()
+        conn = self.get_connection()
+        cursor = conn.cursor()
+
+        cursor.execute('BEGIN IMMEDIATE')
+        # 同一webhook中排在前面的消息还在等待重试或正在发送时，后面的消息不领取，保证发送顺序
+        cursor.execute('''
+            SELECT * FROM outbox
+            WHERE ((status = 'pending' AND next_attempt_at <= ?)
+                   OR (status = 'sending' AND locked_until < ?))
+              AND NOT EXISTS (
+                  SELECT 1 FROM outbox AS earlier
+                  WHERE earlier.webhook_url = outbox.webhook_url AND earlier.id < outbox.id
+                    AND ((earlier.status = 'pending' AND earlier.next_attempt_at > ?)
+                         OR (earlier.status = 'sending' AND earlier.locked_until >= ?))
+              )
+            ORDER BY id LIMIT ?
+        ''', (now, now, now, now, limit))
+        rows = [dict(row) for row in cursor.fetchall()]
+
+        cursor.executemany(
+            "UPDATE outbox SET status = 'sending', locked_until = ? WHERE id = ?",
+            [(now + lease_seconds, row['id']) for row in rows]
+        )
+        conn.commit()
+        conn.close()
+        return rows
+
+    def mark_outbox_sent(self, message_ids: List[int]):
+        """标记消息已发送"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+
+        cursor.executemany('''
+            UPDATE outbox SET status = 'sent', sent_at = CURRENT_TIMESTAMP,
+                              attempts = attempts + 1, locked_until = NULL, last_error = NULL
+            WHERE id = ?
+        ''', [(message_id,) for message_id in message_ids])
+        conn.commit()
+        conn.close()
+
+    def mark_outbox_failed(self, message_id: int, error: str, retry_at: Optional[float] = None):
+        """
+        记录发送失败
+
+        Args:
+            message_id: 消息ID
+            error: 失败原因
+            retry_at: 下次重试的时间戳，为None时转入死信
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor()
+
+        status = 'pending' if retry_at is not None else 'dead'
+        cursor.execute('''
+            UPDATE outbox SET status = ?, attempts = attempts + 1, next_attempt_at = ?,
+                              locked_until = NULL, last_error = ?
+            WHERE id = ?
+        ''', (status, retry_at or 0, error, message_id))
+        conn.commit()
+        conn.close()
+
+    def release_outbox(self, message_id: int, retry_at: float):
+        """将已领取但未尝试发送的消息放回队列（不计入尝试次数）"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+
+        cursor.execute('''
+            UPDATE outbox SET status = 'pending', next_attempt_at = ?, locked_until = NULL
+            WHERE id = ?
+        ''', (retry_at, message_id))
+        conn.commit()
+        conn.close()
+
+    def get_outbox_message(self, idempotency_key: str) -> Optional[Dict]:
+        """根据幂等键获取发件箱消息"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+
+        cursor.execute('SELECT * FROM outbox WHERE idempotency_key = ?', (idempotency_key,))
+        row = cursor.fetchone()
+
+        conn.close()
+        return dict(row) if row else None
+
+    def get_outbox_stats(self) -> Dict[str, int]:
+        """按状态统计发件箱消息数"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+
+        cursor.execute('SELECT status, COUNT(*) FROM outbox GROUP BY status')
+        stats = {row[0]: row[1] for row in cursor.fetchall()}
+
+        conn.close()
+        return stats
+
+    def get_dead_letters(self, limit: int = 50) -> List[Dict]:
+        """获取死信消息"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+
+        cursor.execute("SELECT * FROM outbox WHERE status = 'dead' ORDER BY id DESC LIMIT ?", (limit,))
+        rows = [dict(row) for row in cursor.fetchall()]
+
+        conn.close()
+        return rows
+
+    def requeue_dead_letter(self, message_id: int):
+        """将死信重新放回待发送队列"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+
+        cursor.execute('''
+            UPDATE outbox SET status = 'pending', attempts = 0, next_attempt_at = 0
+            WHERE id = ? AND status = 'dead'
+        ''', (message_id,))
+        conn.commit()
+        conn.close()
+
+    # ==================== 定时任务相关操作 ====================
+
+    def schedule_job(self, job_type: str, activity_id: int, run_at: float, payload: Dict = None) -> int:
+        """
+        安排定时任务（同一活动的同类任务已存在时更新执行时间并重新等待执行）
+
+        Args:
+            job_type: 任务类型
+            activity_id: 活动ID
+            run_at: 执行时间（时间戳）
+            payload: 任务参数
+
+        Returns:
+            任务ID
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor()
+
+        cursor.execute('''
+            INSERT INTO scheduled_jobs (job_type, activity_id, run_at, payload)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT (job_type, activity_id) DO UPDATE SET
+                run_at = excluded.run_at, payload = excluded.payload, status = 'pending',
+                attempts = 0, locked_until = NULL, last_error = NULL, finished_at = NULL
+        ''', (job_type, activity_id, run_at, json.dumps(payload or {}, ensure_ascii=False)))
+        cursor.execute('SELECT id FROM scheduled_jobs WHERE job_type = ? AND activity_id = ?',
+                       (job_type, activity_id))
+        job_id = cursor.fetchone()['id']
+
+        conn.commit()
+        conn.close()
+        return job_id
+
+    def cancel_jobs(self, activity_id: int, job_types: List[str] = None):
+        """取消活动未执行的定时任务"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+
+        query = "UPDATE scheduled_jobs SET status = 'cancelled' WHERE activity_id = ? AND status = 'pending'"
+        params = [activity_id]
+        if job_types:
+            query += f" AND job_type IN ({', '.join('?' * len(job_types))})"
+            params.extend(job_types)
+        cursor.execute(query, params)
+
+        conn.commit()
+        conn.close()
+
+    def get_pending_jobs(self) -> List[Dict]:
+        """获取所有待执行的任务（含租约已过期、执行中断的任务），按执行时间排序"""
+        now = datetime.now().timestamp()
+        conn = self.get_connection()
+        cursor = conn.cursor()
+
+        cursor.execute('''
+            SELECT * FROM scheduled_jobs
+            WHERE status = 'pending' OR (status = 'running' AND locked_until < ?)
+            ORDER BY run_at
+        ''', (now,))
+        rows = cursor.fetchall()
+
+        conn.close()
+        return [dict(row) for row in rows]
+
+    def get_next_job_time(self) -> Optional[float]:
+        """最早的待执行任务的执行时间（没有时返回None），调度器据此发现其他进程安排的任务"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+
+        cursor.execute("SELECT MIN(run_at) AS run_at FROM scheduled_jobs WHERE status = 'pending'")
+        run_at = cursor.fetchone()['run_at']
+
+        conn.close()
+        return run_at
+
+    def claim_job(self, job_id: int, run_at: float, lease_seconds: float = 300) -> Optional[Dict]:
+        """
+        领取到期任务（任务已被重新安排、取消或已被其他进程领取时返回None）
+
+        Args:
+            job_id: 任务ID
+            run_at: 调度器记录的执行时间，与数据库不一致说明任务已被重新安排
+            lease_seconds: 租约时长（秒），执行中断的任务在租约过期后重新执行
+
+        Returns:
+            任务
+        """
+        now = datetime.now().timestamp()
+        conn = self.get_connection()
+        cursor = conn.cursor()
+
+        cursor.execute('''
+            UPDATE scheduled_jobs SET status = 'running', locked_until = ?, attempts = attempts + 1
+            WHERE id = ? AND run_at = ? AND run_at <= ?
+              AND (status = 'pending' OR (status = 'running' AND locked_until < ?))
+        ''', (now + lease_seconds, job_id, run_at, now, now))
+        job = None
+        if cursor.rowcount:
+            cursor.execute('SELECT * FROM scheduled_jobs WHERE id = ?', (job_id,))
+            job = dict(cursor.fetchone())
+
+        conn.commit()
+        conn.close()
+        return job
+
+    def finish_job(self, job_id: int):
+        """标记任务已完成"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+
+        cursor.execute('''
+            UPDATE scheduled_jobs SET status = 'done', locked_until = NULL, finished_at = CURRENT_TIMESTAMP
+            WHERE id = ? AND status = 'running'
+        ''', (job_id,))
+        conn.commit()
+        conn.close()
+
+    def fail_job(self, job_id: int, error: str, retry_at: Optional[float] = None):
+        """
+        记录任务失败
+
+        Args:
+            job_id: 任务ID
+            error: 错误信息
+            retry_at: 下次重试时间，None表示不再重试
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor()
+
+        if retry_at is None:
+            cursor.execute('''
+                UPDATE scheduled_jobs SET status = 'failed', last_error = ?, locked_until = NULL,
+                    finished_at = CURRENT_TIMESTAMP
+                WHERE id = ? AND status = 'running'
+            ''', (error, job_id))
+        else:
+            cursor.execute('''
+                UPDATE scheduled_jobs SET status = 'pending', last_error = ?, locked_until = NULL, run_at = ?
+                WHERE id = ? AND status = 'running'
+            ''', (error, retry_at, job_id))
+        conn.commit()
+        conn.close()
+
+    def get_jobs(self, activity_id: int) -> List[Dict]:
+        """获取活动的定时任务"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+
+        cursor.execute('SELECT * FROM scheduled_jobs WHERE activity_id = ? ORDER BY run_at', (activity_id,))
+        rows = cursor.fetchall()
+
+        conn.close()
+        return [dict(row) for row in rows]
+
+    # ==================== 草稿相关操作 ====================
+
+    def save_draft(self, draft_id: Optional[int], state: str, title: str = None) -> int:
+        """
+        保存草稿（draft_id为空或草稿已删除时新建）
+
+        Args:
+            draft_id: 草稿ID
+            state: 序列化后的草稿内容
+            title: 草稿标题（用于草稿列表展示）
+
+        Returns:
+            草稿ID
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor()
+
+        if draft_id is not None:
+            cursor.execute('''
+                UPDATE drafts SET state = ?, title = ?, updated_at = CURRENT_TIMESTAMP WHERE id = ?
+            ''', (state, title, draft_id))
+        if draft_id is None or cursor.rowcount == 0:
+            cursor.execute('INSERT INTO drafts (state, title) VALUES (?, ?)', (state, title))
+            draft_id = cursor.lastrowid
+
+        conn.commit()
+        conn.close()
+        return draft_id
+
+    def get_draft(self, draft_id: int) -> Optional[Dict]:
+        """获取草稿"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+
+        cursor.execute('SELECT * FROM drafts WHERE id = ?', (draft_id,))
+        row = cursor.fetchone()
+
+        conn.close()
+        return dict(row) if row else None
+
+    def get_recent_drafts(self, limit: int = 10) -> List[Dict]:
+        """获取最近更新的草稿（不含草稿内容）"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+
+        cursor.execute('''
+            SELECT id, title, created_at, updated_at FROM drafts
+            ORDER BY updated_at DESC, id DESC LIMIT ?
+        ''', (limit,))
+        rows = cursor.fetchall()
+
+        conn.close()
+        return [dict(row) for row in rows]
+
+    def delete_drafts_before(self, cutoff: str) -> int:
+        """删除指定时间（UTC，YYYY-MM-DD HH:MM:SS）之前更新的草稿，返回删除数量"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+
+        cursor.execute('DELETE FROM drafts WHERE updated_at < ?', (cutoff,))
+        deleted = cursor.rowcount
+
+        conn.commit()
+        conn.close()
+        return deleted
+
+    # ==================== 资源文件引用 ====================
+
+    def get_asset_references(self, exclude_statuses: List[str] = ()) -> set:
+        """
+        活动和草稿引用的海报文件路径
+
+        Args:
+            exclude_statuses: 不计入引用的活动状态（如已取消的活动）
+
+        Returns:
+            文件路径集合
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor()
+
+        placeholders = ', '.join('?' * len(exclude_statuses))
+        status_clause = f'AND status NOT IN ({placeholders})' if exclude_statuses else ''
+        cursor.execute(f'''
+            SELECT poster_url AS path FROM activities
+            WHERE poster_url IS NOT NULL AND poster_url != '' {status_clause}
+            UNION
+            SELECT json_extract(state, '$.poster_path') AS path FROM drafts
+            WHERE json_extract(state, '$.poster_path') IS NOT NULL
+        ''', list(exclude_statuses))
+        rows = cursor.fetchall()
+
+        conn.close()
+        return {row['path'] for row in rows}
+
+    def replace_asset_reference(self, old_path: str, new_path: str) -> int:
+        """文件迁移后更新活动和草稿中的路径，返回更新的记录数"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+
+        cursor.execute('BEGIN IMMEDIATE')
+        cursor.execute('UPDATE activities SET poster_url = ? WHERE poster_url = ?', (new_path, old_path))
+        updated = cursor.rowcount
+        cursor.execute('''
+            UPDATE drafts SET state = json_set(state, '$.poster_path', ?)
+            WHERE json_extract(state, '$.poster_path') = ?
+        ''', (new_path, old_path))
+        updated += cursor.rowcount
+
+        conn.commit()
+        conn.close()
+        return updated
+
     # ==================== 初始化问题库 ====================
 
     def init_faq_data(self):
@@ -486,3 +1533,13 @@ class Database:
 
         for question, answer, category in faqs:
             self.insert_faq(question, answer, category)
+
+
+# 每个数据库方法的耗时和异常次数（不访问数据库的方法除外）
+metrics.instrument_methods(
+    Database,
+    metrics.histogram('hike_db_method_seconds', '数据库方法耗时', ('method',)),
+    metrics.counter('hike_db_method_errors_total', '数据库方法异常次数', ('method',)),
+    exclude=('get_connection', 'routes_version'),
+)
+tracing.trace_methods(Database, 'db', exclude=('get_connection', 'routes_version'))
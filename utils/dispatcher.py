@@ -0,0 +1,128 @@
+"""
+发件箱投递模块
+后台线程分批领取发件箱中的微信消息并发送，失败按退避重试，多次失败转入死信
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+from utils.database import Database
+from utils.wechat_transport import ERRCODE_RATE_LIMITED, WeChatTransport, backoff_delay
+
+# 网络异常（errcode -1）和频率超限可以重试，其余错误码（如webhook无效、消息格式错误）重试无意义
+RETRYABLE_ERRCODES = {-1, ERRCODE_RATE_LIMITED}
+
+
+class OutboxDispatcher:
+    """发件箱投递器"""
+
+    def __init__(self, db: Database, transport: Optional[WeChatTransport] = None,
+                 batch_size: int = 50, poll_interval: float = 5, max_attempts: int = 6,
+                 max_workers: int = 8):
+        """
+        Args:
+            db: 数据库
+            transport: 发送通道，默认新建（通道内部只做一次快速重试，其余由发件箱退避重试）
+            batch_size: 每批领取的消息数
+            poll_interval: 空闲时的轮询间隔（秒）
+            max_attempts: 最多尝试次数，超过后转入死信
+            max_workers: 并发发送的webhook数
+        """
+        self.db = db
+        self.transport = transport or WeChatTransport(max_retries=1)
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.max_workers = max_workers
+
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        """启动后台投递线程"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name="outbox-dispatcher", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 10):
+        """停止后台投递线程"""
+        self._stopped.set()
+        self._wakeup.set()
+        if self._thread:
+            self._thread.join(timeout)
+
+    def wake(self):
+        """有新消息写入时唤醒投递线程"""
+        self._wakeup.set()
+
+    def _run(self):
+        while not self._stopped.is_set():
+            try:
+                processed = self.drain_once()
+            except Exception as e:
+                print(f"发件箱投递异常：{e}")
+                processed = 0
+
+            # 批次满说明可能还有积压，立即处理下一批
+            if processed < self.batch_size:
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+
+    def _send_group(self, messages: List[Dict]) -> Dict[int, Dict]:
+        """按顺序发送同一webhook的消息，某条失败后其余消息本批不再发送，保证顺序"""
+        results = {}
+        for message in messages:
+            result = self.transport.post(message['webhook_url'], message['payload'].encode('utf-8'))
+            results[message['id']] = result
+            if result.get('errcode') != 0:
+                break
+        return results
+
+    def drain_once(self) -> int:
+        """
+        领取并发送一批消息
+
+        Returns:
+            本批领取的消息数
+        """
+        batch = self.db.claim_outbox_batch(self.batch_size)
+        if not batch:
+            return 0
+
+        groups: "OrderedDict[str, List[Dict]]" = OrderedDict()
+        for message in batch:
+            groups.setdefault(message['webhook_url'], []).append(message)
+
+        results: Dict[int, Dict] = {}
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(groups))) as executor:
+            for group_results in executor.map(self._send_group, groups.values()):
+                results.update(group_results)
+
+        sent_ids = []
+        for message in batch:
+            result = results.get(message['id'])
+            if result is None:
+                # 同组前序消息失败，本条未尝试发送，放回队列，待前序消息发出后再发
+                self.db.release_outbox(message['id'], time.time())
+                continue
+            if result.get('errcode') == 0:
+                sent_ids.append(message['id'])
+                continue
+
+            error = f"{result.get('errcode')}: {result.get('errmsg')}"
+            attempts = message['attempts'] + 1
+            if result.get('errcode') in RETRYABLE_ERRCODES and attempts < self.max_attempts:
+                self.db.mark_outbox_failed(message['id'], error, time.time() + backoff_delay(attempts, base=5, cap=600))
+            else:
+                print(f"消息转入死信（{message['idempotency_key']}）：{error}")
+                self.db.mark_outbox_failed(message['id'], error)
+
+        if sent_ids:
+            self.db.mark_outbox_sent(sent_ids)
+        return len(batch)
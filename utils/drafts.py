@@ -0,0 +1,143 @@
+"""
+活动草稿模块
+把组织流程的进度保存到数据库，刷新页面或换设备后按草稿ID恢复；
+草稿只保存路线ID、图片引用等可序列化的小数据，图片在生成海报时才按引用读取
+"""
+
+import json
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+from utils.database import Database
+
+# 需要持久化的会话字段
+DRAFT_KEYS = (
+    'selected_route',
+    'selected_theme',
+    'searched_images',
+    'bg_image',
+    'vote_options',
+    'vote_year',
+    'vote_month',
+    'vote_deadline',
+    'activity_id',
+    'poster_path',
+    'vote_url',
+    'poster_published',
+    'welcome_keys',
+)
+
+# 以时间类型保存的字段
+DATETIME_KEYS = ('vote_deadline',)
+
+
+def encode_state(session: Dict) -> str:
+    """
+    会话状态序列化为草稿内容
+
+    Args:
+        session: 会话状态（st.session_state 或字典）
+
+    Returns:
+        JSON字符串
+    """
+    state = {}
+    for key in DRAFT_KEYS:
+        if key not in session:
+            continue
+        value = session[key]
+        if key == 'selected_route':
+            # 路线只保存ID，恢复时从数据库读取
+            value = value['id'] if value else None
+        elif key in DATETIME_KEYS and isinstance(value, datetime):
+            value = value.isoformat()
+        state[key] = value
+    return json.dumps(state, ensure_ascii=False)
+
+
+def decode_state(db: Database, content: str) -> Dict:
+    """
+    草稿内容还原为会话状态
+
+    Args:
+        db: 数据库
+        content: JSON字符串
+
+    Returns:
+        会话状态字典（路线已删除时不恢复路线）
+    """
+    state = json.loads(content or '{}')
+    if state.get('selected_route') is not None:
+        route = db.get_route_by_id(state['selected_route'])
+        if route:
+            state['selected_route'] = route
+        else:
+            state.pop('selected_route')
+    else:
+        state.pop('selected_route', None)
+
+    for key in DATETIME_KEYS:
+        if state.get(key):
+            state[key] = datetime.fromisoformat(state[key])
+    return state
+
+
+def draft_title(session: Dict) -> Optional[str]:
+    """草稿标题：路线名称和投票月份"""
+    route = session.get('selected_route')
+    if not route:
+        return None
+    if session.get('vote_year') and session.get('vote_month'):
+        return f"{route['name']} - {session['vote_year']}年{session['vote_month']}月"
+    return route['name']
+
+
+class DraftStore:
+    """活动草稿仓库"""
+
+    def __init__(self, db: Database, max_age_days: int = 30):
+        """
+        Args:
+            db: 数据库
+            max_age_days: 草稿保留天数，超过后清理
+        """
+        self.db = db
+        self.max_age_days = max_age_days
+
+    def save(self, draft_id: Optional[int], session: Dict) -> int:
+        """
+        保存会话进度
+
+        Args:
+            draft_id: 草稿ID（为空时新建）
+            session: 会话状态
+
+        Returns:
+            草稿ID
+        """
+        return self.db.save_draft(draft_id, encode_state(session), draft_title(session))
+
+    def load(self, draft_id: int) -> Optional[Dict]:
+        """
+        读取草稿
+
+        Returns:
+            会话状态字典，草稿不存在时返回None
+        """
+        draft = self.db.get_draft(draft_id)
+        if not draft:
+            return None
+        try:
+            return decode_state(self.db, draft['state'])
+        except (ValueError, TypeError) as e:
+            print(f"草稿内容无法解析（#{draft_id}）：{e}")
+            return None
+
+    def recent(self, limit: int = 10) -> List[Dict]:
+        """最近更新的草稿"""
+        return self.db.get_recent_drafts(limit)
+
+    def prune(self) -> int:
+        """清理过期草稿"""
+        cutoff = datetime.utcnow() - timedelta(days=self.max_age_days)
+        return self.db.delete_drafts_before(cutoff.strftime('%Y-%m-%d %H:%M:%S'))
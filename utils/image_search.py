@@ -0,0 +1,323 @@
+"""
+图片搜索模块
+可插拔的图片搜索后端（Pexels/Unsplash/本地目录/内置示例），并发查询、按相关度合并并缓存结果
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import Callable, Dict, List, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from utils import metrics
+
+
+class ImageSearchProvider:
+    """图片搜索后端基类"""
+
+    name = "base"
+
+    def __init__(self, weight: float = 1.0):
+        """
+        Args:
+            weight: 合并结果时该后端的权重
+        """
+        self.weight = weight
+
+    def search(self, theme: str, count: int) -> List[Dict]:
+        """
+        搜索图片
+
+        Args:
+            theme: 主题词
+            count: 图片数量
+
+        Returns:
+            结果列表，每项包含 url、score（0-1，越大越相关）
+        """
+        raise NotImplementedError
+
+    @staticmethod
+    def _rank_scores(urls: List[str]) -> List[Dict]:
+        """按接口返回顺序换算相关度"""
+        total = len(urls)
+        return [
+            {'url': url, 'score': 1.0 - i / max(total, 1)}
+            for i, url in enumerate(urls)
+        ]
+
+
+class _HTTPProvider(ImageSearchProvider):
+    """基于HTTP接口的后端，共享连接池"""
+
+    def __init__(self, api_key: str, weight: float = 1.0, timeout: float = 8):
+        super().__init__(weight)
+        self.api_key = api_key
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=4)
+        self.session.mount('https://', adapter)
+
+
+class PexelsProvider(_HTTPProvider):
+    """Pexels图片搜索"""
+
+    name = "pexels"
+    api_url = "https://api.pexels.com/v1/search"
+
+    def search(self, theme: str, count: int) -> List[Dict]:
+        with metrics.track_http(self.name) as call:
+            response = self.session.get(
+                self.api_url,
+                params={'query': theme, 'per_page': count, 'orientation': 'portrait'},
+                headers={'Authorization': self.api_key},
+                timeout=self.timeout
+            )
+            call['status'] = response.status_code
+        if response.status_code != 200:
+            print(f"Pexels搜索失败，状态码：{response.status_code}")
+            return []
+
+        photos = response.json().get('photos', [])
+        return self._rank_scores([p['src']['large2x'] for p in photos if p.get('src')])
+
+
+class UnsplashProvider(_HTTPProvider):
+    """Unsplash图片搜索"""
+
+    name = "unsplash"
+    api_url = "https://api.unsplash.com/search/photos"
+
+    def search(self, theme: str, count: int) -> List[Dict]:
+        with metrics.track_http(self.name) as call:
+            response = self.session.get(
+                self.api_url,
+                params={'query': theme, 'per_page': count, 'orientation': 'portrait'},
+                headers={'Authorization': f"Client-ID {self.api_key}"},
+                timeout=self.timeout
+            )
+            call['status'] = response.status_code
+        if response.status_code != 200:
+            print(f"Unsplash搜索失败，状态码：{response.status_code}")
+            return []
+
+        results = response.json().get('results', [])
+        return self._rank_scores([r['urls']['regular'] for r in results if r.get('urls')])
+
+
+class LocalDirectoryProvider(ImageSearchProvider):
+    """本地目录图片（离线测试用）
+
+    目录下按主题词建子目录，或文件名中包含主题词即视为相关
+    """
+
+    name = "local"
+    extensions = ('.jpg', '.jpeg', '.png')
+
+    def __init__(self, directory: str, weight: float = 1.0):
+        super().__init__(weight)
+        self.directory = directory
+
+    def search(self, theme: str, count: int) -> List[Dict]:
+        if not os.path.isdir(self.directory):
+            return []
+
+        results = []
+        for root, _, files in os.walk(self.directory):
+            in_theme_dir = os.path.basename(root) == theme
+            for filename in sorted(files):
+                if not filename.lower().endswith(self.extensions):
+                    continue
+                if in_theme_dir:
+                    score = 1.0
+                elif theme in filename:
+                    score = 0.8
+                else:
+                    score = 0.1
+                results.append({'url': os.path.join(root, filename), 'score': score})
+
+        results.sort(key=lambda r: -r['score'])
+        return results[:count]
+
+
+class SampleProvider(ImageSearchProvider):
+    """内置示例图片（未配置任何API时的兜底）"""
+
+    name = "sample"
+
+    sample_images = {
+        "春日赏花": [
+            "https://images.pexels.com/photos/1366957/pexels-photo-1366957.jpeg",
+            "https://images.pexels.com/photos/1470726/pexels-photo-1470726.jpeg",
+            "https://images.pexels.com/photos/1856086/pexels-photo-1856086.jpeg"
+        ],
+        "山野徒步": [
+            "https://images.pexels.com/photos/167699/pexels-photo-167699.jpeg",
+            "https://images.pexels.com/photos/1687855/pexels-photo-1687855.jpeg",
+            "https://images.pexels.com/photos/1511311/pexels-photo-1511311.jpeg"
+        ],
+        "周末逃离": [
+            "https://images.pexels.com/photos/162436/pexels-photo-162436.jpeg",
+            "https://images.pexels.com/photos/1408221/pexels-photo-1408221.jpeg",
+            "https://images.pexels.com/photos/1470111/pexels-photo-1470111.jpeg"
+        ],
+        "自然疗愈": [
+            "https://images.pexels.com/photos/1547813/pexels-photo-1547813.jpeg",
+            "https://images.pexels.com/photos/1366919/pexels-photo-1366919.jpeg",
+            "https://images.pexels.com/photos/1444724/pexels-photo-1444724.jpeg"
+        ]
+    }
+
+    default_images = [
+        "https://images.pexels.com/photos/167699/pexels-photo-167699.jpeg",
+        "https://images.pexels.com/photos/1687855/pexels-photo-1687855.jpeg",
+        "https://images.pexels.com/photos/1511311/pexels-photo-1511311.jpeg"
+    ]
+
+    def search(self, theme: str, count: int) -> List[Dict]:
+        if theme in self.sample_images:
+            return self._rank_scores(self.sample_images[theme][:count])
+        # 非预置主题的默认图片相关度较低
+        return [
+            {'url': r['url'], 'score': r['score'] * 0.5}
+            for r in self._rank_scores(self.default_images[:count])
+        ]
+
+
+class ImageSearch:
+    """图片搜索聚合器"""
+
+    def __init__(self, providers: List[ImageSearchProvider], cache_size: int = 256,
+                 cache_ttl: float = 6 * 3600, timeout: float = 10):
+        """
+        初始化搜索聚合器
+
+        Args:
+            providers: 搜索后端列表
+            cache_size: 最多缓存的查询数
+            cache_ttl: 查询结果有效期（秒）
+            timeout: 单次搜索等待所有后端的最长时间（秒）
+        """
+        self.providers = providers
+        self.cache_size = cache_size
+        self.cache_ttl = cache_ttl
+        self.timeout = timeout
+
+        self._cache: "OrderedDict[Tuple[str, int], Tuple[float, List[str]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max(len(providers), 1) * 2,
+                                            thread_name_prefix="image-search")
+        # 预热任务单独排队，避免占满查询线程导致互相等待
+        self._warm_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="image-prewarm")
+        # 已排队或正在预热的查询，页面重跑时不重复提交
+        self._warming: set = set()
+
+    @classmethod
+    def from_env(cls) -> 'ImageSearch':
+        """根据环境变量组装搜索后端"""
+        providers: List[ImageSearchProvider] = []
+        if os.getenv('PEXELS_API_KEY'):
+            providers.append(PexelsProvider(os.getenv('PEXELS_API_KEY')))
+        if os.getenv('UNSPLASH_ACCESS_KEY'):
+            providers.append(UnsplashProvider(os.getenv('UNSPLASH_ACCESS_KEY')))
+        if os.getenv('HIKE_IMAGE_DIR'):
+            providers.append(LocalDirectoryProvider(os.getenv('HIKE_IMAGE_DIR')))
+        # 示例图片权重最低，只在其他后端结果不足时补位
+        providers.append(SampleProvider(weight=0.2))
+        return cls(providers)
+
+    def _cache_get(self, key: Tuple[str, int]) -> Optional[List[str]]:
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is None:
+                return None
+            cached_at, urls = entry
+            if time.time() - cached_at > self.cache_ttl:
+                del self._cache[key]
+                return None
+            self._cache.move_to_end(key)
+            return list(urls)
+
+    def _cache_put(self, key: Tuple[str, int], urls: List[str]):
+        with self._lock:
+            self._cache[key] = (time.time(), list(urls))
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def _query_provider(self, provider: ImageSearchProvider, theme: str, count: int) -> List[Dict]:
+        try:
+            return provider.search(theme, count)
+        except Exception as e:
+            print(f"图片搜索失败（{provider.name}）：{e}")
+            return []
+
+    def search(self, theme: str, count: int = 3) -> List[str]:
+        """
+        搜索图片（并发查询所有后端，按相关度合并）
+
+        Args:
+            theme: 主题词
+            count: 图片数量
+
+        Returns:
+            图片URL列表
+        """
+        key = (theme, count)
+        cached = self._cache_get(key)
+        if cached is not None:
+            return cached
+
+        futures = {
+            self._executor.submit(self._query_provider, provider, theme, count): provider
+            for provider in self.providers
+        }
+        done, _ = wait(futures, timeout=self.timeout)
+
+        # 同一URL取最高得分
+        merged: Dict[str, float] = {}
+        for future in done:
+            provider = futures[future]
+            for result in future.result():
+                score = result['score'] * provider.weight
+                if score > merged.get(result['url'], -1):
+                    merged[result['url']] = score
+
+        urls = [url for url, _ in sorted(merged.items(), key=lambda item: -item[1])][:count]
+        # 有后端超时未返回时不缓存不完整的结果
+        if urls and len(done) == len(futures):
+            self._cache_put(key, urls)
+        return urls
+
+    def prewarm(self, themes: List[str], count: int = 3,
+                on_result: Optional[Callable[[List[str]], None]] = None):
+        """
+        后台预热主题的搜索结果
+
+        Args:
+            themes: 主题词列表
+            count: 每个主题的图片数量
+            on_result: 搜索完成后的回调（如预取图片）
+        """
+        def warm(key: Tuple[str, int]):
+            try:
+                urls = self.search(*key)
+            finally:
+                with self._lock:
+                    self._warming.discard(key)
+            if on_result and urls:
+                on_result(urls)
+
+        for theme in themes:
+            key = (theme, count)
+            if self._cache_get(key) is not None:
+                continue
+            with self._lock:
+                if key in self._warming:
+                    continue
+                self._warming.add(key)
+            self._warm_executor.submit(warm, key)
@@ -0,0 +1,289 @@
+"""
+图片缓存模块
+通过连接池并发预取搜索结果图片，原图和缩略图按URL哈希存储在本地，按LRU淘汰
+"""
+
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from typing import Dict, List, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+from PIL import Image
+
+from utils import metrics, tracing
+
+
+class ImageStore:
+    """本地图片仓库"""
+
+    def __init__(self, store_dir: str = "assets/images", max_bytes: int = 200 * 1024 * 1024,
+                 thumb_size: int = 360, max_workers: int = 6, local_dir: Optional[str] = None):
+        """
+        初始化图片仓库
+
+        Args:
+            store_dir: 图片存储目录
+            max_bytes: 磁盘占用上限（字节），超出后按最近最少使用淘汰
+            thumb_size: 缩略图最长边（像素）
+            max_workers: 并发下载线程数
+            local_dir: 允许直接读取的本地图片目录（默认为 HIKE_IMAGE_DIR），其他地址一律按URL下载
+        """
+        self.store_dir = store_dir
+        self.max_bytes = max_bytes
+        self.thumb_size = thumb_size
+        local_dir = local_dir or os.getenv('HIKE_IMAGE_DIR')
+        self.local_dir = os.path.realpath(local_dir) if local_dir else None
+        os.makedirs(self.store_dir, exist_ok=True)
+
+        # 复用TCP连接，连接池大小与并发数一致
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="image-fetch")
+        self._lock = threading.Lock()
+        self._pending: Dict[str, object] = {}
+
+        # key -> 占用字节数，顺序即访问顺序（最旧在前）
+        self._index: "OrderedDict[str, int]" = OrderedDict()
+        self._total_bytes = 0
+        self._load_index()
+
+    @staticmethod
+    def key_for(url: str) -> str:
+        """根据URL计算存储键"""
+        return hashlib.sha1(url.encode('utf-8')).hexdigest()
+
+    def original_path(self, key: str) -> str:
+        """原图路径"""
+        return os.path.join(self.store_dir, f"{key}.jpg")
+
+    def thumbnail_path(self, key: str) -> str:
+        """缩略图路径"""
+        return os.path.join(self.store_dir, f"{key}_thumb.jpg")
+
+    def _load_index(self):
+        """扫描存储目录，按修改时间重建LRU索引"""
+        entries = []
+        for filename in os.listdir(self.store_dir):
+            if not filename.endswith('.jpg') or filename.endswith('_thumb.jpg'):
+                continue
+            key = filename[:-4]
+            size = self._entry_size(key)
+            entries.append((os.path.getmtime(self.original_path(key)), key, size))
+
+        for _, key, size in sorted(entries):
+            self._index[key] = size
+            self._total_bytes += size
+
+    def _entry_size(self, key: str) -> int:
+        """原图与缩略图占用的字节数"""
+        size = 0
+        for path in (self.original_path(key), self.thumbnail_path(key)):
+            if os.path.exists(path):
+                size += os.path.getsize(path)
+        return size
+
+    def _touch(self, key: str):
+        """标记最近使用"""
+        with self._lock:
+            if key in self._index:
+                self._index.move_to_end(key)
+        try:
+            os.utime(self.original_path(key))
+        except OSError:
+            pass
+
+    def _evict(self):
+        """超出磁盘预算时淘汰最久未使用的图片"""
+        with self._lock:
+            while self._total_bytes > self.max_bytes and len(self._index) > 1:
+                key, size = self._index.popitem(last=False)
+                self._total_bytes -= size
+                for path in (self.original_path(key), self.thumbnail_path(key)):
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        pass
+
+    def contains(self, url: str) -> bool:
+        """图片是否已缓存"""
+        return self.key_for(url) in self._index
+
+    def put_bytes(self, key: str, content: bytes) -> bool:
+        """
+        保存图片内容并生成缩略图
+
+        Args:
+            key: 存储键
+            content: 图片二进制内容
+
+        Returns:
+            是否保存成功
+        """
+        try:
+            image = Image.open(BytesIO(content))
+            image = image.convert('RGB')
+
+            # 先写临时文件再改名，避免并发读取到半张图
+            original_path = self.original_path(key)
+            tmp_path = f"{original_path}.{threading.get_ident()}.tmp"
+            image.save(tmp_path, format='JPEG', quality=92)
+            os.replace(tmp_path, original_path)
+
+            image.thumbnail((self.thumb_size, self.thumb_size))
+            thumb_tmp_path = f"{self.thumbnail_path(key)}.{threading.get_ident()}.tmp"
+            image.save(thumb_tmp_path, format='JPEG', quality=80)
+            os.replace(thumb_tmp_path, self.thumbnail_path(key))
+        except Exception as e:
+            print(f"保存图片失败：{e}")
+            return False
+
+        size = self._entry_size(key)
+        with self._lock:
+            self._total_bytes += size - self._index.pop(key, 0)
+            self._index[key] = size
+        self._evict()
+        return True
+
+    def put_upload(self, content: bytes) -> Optional[str]:
+        """
+        保存上传的图片（按内容哈希存储，同一张图重复上传只保存一份）
+
+        Args:
+            content: 图片二进制内容
+
+        Returns:
+            存储键，失败返回None
+        """
+        key = 'upload_' + hashlib.sha1(content).hexdigest()
+        if key in self._index:
+            self._touch(key)
+            return key
+        return key if self.put_bytes(key, content) else None
+
+    def _local_path(self, url: str) -> Optional[str]:
+        """本地图片目录下的文件路径（解析符号链接后仍在目录内才返回）"""
+        if self.local_dir is None or url.startswith(('http://', 'https://')):
+            return None
+        path = os.path.realpath(url)
+        if not path.startswith(self.local_dir + os.sep) or not os.path.isfile(path):
+            return None
+        return path
+
+    def _fetch(self, url: str) -> Optional[str]:
+        """下载单张图片（在线程池中执行）"""
+        key = self.key_for(url)
+        try:
+            if key in self._index:
+                return key
+
+            # 本地图片目录中的图片直接读取，其他路径不读取本地文件
+            local_path = self._local_path(url)
+            if local_path is not None:
+                with open(local_path, 'rb') as f:
+                    content = f.read()
+            else:
+                with metrics.track_http('image_download') as call:
+                    response = self.session.get(url, timeout=10)
+                    call['status'] = response.status_code
+                if response.status_code != 200:
+                    print(f"下载图片失败，状态码：{response.status_code}")
+                    return None
+                content = response.content
+
+            return key if self.put_bytes(key, content) else None
+        except Exception as e:
+            print(f"下载图片失败：{e}")
+            return None
+        finally:
+            with self._lock:
+                self._pending.pop(url, None)
+
+    def prefetch(self, urls: List[str]):
+        """
+        后台并发预取图片，立即返回
+
+        Args:
+            urls: 图片URL列表
+        """
+        with self._lock:
+            for url in urls:
+                if url in self._pending or self.key_for(url) in self._index:
+                    continue
+                self._pending[url] = self._executor.submit(self._fetch, url)
+
+    def _ensure(self, url: str, timeout: float = 15) -> Optional[str]:
+        """确保图片已缓存，必要时等待预取完成或同步下载"""
+        key = self.key_for(url)
+        if key in self._index:
+            self._touch(key)
+            return key
+
+        with self._lock:
+            future = self._pending.get(url)
+        if future is None:
+            return self._fetch(url)
+
+        try:
+            return future.result(timeout=timeout)
+        except Exception as e:
+            print(f"等待图片下载失败：{e}")
+            return None
+
+    def get_thumbnail(self, url: str) -> Optional[str]:
+        """
+        获取缩略图路径（用于选择界面展示）
+
+        Args:
+            url: 图片URL
+
+        Returns:
+            缩略图本地路径，失败返回None
+        """
+        key = self._ensure(url)
+        return self.thumbnail_path(key) if key else None
+
+    def get_original(self, url: str) -> Optional[Image.Image]:
+        """
+        获取缓存的原图（用于海报合成）
+
+        Args:
+            url: 图片URL
+
+        Returns:
+            图片对象，失败返回None
+        """
+        key = self._ensure(url)
+        return self.get_original_by_key(key) if key else None
+
+    def get_original_by_key(self, key: str) -> Optional[Image.Image]:
+        """
+        按存储键读取原图（已被淘汰时返回None）
+
+        Args:
+            key: 存储键
+
+        Returns:
+            图片对象，失败返回None
+        """
+        if key not in self._index:
+            return None
+        self._touch(key)
+        try:
+            with Image.open(self.original_path(key)) as image:
+                image.load()
+                return image.copy()
+        except Exception as e:
+            print(f"读取缓存图片失败：{e}")
+            return None
+
+
+# 等待下载（get_original）与读盘解码的耗时
+tracing.trace_methods(ImageStore, 'image_store', methods=('get_original', 'get_original_by_key', 'put_upload'))
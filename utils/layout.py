@@ -0,0 +1,358 @@
+"""
+海报排版模块
+读取声明式排版模板（JSON/YAML），编译为绘制计划并按模板缓存，渲染时只需执行计划
+"""
+
+import json
+import math
+import os
+import re
+import threading
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+
+from PIL import Image, ImageDraw, ImageFont
+
+from utils import tracing
+
+DEFAULT_TEMPLATE = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "templates", "poster_default.json"
+)
+
+# 尝试多种字体路径
+FONT_PATHS = [
+    # Linux 系统字体
+    "/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf",
+    "/usr/share/fonts/truetype/liberation/LiberationSans-Bold.ttf",
+    "/usr/share/fonts/truetype/droid/DroidSansFallbackFull.ttf",
+    # macOS 系统字体
+    "/System/Library/Fonts/PingFang.ttc",
+    "/System/Library/Fonts/Helvetica.ttc",
+    # Windows 系统字体
+    "C:/Windows/Fonts/simhei.ttf",
+    "C:/Windows/Fonts/msyh.ttc",
+]
+
+# 英文单词和数字作为整体换行，其余字符（中文、标点）逐字换行
+_TOKEN_PATTERN = re.compile(r'[A-Za-z0-9.\-:/%℃]+|\s+|.')
+
+
+@lru_cache(maxsize=None)
+def load_font(size: int):
+    """加载指定字号的字体（按字号缓存，只探测一次字体文件）"""
+    for font_path in FONT_PATHS:
+        try:
+            return ImageFont.truetype(font_path, size)
+        except Exception:
+            continue
+
+    # 如果都失败，使用默认字体
+    print(f"警告：无法加载字体，使用默认字体")
+    return ImageFont.load_default()
+
+
+def _color(value):
+    """模板中的颜色：字符串原样使用，列表转为元组"""
+    return tuple(value) if isinstance(value, list) else value
+
+
+def _wrap(text: str, font, width: int) -> List[str]:
+    """按宽度贪心换行"""
+    lines = []
+    current = ''
+    for token in _TOKEN_PATTERN.findall(text):
+        if token == '\n':
+            lines.append(current)
+            current = ''
+            continue
+        candidate = current + token
+        if not current or font.getlength(candidate) <= width:
+            current = candidate
+            continue
+        lines.append(current.rstrip())
+        current = token.lstrip()
+    if current:
+        lines.append(current)
+    return lines or ['']
+
+
+def _truncate(line: str, font, width: int) -> str:
+    """截断超宽的行并添加省略号"""
+    if font.getlength(line) <= width:
+        return line
+    while line and font.getlength(line + '…') > width:
+        line = line[:-1]
+    return line + '…'
+
+
+@lru_cache(maxsize=2048)
+def fit_text(text: str, font_size: int, min_font_size: int, width: int,
+             max_lines: int) -> Tuple[int, Tuple[str, ...]]:
+    """
+    将文本排进指定宽度：先换行，放不下再逐步缩小字号，最小字号仍放不下则截断
+
+    Args:
+        text: 文本
+        font_size: 首选字号
+        min_font_size: 最小字号
+        width: 可用宽度（像素）
+        max_lines: 最多行数
+
+    Returns:
+        (字号, 各行文本)
+    """
+    size = font_size
+    while True:
+        font = load_font(size)
+        lines = _wrap(text, font, width)
+        if len(lines) <= max_lines or size <= min_font_size:
+            break
+        size = max(min_font_size, size - 2)
+
+    if len(lines) > max_lines:
+        lines = lines[:max_lines]
+        lines[-1] = lines[-1] + '…'
+    lines = [_truncate(line, font, width) for line in lines]
+    return size, tuple(lines)
+
+
+def _layout_lines(lines: Tuple[str, ...], font, box: Tuple[int, int, int, int],
+                  align: str, line_height: int) -> List[Tuple[Tuple[int, int], str]]:
+    """计算每行文本的绘制坐标"""
+    x, y, width, _ = box
+    positioned = []
+    for i, line in enumerate(lines):
+        line_width = font.getlength(line)
+        if align == 'center':
+            line_x = x + (width - line_width) // 2
+        elif align == 'right':
+            line_x = x + width - line_width
+        else:
+            line_x = x
+        positioned.append(((int(line_x), y + i * line_height), line))
+    return positioned
+
+
+class _SafeDict(dict):
+    """格式化时缺失的字段替换为空字符串"""
+
+    def __missing__(self, key):
+        return ''
+
+
+class RectOp:
+    """圆角矩形"""
+
+    def __init__(self, spec: Dict):
+        x, y, width, height = spec['box']
+        self.xy = [(x, y), (x + width, y + height)]
+        self.radius = spec.get('radius', 0)
+        self.fill = _color(spec.get('fill'))
+        self.outline = _color(spec.get('outline'))
+        self.width = spec.get('width', 1)
+
+    def draw(self, poster: Image.Image, draw: ImageDraw.ImageDraw, context: Dict):
+        draw.rounded_rectangle(self.xy, radius=self.radius, fill=self.fill,
+                               outline=self.outline, width=self.width)
+
+
+class TextOp:
+    """文本框：静态文本在编译时完成测量和排版，含占位符的文本在渲染时排版"""
+
+    def __init__(self, spec: Dict):
+        self.text = spec['text']
+        self.box = tuple(spec['box'])
+        self.font_size = spec.get('font_size', 36)
+        self.min_font_size = spec.get('min_font_size', self.font_size)
+        self.max_lines = spec.get('max_lines', 1)
+        self.align = spec.get('align', 'left')
+        self.color = _color(spec.get('color', 'white'))
+        self.line_spacing = spec.get('line_spacing', 1.25)
+
+        # 预测量静态文本
+        self.static = None
+        if '{' not in self.text:
+            self.static = self._layout(self.text)
+
+    def _layout(self, text: str):
+        size, lines = fit_text(text, self.font_size, self.min_font_size, self.box[2], self.max_lines)
+        font = load_font(size)
+        return font, _layout_lines(lines, font, self.box, self.align, int(size * self.line_spacing))
+
+    def draw(self, poster: Image.Image, draw: ImageDraw.ImageDraw, context: Dict):
+        if self.static is not None:
+            font, positioned = self.static
+        else:
+            font, positioned = self._layout(self.text.format_map(_SafeDict(context)))
+        for xy, line in positioned:
+            draw.text(xy, line, fill=self.color, font=font)
+
+
+class VoteOptionsOp:
+    """投票选项区：选项多时自动分多列"""
+
+    def __init__(self, spec: Dict):
+        self.x, self.y, self.width, self.height = spec['box']
+        self.card_height = spec.get('card_height', 80)
+        self.gap = spec.get('gap', 15)
+        self.max_columns = spec.get('max_columns', 3)
+        self.radius = spec.get('radius', 10)
+        self.fill = _color(spec.get('fill', [255, 255, 255]))
+        self.padding = spec.get('padding', 30)
+        self.date_font_size = spec.get('date_font_size', 36)
+        self.weather_font_size = spec.get('weather_font_size', 28)
+        self.min_font_size = spec.get('min_font_size', 20)
+        self.date_color = _color(spec.get('date_color', [50, 50, 50]))
+        self.weather_color = _color(spec.get('weather_color', [100, 100, 100]))
+        self.date_offset = spec.get('date_offset', 15)
+        self.weather_offset = spec.get('weather_offset', 45)
+
+        # 标题是静态文本，编译时排好
+        self.title = None
+        title_height = 0
+        if spec.get('title'):
+            title_height = spec.get('title_height', 70)
+            indent = spec.get('title_indent', 20)
+            self.title = TextOp({
+                'text': spec['title'],
+                'box': [self.x + indent, self.y, self.width - indent, title_height],
+                'font_size': spec.get('title_font_size', 48),
+                'color': spec.get('title_color', 'white'),
+            })
+        self.cards_top = self.y + title_height
+        self.rows_per_column = max(1, (self.height - title_height + self.gap) // (self.card_height + self.gap))
+
+    def columns_for(self, count: int) -> int:
+        """容纳所有选项所需的列数（超过最大列数时多出的选项不显示）"""
+        return max(1, min(self.max_columns, math.ceil(count / self.rows_per_column)))
+
+    def draw(self, poster: Image.Image, draw: ImageDraw.ImageDraw, context: Dict):
+        options = context.get('vote_options') or []
+        if self.title:
+            self.title.draw(poster, draw, context)
+        if not options:
+            return
+
+        columns = self.columns_for(len(options))
+        rows = min(self.rows_per_column, math.ceil(len(options) / columns))
+        column_width = (self.width - self.gap * (columns - 1)) // columns
+        text_width = column_width - self.padding * 2
+
+        # 按列填充，保证日期从上到下连续
+        for i, option in enumerate(options[:rows * columns]):
+            column, row = divmod(i, rows)
+            card_x = self.x + column * (column_width + self.gap)
+            card_y = self.cards_top + row * (self.card_height + self.gap)
+            draw.rounded_rectangle(
+                [(card_x, card_y), (card_x + column_width, card_y + self.card_height)],
+                radius=self.radius,
+                fill=self.fill
+            )
+
+            for text, font_size, offset, color in (
+                (option.get('date', ''), self.date_font_size, self.date_offset, self.date_color),
+                (option.get('weather', ''), self.weather_font_size, self.weather_offset, self.weather_color),
+            ):
+                size, lines = fit_text(text, font_size, self.min_font_size, text_width, 1)
+                draw.text((card_x + self.padding, card_y + offset), lines[0],
+                          fill=color, font=load_font(size))
+
+
+class QRCodeOp:
+    """投票二维码"""
+
+    def __init__(self, spec: Dict):
+        self.x, self.y, self.width, self.height = spec['box']
+
+    def draw(self, poster: Image.Image, draw: ImageDraw.ImageDraw, context: Dict):
+        qr_image = context.get('qrcode')
+        if qr_image is None:
+            return
+        qr_image = qr_image.resize((self.width, self.height))
+        poster.paste(qr_image, (self.x, self.y))
+
+
+OP_TYPES = {
+    'rect': RectOp,
+    'text': TextOp,
+    'vote_options': VoteOptionsOp,
+    'qrcode': QRCodeOp,
+}
+
+
+class DrawPlan:
+    """编译后的绘制计划"""
+
+    def __init__(self, template: Dict):
+        self.width, self.height = template.get('size', [1080, 1920])
+        background = template.get('background', {})
+        self.overlay_color = _color(background.get('overlay'))
+        self.ops = []
+        for spec in template.get('elements', []):
+            op_type = OP_TYPES.get(spec.get('type'))
+            if op_type is None:
+                raise ValueError(f"未知的排版元素类型：{spec.get('type')}")
+            self.ops.append(op_type(spec))
+
+        # 遮罩层只创建一次
+        self.overlay = None
+        if self.overlay_color:
+            self.overlay = Image.new('RGBA', (self.width, self.height), self.overlay_color)
+
+    def render(self, background_image: Optional[Image.Image], context: Dict) -> Image.Image:
+        """
+        执行绘制计划
+
+        Args:
+            background_image: 背景图片
+            context: 模板变量（路线字段、theme、vote_options、qrcode）
+
+        Returns:
+            海报图片
+        """
+        poster = Image.new('RGB', (self.width, self.height), color='white')
+        if background_image is not None:
+            with tracing.span('layout.background', source=f"{background_image.width}x{background_image.height}"):
+                bg_image = background_image.convert('RGB').resize((self.width, self.height))
+                poster.paste(bg_image, (0, 0))
+        if self.overlay is not None:
+            with tracing.span('layout.overlay'):
+                poster.paste(self.overlay, (0, 0), self.overlay)
+
+        draw = ImageDraw.Draw(poster)
+        for op in self.ops:
+            with tracing.span(f"layout.{op.__class__.__name__}"):
+                op.draw(poster, draw, context)
+        return poster
+
+
+_plan_cache: Dict[Tuple[str, float], DrawPlan] = {}
+_plan_lock = threading.Lock()
+
+
+def _read_template(path: str) -> Dict:
+    """读取模板文件"""
+    with open(path, 'r', encoding='utf-8') as f:
+        if path.endswith(('.yaml', '.yml')):
+            import yaml  # 可选依赖，仅YAML模板需要
+            return yaml.safe_load(f)
+        return json.load(f)
+
+
+def load_plan(path: str = DEFAULT_TEMPLATE) -> DrawPlan:
+    """
+    加载并编译排版模板（按文件路径和修改时间缓存）
+
+    Args:
+        path: 模板文件路径
+
+    Returns:
+        绘制计划
+    """
+    key = (os.path.abspath(path), os.path.getmtime(path))
+    with _plan_lock:
+        plan = _plan_cache.get(key)
+        if plan is None:
+            plan = DrawPlan(_read_template(path))
+            _plan_cache[key] = plan
+        return plan
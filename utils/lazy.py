@@ -0,0 +1,90 @@
+"""
+延迟加载模块
+工具类在第一次使用时才导入所在模块并构造（如只浏览路线时不加载PIL、bs4），
+并记录启动各阶段耗时，便于排查首屏变慢
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Tuple
+
+
+class StartupTimer:
+    """启动耗时记录（同名阶段只记录第一次）"""
+
+    def __init__(self):
+        self.phases: List[Tuple[str, float]] = []
+        self._names = set()
+        self._lock = threading.Lock()
+        self._reported = False
+
+    def record(self, name: str, seconds: float):
+        """记录阶段耗时"""
+        with self._lock:
+            if name in self._names:
+                return
+            self._names.add(name)
+            self.phases.append((name, seconds))
+
+    @contextmanager
+    def phase(self, name: str):
+        """计时上下文"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - started)
+
+    def report(self) -> str:
+        """耗时报告（每行一个阶段）"""
+        with self._lock:
+            phases = list(self.phases)
+        width = max((len(name) for name, _ in phases), default=0)
+        return '\n'.join(f"{name.ljust(width)}  {seconds * 1000:8.1f}ms" for name, seconds in phases)
+
+    def print_once(self, title: str = "启动耗时"):
+        """首次调用时打印报告"""
+        with self._lock:
+            if self._reported:
+                return
+            self._reported = True
+        print(f"{title}：\n{self.report()}")
+
+
+class LazyTools:
+    """延迟构造的工具集合：tools['poster'] 第一次访问时才执行对应的构造函数"""
+
+    def __init__(self, factories: Dict[str, Callable[[], object]], timer: StartupTimer = None):
+        """
+        Args:
+            factories: 名称 -> 构造函数（在函数内导入所需模块）
+            timer: 记录首次构造耗时
+        """
+        self._factories = dict(factories)
+        self._instances: Dict[str, object] = {}
+        self._lock = threading.Lock()
+        self._timer = timer
+
+    def __getitem__(self, name: str):
+        instance = self._instances.get(name)
+        if instance is not None:
+            return instance
+        if name not in self._factories:
+            raise KeyError(name)
+        with self._lock:
+            instance = self._instances.get(name)
+            if instance is None:
+                started = time.perf_counter()
+                instance = self._factories[name]()
+                if self._timer is not None:
+                    self._timer.record(f"构造 {name}", time.perf_counter() - started)
+                self._instances[name] = instance
+        return instance
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._factories
+
+    def loaded(self) -> List[str]:
+        """已构造的工具"""
+        return list(self._instances)
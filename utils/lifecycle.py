@@ -0,0 +1,77 @@
+"""
+活动生命周期
+planning（筹备）→ voting（投票中）→ recruiting（招募中）→ confirmed（已成团）→ done（已结束），
+任一未结束的阶段都可以取消（cancelled）；状态变更用条件更新校验，非法变更抛出异常
+"""
+
+from typing import Dict, List
+
+from utils.database import Database
+
+PLANNING = 'planning'
+VOTING = 'voting'
+RECRUITING = 'recruiting'
+CONFIRMED = 'confirmed'
+DONE = 'done'
+CANCELLED = 'cancelled'
+
+STATUS_LABELS = {
+    PLANNING: '筹备中',
+    VOTING: '投票中',
+    RECRUITING: '招募中',
+    CONFIRMED: '已成团',
+    DONE: '已结束',
+    CANCELLED: '已取消',
+}
+
+TRANSITIONS = {
+    PLANNING: {VOTING, CANCELLED},
+    VOTING: {RECRUITING, CANCELLED},
+    RECRUITING: {CONFIRMED, CANCELLED},
+    CONFIRMED: {DONE, CANCELLED},
+    DONE: set(),
+    CANCELLED: set(),
+}
+
+# 需要发送提醒的进行中状态
+ACTIVE_STATUSES = (RECRUITING, CONFIRMED)
+
+
+class InvalidTransition(ValueError):
+    """非法的状态变更"""
+
+
+def can_transition(from_status: str, to_status: str) -> bool:
+    """是否允许从from_status变为to_status"""
+    return to_status in TRANSITIONS.get(from_status, set())
+
+
+def transition(db: Database, activity_id: int, to_status: str, update_data: Dict = None,
+               outbox_messages: List[Dict] = None):
+    """
+    变更活动状态
+
+    Args:
+        db: 数据库
+        activity_id: 活动ID
+        to_status: 新状态
+        update_data: 同时更新的其他字段
+        outbox_messages: 与状态变更在同一事务中写入发件箱的消息
+
+    Raises:
+        InvalidTransition: 活动不存在或当前状态不能变为新状态
+    """
+    from_statuses = [status for status, targets in TRANSITIONS.items() if to_status in targets]
+    if not from_statuses:
+        raise InvalidTransition(f"未知的活动状态：{to_status}")
+
+    if db.transition_activity(activity_id, from_statuses, to_status, update_data, outbox_messages):
+        return
+
+    activity = db.get_activity(activity_id)
+    if not activity:
+        raise InvalidTransition(f"活动不存在：{activity_id}")
+    current = activity['status']
+    raise InvalidTransition(
+        f"活动 #{activity_id} 当前{STATUS_LABELS.get(current, current)}，不能变为{STATUS_LABELS[to_status]}"
+    )
@@ -0,0 +1,218 @@
+"""
+消息模板模块
+模板编译一次并预先生成JSON外壳，渲染时只格式化变量、转义内容；
+发送前按企业微信长度限制（markdown 4096字节）校验，超长消息按行拆分
+"""
+
+import json
+from json.encoder import encode_basestring
+from string import Formatter
+from typing import List, Tuple
+
+# 企业微信消息内容长度上限（UTF-8字节）
+MARKDOWN_MAX_BYTES = 4096
+TEXT_MAX_BYTES = 2048
+
+MAX_BYTES = {
+    'markdown': MARKDOWN_MAX_BYTES,
+    'text': TEXT_MAX_BYTES,
+}
+
+
+def escape_json(text: str) -> str:
+    """JSON字符串转义（不含两侧引号）"""
+    return encode_basestring(text)[1:-1]
+
+
+def _envelope(msgtype: str) -> Tuple[bytes, bytes]:
+    """消息体外壳：内容之前和之后的部分"""
+    prefix, suffix = json.dumps(
+        {"msgtype": msgtype, msgtype: {"content": "\0"}}, ensure_ascii=False
+    ).split('\\u0000')
+    return prefix.encode('utf-8'), suffix.encode('utf-8')
+
+
+_ENVELOPES = {msgtype: _envelope(msgtype) for msgtype in MAX_BYTES}
+
+
+def split_content(content: str, max_bytes: int) -> List[str]:
+    """
+    按行把内容拆成不超过max_bytes字节的若干段（单行超长时按字符拆分）
+
+    Args:
+        content: 消息内容
+        max_bytes: 每段最大字节数
+
+    Returns:
+        各段内容
+    """
+    chunks = []
+    current, current_size = [], 0
+    for line in content.splitlines(keepends=True):
+        size = len(line.encode('utf-8'))
+        if current and current_size + size > max_bytes:
+            chunks.append(''.join(current))
+            current, current_size = [], 0
+        if size <= max_bytes:
+            current.append(line)
+            current_size += size
+            continue
+
+        # 单行超长，逐字符切分
+        for ch in line:
+            ch_size = len(ch.encode('utf-8'))
+            if current_size + ch_size > max_bytes:
+                chunks.append(''.join(current))
+                current, current_size = [], 0
+            current.append(ch)
+            current_size += ch_size
+    if current:
+        chunks.append(''.join(current))
+
+    # 去掉拆分处多余的换行
+    return [chunk.strip('\n') for chunk in chunks if chunk.strip()]
+
+
+def encode_content(content: str, msgtype: str = 'markdown') -> List[bytes]:
+    """
+    序列化消息内容，超过长度限制时拆成多条
+
+    Args:
+        content: 消息内容
+        msgtype: 消息类型（markdown/text）
+
+    Returns:
+        消息体列表
+    """
+    prefix, suffix = _ENVELOPES[msgtype]
+    max_bytes = MAX_BYTES[msgtype]
+    if len(content.encode('utf-8')) <= max_bytes:
+        chunks = [content]
+    else:
+        chunks = split_content(content, max_bytes)
+    return [prefix + escape_json(chunk).encode('utf-8') + suffix for chunk in chunks]
+
+
+class MessageTemplate:
+    """编译后的消息模板（str.format 语法）"""
+
+    def __init__(self, source: str, msgtype: str = 'markdown'):
+        """
+        Args:
+            source: 模板文本，变量使用 {name} / {name:.1f} 形式
+            msgtype: 消息类型（markdown/text）
+        """
+        if msgtype not in MAX_BYTES:
+            raise ValueError(f"不支持的消息类型：{msgtype}")
+        self.source = source
+        self.msgtype = msgtype
+        self.max_bytes = MAX_BYTES[msgtype]
+        self.prefix, self.suffix = _ENVELOPES[msgtype]
+
+        # 编译时解析变量并统计静态文本长度，模板本身超长时直接报错
+        self.fields: List[str] = []
+        static_bytes = 0
+        for literal, field, _, _ in Formatter().parse(source):
+            static_bytes += len(literal.encode('utf-8'))
+            if field is not None:
+                if not field:
+                    raise ValueError("模板变量必须命名")
+                self.fields.append(field)
+        self.static_bytes = static_bytes
+        if static_bytes > self.max_bytes:
+            raise ValueError(f"模板静态内容已超过{self.max_bytes}字节")
+        self._format = source.format_map
+
+    def render(self, **variables) -> str:
+        """渲染消息内容"""
+        return self._format(variables)
+
+    def payloads(self, **variables) -> List[bytes]:
+        """
+        渲染并序列化消息体（直接拼接预先生成的JSON外壳），超过长度限制时按行拆成多条
+
+        Returns:
+            消息体列表（通常只有一条）
+        """
+        content = self._format(variables)
+        if len(content.encode('utf-8')) > self.max_bytes:
+            return encode_content(content, self.msgtype)
+        return [self.prefix + escape_json(content).encode('utf-8') + self.suffix]
+
+
+WELCOME = MessageTemplate("""🎉 欢迎大家加入本次轻徒步活动群！
+
+本次活动信息：
+📍 <font color="warning">路线</font>：{name}
+📅 <font color="info">时间</font>：{activity_date}
+🏃 里程：{distance}公里
+⛰️ 爬升：{elevation}米
+⏱️ 时长：{duration}小时
+💰 费用：公益免费（AA制交通费）
+
+---
+
+📋 常见问题快速入口：
+1. 活动费用多少？
+2. 需要带什么装备？
+3. 集合时间和地点？
+4. 活动难度如何？
+5. 天气怎么样？
+6. 如何报名参加？
+
+<font color="comment">有任何问题请直接在群里提问，机器人小助手会自动回复～</font>""")
+
+VOTE_OPEN = MessageTemplate("📢 活动投票已开启！\n\n请扫描上方二维码或点击下方链接选择活动日期：\n{vote_url}")
+
+VOTE_RESULT = MessageTemplate("""🎉 投票结果公布！
+
+活动日期已确定为：<font color="warning">{selected_date}</font>
+天气预报：<font color="info">{weather}</font>
+
+接下来请留意群内通知，我们会在活动前发布详细安排和集合信息。
+
+<font color="comment">期待与大家一起出发！🚶‍♂️🚶‍♀️</font>""")
+
+ACTIVITY_REMINDER = MessageTemplate("""📢 活动前提醒！
+
+活动时间：<font color="warning">{activity_date}</font>
+
+<font color="info">集合信息</font>：
+- 时间：活动前一天晚上群内通知
+- 地点：待定
+
+<font color="warning">装备清单</font>：
+✅ 徒步鞋（防滑耐磨）
+✅ 双肩背包
+✅ 饮用水（1.5-2L）
+✅ 午餐和零食
+✅ 防晒用品
+✅ 个人常用药品
+
+<font color="comment">请提前做好准备，准时集合！</font>""")
+
+MEETING_REMINDER = MessageTemplate("""📢 明天就出发啦！集合提醒
+
+路线：<font color="warning">{name}</font>
+活动日期：<font color="warning">{activity_date}</font>
+
+<font color="info">集合信息</font>：
+- 时间：{meeting_time}
+- 地点：{meeting_place}
+
+<font color="warning">装备清单</font>：
+✅ 徒步鞋（防滑耐磨）
+✅ 双肩背包
+✅ 饮用水（1.5-2L）
+✅ 午餐和零食
+✅ 防晒用品
+✅ 个人常用药品
+
+<font color="comment">请提前做好准备，准时集合！</font>""")
+
+WEATHER_REMINDER = MessageTemplate("""🌤️ 活动天气提醒
+
+活动时间：<font color="warning">{activity_date}</font>
+{location}天气预报：<font color="info">{weather}</font>
+
+请根据天气准备相应装备，如遇恶劣天气，活动调整会在群内通知。""")
@@ -0,0 +1,349 @@
+"""
+运行指标模块
+进程内的计数器和直方图（数据库方法、外部HTTP请求、海报生成、机器人回复等热点路径），
+以Prometheus文本格式导出，并汇总给管理面板显示
+
+    # Streamlit应用：设置 METRICS_PORT 后在该端口提供 /metrics
+    METRICS_PORT=9108 streamlit run app.py
+    # 投票、机器人、API服务：在服务端口上提供 GET /metrics
+"""
+
+import bisect
+import functools
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# 默认的耗时分桶（秒）
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+LabelKey = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_number(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    """指标基类：按标签值分组"""
+
+    kind = ''
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> LabelKey:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"指标 {self.name} 的标签应为 {self.labelnames}，实际为 {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def render(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    """计数器（只增不减）"""
+
+    kind = 'counter'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelKey, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def values(self) -> Dict[LabelKey, float]:
+        with self._lock:
+            return dict(self._values)
+
+    def render(self) -> List[str]:
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_number(value)}"
+                for key, value in sorted(self.values().items())]
+
+
+class _HistogramState:
+    __slots__ = ('counts', 'sum', 'count')
+
+    def __init__(self, size: int):
+        self.counts = [0] * size
+        self.sum = 0.0
+        self.count = 0
+
+
+class Histogram(_Metric):
+    """直方图（按分桶统计耗时分布，可估算分位数）"""
+
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+        self._states: Dict[LabelKey, _HistogramState] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._states.get(key)
+            if state is None:
+                state = self._states[key] = _HistogramState(len(self.buckets))
+            state.counts[index] += 1
+            state.sum += value
+            state.count += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """计时上下文（出现异常时同样记录）"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def snapshot(self) -> Dict[LabelKey, Tuple[List[int], float, int]]:
+        """各标签的（分桶计数, 总和, 次数）"""
+        with self._lock:
+            return {key: (list(state.counts), state.sum, state.count) for key, state in self._states.items()}
+
+    def quantile(self, counts: List[int], count: int, q: float) -> float:
+        """按分桶线性插值估算分位数"""
+        if not count:
+            return 0.0
+        rank = q * count
+        seen = 0
+        for i, bucket_count in enumerate(counts):
+            if seen + bucket_count >= rank and bucket_count:
+                upper = self.buckets[i]
+                lower = self.buckets[i - 1] if i else 0.0
+                if upper == float('inf'):
+                    return lower
+                return lower + (upper - lower) * (rank - seen) / bucket_count
+            seen += bucket_count
+        return self.buckets[-2]
+
+    def render(self) -> List[str]:
+        lines = []
+        for key, (counts, total, count) in sorted(self.snapshot().items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                le = f'le="{_format_number(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_number(total)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class Registry:
+    """指标注册表"""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def _get_or_create(self, cls, name: str, *args, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, *args, **kwargs)
+            elif not isinstance(metric, cls):
+                raise ValueError(f"指标 {name} 已注册为 {metric.kind}")
+            return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._get_or_create(Counter, name, documentation, labelnames)
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._get_or_create(Histogram, name, documentation, labelnames, buckets)
+
+    def metrics(self) -> List[_Metric]:
+        with self._lock:
+            return sorted(self._metrics.values(), key=lambda metric: metric.name)
+
+    def render(self) -> str:
+        """Prometheus文本格式"""
+        lines = []
+        for metric in self.metrics():
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+    def summary(self) -> List[Dict]:
+        """
+        管理面板用的汇总（直方图给出次数、平均和估算分位数，计数器给出数值）
+
+        Returns:
+            每个指标每组标签一行
+        """
+        rows = []
+        for metric in self.metrics():
+            if isinstance(metric, Histogram):
+                for key, (counts, total, count) in sorted(metric.snapshot().items()):
+                    rows.append({
+                        '指标': metric.name,
+                        '标签': ', '.join(f"{n}={v}" for n, v in zip(metric.labelnames, key)),
+                        '次数': count,
+                        '平均(ms)': round(total / count * 1000, 2) if count else 0,
+                        'p50(ms)': round(metric.quantile(counts, count, 0.5) * 1000, 2),
+                        'p95(ms)': round(metric.quantile(counts, count, 0.95) * 1000, 2),
+                        '合计(s)': round(total, 3),
+                    })
+            else:
+                for key, value in sorted(metric.values().items()):
+                    rows.append({
+                        '指标': metric.name,
+                        '标签': ', '.join(f"{n}={v}" for n, v in zip(metric.labelnames, key)),
+                        '次数': value,
+                    })
+        return rows
+
+
+# 进程内默认注册表
+REGISTRY = Registry()
+
+
+def counter(name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+    return REGISTRY.counter(name, documentation, labelnames)
+
+
+def histogram(name: str, documentation: str, labelnames: Sequence[str] = (),
+              buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+    return REGISTRY.histogram(name, documentation, labelnames, buckets)
+
+
+def render() -> str:
+    return REGISTRY.render()
+
+
+def summary() -> List[Dict]:
+    return REGISTRY.summary()
+
+
+# ==================== 常用指标 ====================
+
+HTTP_SECONDS = histogram('hike_http_client_seconds', '外部HTTP请求耗时', ('service', 'status'))
+
+
+@contextmanager
+def track_http(service: str):
+    """
+    记录一次外部HTTP请求，调用方在拿到响应后设置状态码，未设置（抛出异常）时记为error
+
+        with metrics.track_http('qweather') as call:
+            response = requests.get(...)
+            call['status'] = response.status_code
+    """
+    call = {'status': 'error'}
+    started = time.perf_counter()
+    try:
+        yield call
+    finally:
+        HTTP_SECONDS.observe(time.perf_counter() - started, service=service, status=call['status'])
+
+
+def instrument_methods(cls, seconds: Histogram, errors: Counter, methods: Iterable[str] = None,
+                       exclude: Iterable[str] = ()):
+    """
+    为类的方法记录耗时和异常次数（标签 method 为方法名）
+
+    Args:
+        cls: 要埋点的类
+        seconds: 耗时直方图（标签为 method）
+        errors: 异常计数器（标签为 method）
+        methods: 要埋点的方法，默认为全部公开方法
+        exclude: 不埋点的方法
+    """
+    skipped = set(exclude)
+    names = list(methods) if methods is not None else [name for name in vars(cls) if not name.startswith('_')]
+    for name in names:
+        func = vars(cls).get(name)
+        if name in skipped or not callable(func) or isinstance(func, (staticmethod, classmethod)):
+            continue
+        setattr(cls, name, _timed_method(func, name, seconds, errors))
+
+
+def _timed_method(func: Callable, name: str, seconds: Histogram, errors: Counter) -> Callable:
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        except Exception:
+            errors.inc(method=name)
+            raise
+        finally:
+            seconds.observe(time.perf_counter() - started, method=name)
+    return wrapper
+
+
+# ==================== 导出 ====================
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    registry: Registry = REGISTRY
+
+    def do_GET(self):
+        if self.path.split('?', 1)[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = self.registry.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+_servers: Dict[Tuple[str, int], ThreadingHTTPServer] = {}
+_servers_lock = threading.Lock()
+
+
+def serve_metrics(port: int, host: str = '127.0.0.1') -> Optional[ThreadingHTTPServer]:
+    """
+    在后台线程中提供 GET /metrics（同一端口只启动一次，供没有HTTP服务的进程使用，如Streamlit应用）
+
+    Returns:
+        HTTP服务，端口被占用时返回None
+    """
+    with _servers_lock:
+        server = _servers.get((host, port))
+        if server is not None:
+            return server
+        try:
+            server = ThreadingHTTPServer((host, port), _MetricsHandler)
+        except OSError as e:
+            print(f"指标服务启动失败（{host}:{port}）：{e}")
+            return None
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+        _servers[(host, port)] = server
+        return server
@@ -3,56 +3,39 @@
 根据路线信息、主题词、背景图、投票二维码合成海报
 """
 
-from PIL import Image, ImageDraw, ImageFont
+from PIL import Image
 import qrcode
 from typing import Dict, List, Optional
 import os
-import requests
 from io import BytesIO
-from datetime import datetime
+from utils import metrics, tracing
+from utils.asset_store import AssetStore
+from utils.image_store import ImageStore
+from utils.image_search import ImageSearch
+from utils.layout import DEFAULT_TEMPLATE, load_plan
 
 class PosterGenerator:
     """海报生成器"""
 
-    def __init__(self):
+    def __init__(self, image_store: Optional[ImageStore] = None,
+                 image_search: Optional[ImageSearch] = None, template_path: str = DEFAULT_TEMPLATE,
+                 assets_dir: str = "assets", asset_store: Optional[AssetStore] = None):
         self.poster_width = 1080  # 海报宽度
         self.poster_height = 1920  # 海报高度
-        self.assets_dir = "assets"
+        self.assets_dir = assets_dir
 
         # 确保资源目录存在
         os.makedirs(self.assets_dir, exist_ok=True)
 
-        # 字体设置 - 支持Linux环境
-        self.title_font = self._load_font(72)
-        self.subtitle_font = self._load_font(48)
-        self.content_font = self._load_font(36)
-        self.small_font = self._load_font(28)
-
-    def _load_font(self, size):
-        """加载字体，支持多种系统"""
-        # 尝试多种字体路径
-        font_paths = [
-            # Linux 系统字体
-            "/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf",
-            "/usr/share/fonts/truetype/liberation/LiberationSans-Bold.ttf",
-            "/usr/share/fonts/truetype/droid/DroidSansFallbackFull.ttf",
-            # macOS 系统字体
-            "/System/Library/Fonts/PingFang.ttc",
-            "/System/Library/Fonts/Helvetica.ttc",
-            # Windows 系统字体
-            "C:/Windows/Fonts/simhei.ttf",
-            "C:/Windows/Fonts/msyh.ttc",
-        ]
-
-        for font_path in font_paths:
-            try:
-                return ImageFont.truetype(font_path, size)
-            except:
-                continue
-
-        # 如果都失败，使用默认字体
-        print(f"警告：无法加载字体，使用默认字体")
-        return ImageFont.load_default()
+        # 海报文件仓库（按内容哈希分级存放，未引用的由后台整理任务回收）
+        self.asset_store = asset_store or AssetStore(self.assets_dir)
+        # 背景图片缓存（原图+缩略图）
+        self.image_store = image_store or ImageStore(os.path.join(self.assets_dir, "images"))
+        # 图片搜索后端（按环境变量配置API Key）
+        self.image_search = image_search or ImageSearch.from_env()
+
+        # 海报排版模板（编译结果按模板缓存）
+        self.template_path = template_path
 
     def generate_themes(self, route_info: Dict) -> List[str]:
         """
@@ -112,52 +95,29 @@ class PosterGenerator:
         Returns:
             图片URL列表
         """
-        # 这里使用Pexels API（需要配置API Key）
-        # 暂时返回示例URL，实际需要调用API
-
-        # 临时返回示例URL
-        sample_images = {
-            "春日赏花": [
-                "https://images.pexels.com/photos/1366957/pexels-photo-1366957.jpeg",
-                "https://images.pexels.com/photos/1470726/pexels-photo-1470726.jpeg",
-                "https://images.pexels.com/photos/1856086/pexels-photo-1856086.jpeg"
-            ],
-            "山野徒步": [
-                "https://images.pexels.com/photos/167699/pexels-photo-167699.jpeg",
-                "https://images.pexels.com/photos/1687855/pexels-photo-1687855.jpeg",
-                "https://images.pexels.com/photos/1511311/pexels-photo-1511311.jpeg"
-            ],
-            "周末逃离": [
-                "https://images.pexels.com/photos/162436/pexels-photo-162436.jpeg",
-                "https://images.pexels.com/photos/1408221/pexels-photo-1408221.jpeg",
-                "https://images.pexels.com/photos/1470111/pexels-photo-1470111.jpeg"
-            ],
-            "自然疗愈": [
-                "https://images.pexels.com/photos/1547813/pexels-photo-1547813.jpeg",
-                "https://images.pexels.com/photos/1366919/pexels-photo-1366919.jpeg",
-                "https://images.pexels.com/photos/1444724/pexels-photo-1444724.jpeg"
-            ]
-        }
-
-        if theme in sample_images:
-            return sample_images[theme][:count]
-        else:
-            # 默认图片
-            return [
-                "https://images.pexels.com/photos/167699/pexels-photo-167699.jpeg",
-                "https://images.pexels.com/photos/1687855/pexels-photo-1687855.jpeg",
-                "https://images.pexels.com/photos/1511311/pexels-photo-1511311.jpeg"
-            ][:count]
+        return self.image_search.search(theme, count)
+
+    def prewarm_image_search(self, themes: List[str], count: int = 3):
+        """
+        后台预热主题词的搜索结果，并预取搜索到的图片
+
+        Args:
+            themes: 主题词列表
+            count: 每个主题的图片数量
+        """
+        self.image_search.prewarm(themes, count, on_result=self.image_store.prefetch)
+
+    def prefetch_images(self, urls: List[str]):
+        """后台预取搜索结果图片"""
+        self.image_store.prefetch(urls)
+
+    def get_thumbnail(self, url: str) -> Optional[str]:
+        """获取图片缩略图的本地路径"""
+        return self.image_store.get_thumbnail(url)
 
     def download_image(self, url: str) -> Optional[Image.Image]:
-        """下载图片"""
-        try:
-            response = requests.get(url, timeout=10)
-            if response.status_code == 200:
-                return Image.open(BytesIO(response.content))
-        except Exception as e:
-            print(f"下载图片失败：{e}")
-        return None
+        """下载图片（优先使用本地缓存的原图）"""
+        return self.image_store.get_original(url)
 
     def generate_qrcode(self, vote_url: str) -> Image.Image:
         """
@@ -196,131 +156,75 @@ class PosterGenerator:
         Returns:
             海报文件路径
         """
-        # 创建海报画布
-        poster = Image.new('RGB', (self.poster_width, self.poster_height), color='white')
-        draw = ImageDraw.Draw(poster)
-
-        # 处理背景图（调整大小并添加半透明遮罩）
-        bg_image = background_image.resize((self.poster_width, self.poster_height))
-        bg_image = bg_image.convert('RGBA')
-        bg_image.putalpha(128)  # 半透明
-        poster.paste(bg_image, (0, 0))
-
-        # 添加深色渐变遮罩
-        overlay = Image.new('RGBA', (self.poster_width, self.poster_height), (0, 0, 0, 100))
-        poster.paste(overlay, (0, 0), overlay)
-
-        # 绘制主题词（顶部）
-        theme_text = theme
-        theme_bbox = draw.textbbox((0, 0), theme_text, font=self.title_font)
-        theme_width = theme_bbox[2] - theme_bbox[0]
-        theme_x = (self.poster_width - theme_width) // 2
-        draw.text((theme_x, 100), theme_text, fill='white', font=self.title_font)
-
-        # 绘制路线名称
-        route_name = route_info.get('name', '')
-        name_bbox = draw.textbbox((0, 0), route_name, font=self.subtitle_font)
-        name_width = name_bbox[2] - name_bbox[0]
-        name_x = (self.poster_width - name_width) // 2
-        draw.text((name_x, 200), route_name, fill='white', font=self.subtitle_font)
-
-        # 绘制路线信息（卡片样式）
-        self._draw_route_info_card(draw, route_info, 350)
-
-        # 绘制投票选项
-        self._draw_vote_options(draw, vote_options, 700)
-
-        # 生成并绘制二维码
-        qr_image = self.generate_qrcode(vote_url)
-        qr_size = 250
-        qr_image = qr_image.resize((qr_size, qr_size))
-        qr_x = (self.poster_width - qr_size) // 2
-        qr_y = 1450
-        poster.paste(qr_image, (qr_x, qr_y))
-
-        # 绘制二维码说明
-        qr_text = "扫码选择活动日期"
-        qr_text_bbox = draw.textbbox((0, 0), qr_text, font=self.content_font)
-        qr_text_width = qr_text_bbox[2] - qr_text_bbox[0]
-        qr_text_x = (self.poster_width - qr_text_width) // 2
-        draw.text((qr_text_x, 1720), qr_text, fill='white', font=self.content_font)
-
-        # 绘制底部信息
-        bottom_text = "公益徒步 · 安全第一 · 快乐同行"
-        bottom_bbox = draw.textbbox((0, 0), bottom_text, font=self.small_font)
-        bottom_width = bottom_bbox[2] - bottom_bbox[0]
-        bottom_x = (self.poster_width - bottom_width) // 2
-        draw.text((bottom_x, 1850), bottom_text, fill='white', font=self.small_font)
-
-        # 保存海报
-        timestamp = int(datetime.now().timestamp())
-        filename = f"poster_{timestamp}.png"
-        filepath = os.path.join(self.assets_dir, filename)
-        poster.save(filepath)
+        # 按模板执行绘制计划
+        plan = load_plan(self.template_path)
+        context = dict(route_info)
+        context.update({
+            'theme': theme,
+            'vote_options': vote_options,
+            'qrcode': self.generate_qrcode(vote_url),
+        })
+        with tracing.span('layout.render', ops=len(plan.ops)):
+            poster = plan.render(background_image, context)
+
+        # 保存海报（按内容哈希命名，并发生成的海报互不覆盖）
+        with tracing.span('poster.save') as span:
+            buffer = BytesIO()
+            poster.save(buffer, format='PNG')
+            span.set('bytes', buffer.tell())
+            filepath = self.asset_store.put(buffer.getvalue(), '.png')
 
         return filepath
 
-    def _draw_route_info_card(self, draw: ImageDraw.Draw, route_info: Dict, y: int):
-        """绘制路线信息卡片"""
-        # 卡片背景
-        card_margin = 40
-        card_height = 250
-        draw.rounded_rectangle(
-            [(card_margin, y), (self.poster_width - card_margin, y + card_height)],
-            radius=20,
-            fill='white',
-            outline=(200, 200, 200),
-            width=2
-        )
+    def upload_custom_image(self, uploaded_file) -> Optional[Dict]:
+        """
+        上传自定义图片（保存到本地图片仓库）
 
-        # 路线信息
-        distance = route_info.get('distance', 0)
-        elevation = route_info.get('elevation', 0)
-        duration = route_info.get('duration', 0)
-        difficulty = route_info.get('difficulty', '初级')
-
-        info_text = [
-            f"路线：{route_info.get('name', '')}",
-            f"里程：{distance}公里 | 爬升：{elevation}米",
-            f"时长：{duration}小时 | 难度：{difficulty}"
-        ]
-
-        current_y = y + 50
-        for text in info_text:
-            draw.text((80, current_y), text, fill=(50, 50, 50), font=self.content_font)
-            current_y += 60
-
-    def _draw_vote_options(self, draw: ImageDraw.Draw, vote_options: List[Dict], y: int):
-        """绘制投票选项"""
-        # 标题
-        draw.text((60, y), "活动日期投票", fill='white', font=self.subtitle_font)
-
-        current_y = y + 70
-
-        # 只显示前4个选项
-        for i, option in enumerate(vote_options[:4]):
-            # 选项卡片
-            card_margin = 40
-            card_height = 80
-            card_y = current_y + i * (card_height + 15)
-
-            draw.rounded_rectangle(
-                [(card_margin, card_y), (self.poster_width - card_margin, card_y + card_height)],
-                radius=10,
-                fill=(255, 255, 255, 230)
-            )
-
-            # 选项内容
-            date_text = option.get('date', '')
-            weather_text = option.get('weather', '')
-
-            draw.text((70, card_y + 15), date_text, fill=(50, 50, 50), font=self.content_font)
-            draw.text((70, card_y + 45), weather_text, fill=(100, 100, 100), font=self.small_font)
-
-    def upload_custom_image(self, uploaded_file) -> Optional[Image.Image]:
-        """上传自定义图片"""
+        Returns:
+            背景图引用，失败返回None
+        """
         try:
-            return Image.open(uploaded_file)
+            key = self.image_store.put_upload(uploaded_file.getvalue())
         except Exception as e:
             print(f"上传图片失败：{e}")
             return None
+        return {'key': key} if key else None
+
+    def load_background(self, image_ref: Dict) -> Optional[Image.Image]:
+        """
+        按引用读取背景图（搜索图片引用URL，缓存被淘汰后重新下载；上传图片引用存储键）
+
+        Args:
+            image_ref: 背景图引用 {'url': ...} 或 {'key': ...}
+
+        Returns:
+            图片对象，失败返回None
+        """
+        if image_ref.get('url'):
+            return self.image_store.get_original(image_ref['url'])
+        if image_ref.get('key'):
+            return self.image_store.get_original_by_key(image_ref['key'])
+        return None
+
+    def background_thumbnail(self, image_ref: Dict) -> Optional[str]:
+        """背景图缩略图的本地路径"""
+        if image_ref.get('url'):
+            return self.image_store.get_thumbnail(image_ref['url'])
+        key = image_ref.get('key')
+        if key and os.path.exists(self.image_store.thumbnail_path(key)):
+            return self.image_store.thumbnail_path(key)
+        return None
+
+
+# 海报生成各步骤的耗时和失败次数
+metrics.instrument_methods(
+    PosterGenerator,
+    metrics.histogram('hike_poster_seconds', '海报生成各步骤耗时', ('method',)),
+    metrics.counter('hike_poster_errors_total', '海报生成各步骤异常次数', ('method',)),
+    methods=('search_images', 'download_image', 'load_background', 'generate_qrcode', 'generate_poster'),
+)
+tracing.trace_methods(
+    PosterGenerator, 'poster',
+    methods=('search_images', 'download_image', 'load_background', 'upload_custom_image',
+             'generate_qrcode', 'generate_poster'),
+)
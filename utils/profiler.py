@@ -0,0 +1,357 @@
+"""
+采样分析模块
+在运行中的进程里按固定间隔采集所有线程的调用栈，持续N秒后输出折叠栈（flamegraph.pl）和speedscope文件，
+用于在生产负载下查看页面重跑、SQL和海报渲染的热点，不需要重启进程
+
+采样线程只读取 sys._current_frames()，默认每10ms一次，开销通常在1%以内；未开启时没有任何开销
+
+    HIKE_PROFILER=1 streamlit run app.py       # 侧边栏显示「🩺 采样分析」开关，并监听触发文件
+    echo 30 > data/profile.trigger             # 在服务器上触发一次30秒的采样（文件路径可用 HIKE_PROFILE_TRIGGER 指定）
+
+    python -m utils.profiler data/profiles/xxx.collapsed --top 20   # 自身耗时最多的函数
+"""
+
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+DEFAULT_INTERVAL = 0.01
+DEFAULT_OUTPUT_DIR = 'data/profiles'
+MAX_SECONDS = 600
+
+# 线程空闲等待时的栈顶（默认不计入，只看真正在执行的代码）
+IDLE_LEAVES = {
+    ('threading.py', 'wait'),
+    ('threading.py', '_wait_for_tstate_lock'),
+    ('selectors.py', 'select'),
+    ('queue.py', 'get'),
+    ('socket.py', 'accept'),
+    ('thread.py', '_worker'),
+}
+
+Frame = Tuple[str, str, int]  # (函数名, 文件, 首行号)
+
+
+def _short_path(filename: str) -> str:
+    """项目内文件显示相对路径，第三方和标准库只显示 上级目录/文件名"""
+    try:
+        relative = os.path.relpath(filename)
+        if not relative.startswith('..'):
+            return relative
+    except ValueError:
+        pass
+    parent, name = os.path.split(filename)
+    return f"{os.path.basename(parent)}/{name}"
+
+
+class SamplingProfiler:
+    """调用栈采样器"""
+
+    def __init__(self, interval: float = DEFAULT_INTERVAL, include_idle: bool = False):
+        """
+        Args:
+            interval: 采样间隔（秒）
+            include_idle: 是否计入空闲等待的线程
+        """
+        self.interval = interval
+        self.include_idle = include_idle
+        self.samples: Counter = Counter()  # (线程名, 栈) -> 次数
+        self.ticks = 0
+        self.sampling_seconds = 0.0
+        self.started_at = None
+        self.stopped_at = None
+        self._frames: Dict[object, Frame] = {}
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _frame(self, code) -> Frame:
+        frame = self._frames.get(code)
+        if frame is None:
+            frame = self._frames[code] = (code.co_name, _short_path(code.co_filename), code.co_firstlineno)
+        return frame
+
+    def _sample(self):
+        names = {t.ident: t.name for t in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            name = names.get(ident, f"thread-{ident}")
+            if name.startswith('sampling-profiler'):
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(self._frame(frame.f_code))
+                frame = frame.f_back
+            if not stack:
+                continue
+            leaf = stack[0]
+            if not self.include_idle and (os.path.basename(leaf[1]), leaf[0]) in IDLE_LEAVES:
+                continue
+            stack.reverse()
+            self.samples[(name, tuple(stack))] += 1
+
+    def _run(self, seconds: float):
+        deadline = time.monotonic() + seconds
+        while not self._stop.is_set() and time.monotonic() < deadline:
+            started = time.perf_counter()
+            self._sample()
+            self.ticks += 1
+            elapsed = time.perf_counter() - started
+            self.sampling_seconds += elapsed
+            self._stop.wait(max(self.interval - elapsed, 0))
+        self.stopped_at = time.time()
+
+    def start(self, seconds: float):
+        """在后台线程中采样指定秒数"""
+        self.started_at = time.time()
+        self._thread = threading.Thread(target=self._run, args=(seconds,), name="sampling-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """提前结束并等待采样线程退出"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def join(self, timeout: float = None):
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    @property
+    def duration(self) -> float:
+        if self.started_at is None:
+            return 0.0
+        return (self.stopped_at or time.time()) - self.started_at
+
+    @staticmethod
+    def _label(frame: Frame) -> str:
+        name, filename, line = frame
+        return f"{name} ({filename}:{line})"
+
+    def collapsed(self) -> List[str]:
+        """折叠栈（每行“线程;函数;... 采样次数”）"""
+        lines = []
+        for (thread, stack), count in sorted(self.samples.items(), key=lambda item: -item[1]):
+            path = ';'.join([thread] + [self._label(frame) for frame in stack])
+            lines.append(f"{path.replace(' ', '_')} {count}")
+        return lines
+
+    def speedscope(self, name: str = 'hike-organizer') -> Dict:
+        """speedscope文件（每个线程名一个sampled profile，权重为秒）"""
+        frames: List[Dict] = []
+        index: Dict[Frame, int] = {}
+        per_thread: Dict[str, Tuple[List[List[int]], List[float]]] = {}
+        weight = self.duration / self.ticks if self.ticks else self.interval
+        for (thread, stack), count in self.samples.items():
+            ids = []
+            for frame in stack:
+                if frame not in index:
+                    index[frame] = len(frames)
+                    frames.append({'name': frame[0], 'file': frame[1], 'line': frame[2]})
+                ids.append(index[frame])
+            samples, weights = per_thread.setdefault(thread, ([], []))
+            samples.append(ids)
+            weights.append(round(count * weight, 6))
+        profiles = [
+            {
+                'type': 'sampled',
+                'name': thread,
+                'unit': 'seconds',
+                'startValue': 0,
+                'endValue': round(sum(weights), 6),
+                'samples': samples,
+                'weights': weights,
+            }
+            for thread, (samples, weights) in sorted(per_thread.items(), key=lambda item: -sum(item[1][1]))
+        ]
+        return {
+            '$schema': 'https://www.speedscope.app/file-format-schema.json',
+            'name': name,
+            'exporter': 'utils.profiler',
+            'activeProfileIndex': 0,
+            'shared': {'frames': frames},
+            'profiles': profiles,
+        }
+
+    def save(self, output_dir: str = DEFAULT_OUTPUT_DIR) -> Dict:
+        """
+        写入折叠栈和speedscope文件
+
+        Returns:
+            {'collapsed': 路径, 'speedscope': 路径, 'samples': 采样数, 'seconds': 时长, 'overhead': 采样开销占比}
+        """
+        os.makedirs(output_dir, exist_ok=True)
+        stamp = time.strftime('%Y%m%d_%H%M%S', time.localtime(self.started_at or time.time()))
+        base = os.path.join(output_dir, f"profile_{stamp}_{os.getpid()}")
+        with open(base + '.collapsed', 'w', encoding='utf-8') as f:
+            f.write('\n'.join(self.collapsed()) + '\n')
+        with open(base + '.speedscope.json', 'w', encoding='utf-8') as f:
+            json.dump(self.speedscope(f"hike-organizer {stamp}"), f, ensure_ascii=False)
+        return {
+            'collapsed': base + '.collapsed',
+            'speedscope': base + '.speedscope.json',
+            'samples': sum(self.samples.values()),
+            'seconds': round(self.duration, 1),
+            'overhead': self.sampling_seconds / self.duration if self.duration else 0.0,
+        }
+
+
+# ==================== 进程内采样（同一时间只有一次） ====================
+
+_lock = threading.Lock()
+_active: Optional[SamplingProfiler] = None
+_saver: Optional[threading.Thread] = None
+_last_result: Optional[Dict] = None
+
+
+def start_capture(seconds: float, output_dir: str = DEFAULT_OUTPUT_DIR,
+                  interval: float = DEFAULT_INTERVAL, include_idle: bool = False) -> bool:
+    """
+    开始一次采样，结束后自动写入文件
+
+    Args:
+        seconds: 采样时长（最长10分钟）
+        output_dir: 输出目录
+        interval: 采样间隔（秒）
+        include_idle: 是否计入空闲等待的线程
+
+    Returns:
+        是否已开始（已有采样在进行时返回False）
+    """
+    global _active, _saver
+    seconds = min(max(float(seconds), 1.0), MAX_SECONDS)
+    with _lock:
+        if _active is not None:
+            return False
+        profiler = _active = SamplingProfiler(interval, include_idle)
+    profiler.start(seconds)
+    saver = threading.Thread(target=_finish, args=(profiler, output_dir), name="sampling-profiler-save", daemon=True)
+    with _lock:
+        _saver = saver
+    saver.start()
+    print(f"开始采样分析：{seconds:.0f}秒，间隔{interval * 1000:.0f}ms")
+    return True
+
+
+def _finish(profiler: SamplingProfiler, output_dir: str):
+    global _active, _last_result
+    profiler.join()
+    try:
+        result = profiler.save(output_dir)
+        print(f"采样分析完成：{result['samples']} 个样本，采样开销 {result['overhead']:.2%}，输出 {result['speedscope']}")
+    except OSError as e:
+        result = {'error': str(e)}
+        print(f"写入采样结果失败：{e}")
+    with _lock:
+        _last_result = result
+        _active = None
+
+
+def stop_capture(timeout: float = 10):
+    """提前结束当前采样，并等待已采集的部分写入文件"""
+    with _lock:
+        profiler, saver = _active, _saver
+    if profiler is not None:
+        profiler.stop()
+    if saver is not None:
+        saver.join(timeout)
+
+
+def status() -> Dict:
+    """
+    当前状态
+
+    Returns:
+        {'running': 是否在采样, 'elapsed': 已采样秒数, 'last': 上次结果}
+    """
+    with _lock:
+        profiler, last = _active, _last_result
+    return {
+        'running': profiler is not None,
+        'elapsed': profiler.duration if profiler else 0.0,
+        'last': last,
+    }
+
+
+def watch_trigger(path: str, output_dir: str = DEFAULT_OUTPUT_DIR, default_seconds: float = 30,
+                  poll: float = 1.0) -> threading.Thread:
+    """
+    监听触发文件：文件出现时读取其中的秒数（为空时用默认值）开始采样，并删除文件
+
+    Args:
+        path: 触发文件路径
+        output_dir: 输出目录
+        default_seconds: 默认采样时长
+        poll: 检查间隔（秒）
+    """
+    def watch():
+        while True:
+            time.sleep(poll)
+            if not os.path.exists(path):
+                continue
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    content = f.read().strip()
+                os.remove(path)
+            except OSError:
+                continue  # 其他进程已处理
+            try:
+                seconds = float(content) if content else default_seconds
+            except ValueError:
+                print(f"触发文件内容无效：{content}")
+                continue
+            start_capture(seconds, output_dir)
+
+    thread = threading.Thread(target=watch, name="sampling-profiler-trigger", daemon=True)
+    thread.start()
+    return thread
+
+
+# ==================== 查看 ====================
+
+def top_functions(collapsed_lines: List[str], limit: int = 20) -> List[Tuple[str, int, int]]:
+    """
+    按折叠栈统计函数的自身和累计采样数
+
+    Returns:
+        [(函数, 自身样本数, 累计样本数)]，按自身样本数降序
+    """
+    own: Counter = Counter()
+    total: Counter = Counter()
+    for line in collapsed_lines:
+        path, _, count = line.rstrip().rpartition(' ')
+        if not path:
+            continue
+        frames = path.split(';')[1:]  # 第一项为线程名
+        if not frames:
+            continue
+        own[frames[-1]] += int(count)
+        for frame in set(frames):
+            total[frame] += int(count)
+    return [(frame, count, total[frame]) for frame, count in own.most_common(limit)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="查看采样分析结果")
+    parser.add_argument('path', help="折叠栈文件（.collapsed）")
+    parser.add_argument('--top', type=int, default=20, help="显示前几个函数")
+    args = parser.parse_args()
+
+    with open(args.path, 'r', encoding='utf-8') as f:
+        lines = f.readlines()
+    samples = sum(int(line.rsplit(' ', 1)[1]) for line in lines if line.strip())
+    print(f"共 {samples} 个样本")
+    print(f"{'自身':>7} {'累计':>7}  函数")
+    for frame, own, total in top_functions(lines, args.top):
+        print(f"{own / samples:>7.1%} {total / samples:>7.1%}  {frame.replace('_(', ' (')}")
+
+
+if __name__ == '__main__':
+    main()
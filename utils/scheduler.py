@@ -0,0 +1,180 @@
+"""
+定时任务调度模块
+任务持久化在 scheduled_jobs 表中，内存中按执行时间维护最小堆；
+单个工作线程只在最早的任务到期（或有新任务）时唤醒，进程重启后从数据库恢复；
+其他进程（接口服务、命令行）直接写入数据库的任务，由定期查询最早的执行时间发现
+"""
+
+import heapq
+import json
+import threading
+import time
+import traceback
+from typing import Callable, Dict, List, Optional, Tuple
+
+from utils.database import Database
+from utils.wechat_transport import backoff_delay
+
+# 任务处理函数：接收任务记录（payload 已解析为字典）
+JobHandler = Callable[[Dict], None]
+
+
+class JobScheduler:
+    """定时任务调度器"""
+
+    def __init__(self, db: Database, max_attempts: int = 5, resync_interval: float = 600,
+                 poll_interval: float = 5):
+        """
+        Args:
+            db: 数据库
+            max_attempts: 最多尝试次数，超过后标记为失败
+            resync_interval: 重新从数据库加载全部任务的间隔（秒）
+            poll_interval: 查询最早执行时间的间隔（秒），其他进程安排了更早的任务时立即重新加载
+        """
+        self.db = db
+        self.max_attempts = max_attempts
+        self.resync_interval = resync_interval
+        self.poll_interval = poll_interval
+        self._handlers: Dict[str, JobHandler] = {}
+        self._heap: List[Tuple[float, int]] = []
+        self._queued: set = set()
+        self._cond = threading.Condition()
+        self._stopped = False
+        self._thread: Optional[threading.Thread] = None
+
+    def register(self, job_type: str, handler: JobHandler):
+        """注册任务处理函数"""
+        self._handlers[job_type] = handler
+
+    def _push(self, run_at: float, job_id: int):
+        """加入堆（调用方持有锁），同一任务同一执行时间只保留一项"""
+        if (run_at, job_id) in self._queued:
+            return
+        self._queued.add((run_at, job_id))
+        heapq.heappush(self._heap, (run_at, job_id))
+
+    def schedule(self, job_type: str, activity_id: int, run_at: float, payload: Dict = None) -> int:
+        """
+        安排任务（先写入数据库，再加入内存堆）
+
+        Args:
+            job_type: 任务类型
+            activity_id: 活动ID
+            run_at: 执行时间（时间戳）
+            payload: 任务参数
+
+        Returns:
+            任务ID
+        """
+        job_id = self.db.schedule_job(job_type, activity_id, run_at, payload)
+        with self._cond:
+            self._push(run_at, job_id)
+            self._cond.notify()
+        return job_id
+
+    def cancel(self, activity_id: int, job_types: List[str] = None):
+        """取消活动的任务（堆中的旧项在到期领取时会被跳过）"""
+        self.db.cancel_jobs(activity_id, job_types)
+
+    def resync(self):
+        """从数据库重新加载待执行的任务"""
+        jobs = self.db.get_pending_jobs()
+        with self._cond:
+            for job in jobs:
+                self._push(job['run_at'], job['id'])
+            self._cond.notify()
+
+    def start(self):
+        """启动工作线程"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stopped = False
+        self.resync()
+        self._thread = threading.Thread(target=self._run, name="job-scheduler", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 10):
+        """停止工作线程"""
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+        if self._thread:
+            self._thread.join(timeout)
+
+    def _next_due(self, check_at: float) -> Optional[Tuple[float, int]]:
+        """等待到最早的任务到期，返回该任务；到达检查时间或停止时返回None"""
+        with self._cond:
+            while not self._stopped:
+                now = time.time()
+                if self._heap and self._heap[0][0] <= now:
+                    item = heapq.heappop(self._heap)
+                    self._queued.discard(item)
+                    return item
+                if now >= check_at:
+                    return None
+                wake_at = min(self._heap[0][0], check_at) if self._heap else check_at
+                self._cond.wait(wake_at - now)
+        return None
+
+    def _has_earlier_job(self) -> bool:
+        """数据库中是否有比内存堆中更早的待执行任务（其他进程新安排或改期的任务）"""
+        run_at = self.db.get_next_job_time()
+        if run_at is None:
+            return False
+        with self._cond:
+            return not self._heap or run_at < self._heap[0][0]
+
+    def _run(self):
+        resync_at = time.time() + self.resync_interval
+        while not self._stopped:
+            item = self._next_due(min(time.time() + self.poll_interval, resync_at))
+            if item is None:
+                if not self._stopped:
+                    try:
+                        if time.time() >= resync_at or self._has_earlier_job():
+                            self.resync()
+                            resync_at = time.time() + self.resync_interval
+                    except Exception as e:
+                        print(f"加载定时任务失败：{e}")
+                continue
+            try:
+                self.run_job(*item)
+            except Exception as e:
+                print(f"定时任务调度异常：{e}")
+
+    def run_job(self, run_at: float, job_id: int) -> bool:
+        """
+        领取并执行一个到期任务
+
+        Returns:
+            是否执行了任务（已被重新安排、取消或其他进程领取时为False）
+        """
+        job = self.db.claim_job(job_id, run_at)
+        if job is None:
+            return False
+
+        handler = self._handlers.get(job['job_type'])
+        if handler is None:
+            self.db.fail_job(job_id, f"未注册的任务类型：{job['job_type']}")
+            return True
+
+        job['payload'] = json.loads(job['payload'] or '{}')
+        try:
+            handler(job)
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+            if job['attempts'] < self.max_attempts:
+                retry_at = time.time() + backoff_delay(job['attempts'], base=30, cap=3600)
+                print(f"定时任务执行失败（{job['job_type']} #{job['activity_id']}），稍后重试：{error}")
+                self.db.fail_job(job_id, error, retry_at)
+                with self._cond:
+                    self._push(retry_at, job_id)
+                    self._cond.notify()
+            else:
+                print(f"定时任务执行失败（{job['job_type']} #{job['activity_id']}）：{error}")
+                traceback.print_exc()
+                self.db.fail_job(job_id, error)
+            return True
+
+        self.db.finish_job(job_id)
+        return True
@@ -0,0 +1,435 @@
+"""
+链路追踪模块
+一次操作（如页面上的“生成海报”）记为一条链路，其中的数据库、天气、爬虫、图片、海报、微信调用记为嵌套的span；
+链路结束后按OpenTelemetry OTLP/JSON格式追加到 data/traces.jsonl（每行一条链路），
+并可输出按耗时展开的火焰式分解或折叠栈（flamegraph.pl / speedscope 可直接读取）
+
+只有在 trace() 开启的链路内才记录span，服务和后台线程中的调用没有开销
+
+    HIKE_TRACE_FILE=data/traces.jsonl   # 输出文件
+    HIKE_TRACING=0                      # 关闭追踪
+
+    python -m utils.tracing --last 5                # 最近5条链路的耗时分解
+    python -m utils.tracing --collapsed stacks.txt  # 折叠栈
+"""
+
+import argparse
+import functools
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict, Iterable, List, Optional
+
+SERVICE_NAME = 'hike-organizer'
+SCOPE_NAME = 'utils.tracing'
+
+# 单条链路最多记录的span数（循环中的数据库调用可能很多）
+MAX_SPANS_PER_TRACE = 2000
+
+# OTLP状态码
+STATUS_OK = 1
+STATUS_ERROR = 2
+
+
+class _Trace:
+    """一条链路中已结束的span"""
+
+    __slots__ = ('trace_id', 'spans', 'dropped', 'lock')
+
+    def __init__(self):
+        self.trace_id = uuid.uuid4().hex
+        self.spans: List['Span'] = []
+        self.dropped = 0
+        self.lock = threading.Lock()
+
+
+class Span:
+    """一个计时片段"""
+
+    __slots__ = ('trace', 'name', 'span_id', 'parent_id', 'start_ns', 'end_ns', 'attributes', 'error')
+
+    def __init__(self, trace: _Trace, name: str, parent_id: Optional[str], attributes: Dict):
+        self.trace = trace
+        self.name = name
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent_id
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.attributes = attributes
+        self.error: Optional[str] = None
+
+    def set(self, key: str, value):
+        """设置属性"""
+        self.attributes[key] = value
+
+
+class _NoopSpan:
+    """链路外的span（不记录）"""
+
+    def set(self, key: str, value):
+        pass
+
+
+_NOOP = _NoopSpan()
+_current: ContextVar[Optional[Span]] = ContextVar('hike_span', default=None)
+
+
+# ==================== 导出 ====================
+
+def _otlp_value(value) -> Dict:
+    if isinstance(value, bool):
+        return {'boolValue': value}
+    if isinstance(value, int):
+        return {'intValue': str(value)}
+    if isinstance(value, float):
+        return {'doubleValue': value}
+    return {'stringValue': str(value)}
+
+
+def to_otlp(trace: _Trace) -> Dict:
+    """链路转换为OTLP/JSON（ExportTraceServiceRequest）"""
+    spans = []
+    for span in trace.spans:
+        data = {
+            'traceId': trace.trace_id,
+            'spanId': span.span_id,
+            'name': span.name,
+            'kind': 1,
+            'startTimeUnixNano': str(span.start_ns),
+            'endTimeUnixNano': str(span.end_ns),
+            'attributes': [{'key': k, 'value': _otlp_value(v)} for k, v in span.attributes.items()],
+            'status': {'code': STATUS_ERROR, 'message': span.error} if span.error else {'code': STATUS_OK},
+        }
+        if span.parent_id:
+            data['parentSpanId'] = span.parent_id
+        spans.append(data)
+    resource = [{'key': 'service.name', 'value': {'stringValue': SERVICE_NAME}}]
+    if trace.dropped:
+        resource.append({'key': 'hike.dropped_spans', 'value': {'intValue': str(trace.dropped)}})
+    return {'resourceSpans': [{
+        'resource': {'attributes': resource},
+        'scopeSpans': [{'scope': {'name': SCOPE_NAME}, 'spans': spans}],
+    }]}
+
+
+class FileExporter:
+    """追加写入JSONL文件，超过大小上限时轮转为 .1"""
+
+    def __init__(self, path: str, max_bytes: int = 20 * 1024 * 1024):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+    def export(self, trace: _Trace):
+        line = json.dumps(to_otlp(trace), ensure_ascii=False) + '\n'
+        with self._lock:
+            try:
+                directory = os.path.dirname(self.path)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                if os.path.exists(self.path) and os.path.getsize(self.path) > self.max_bytes:
+                    os.replace(self.path, self.path + '.1')
+                with open(self.path, 'a', encoding='utf-8') as f:
+                    f.write(line)
+            except OSError as e:
+                print(f"写入链路追踪失败：{e}")
+
+
+_exporter: Optional[FileExporter] = None
+if os.getenv('HIKE_TRACING', '1') != '0':
+    _exporter = FileExporter(os.getenv('HIKE_TRACE_FILE', 'data/traces.jsonl'))
+
+
+def configure(path: Optional[str] = None, enabled: bool = True):
+    """设置输出文件或关闭追踪（默认按环境变量配置）"""
+    global _exporter
+    _exporter = FileExporter(path or os.getenv('HIKE_TRACE_FILE', 'data/traces.jsonl')) if enabled else None
+
+
+def trace_file() -> Optional[str]:
+    return _exporter.path if _exporter else None
+
+
+# ==================== 记录 ====================
+
+def _finish(span: Span):
+    span.end_ns = time.time_ns()
+    trace = span.trace
+    with trace.lock:
+        if len(trace.spans) < MAX_SPANS_PER_TRACE:
+            trace.spans.append(span)
+        else:
+            trace.dropped += 1
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """
+    记录一个span（不在链路内时什么也不做）
+
+        with tracing.span('poster.save', size=...) as s:
+            ...
+            s.set('bytes', n)
+    """
+    parent = _current.get()
+    if parent is None:
+        yield _NOOP
+        return
+    current = Span(parent.trace, name, parent.span_id, attributes)
+    token = _current.set(current)
+    try:
+        yield current
+    except Exception as e:
+        current.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        _current.reset(token)
+        _finish(current)
+
+
+@contextmanager
+def trace(name: str, **attributes):
+    """
+    开启一条链路（已在链路内时作为普通span），结束后写入文件
+
+        with tracing.trace('生成海报', route_id=3):
+            ...
+    """
+    if _current.get() is not None:
+        with span(name, **attributes) as current:
+            yield current
+        return
+    if _exporter is None:
+        yield _NOOP
+        return
+
+    root = Span(_Trace(), name, None, attributes)
+    token = _current.set(root)
+    try:
+        yield root
+    except Exception as e:
+        root.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        # Streamlit的 st.rerun()/st.stop() 以BaseException结束脚本，链路照常导出
+        _current.reset(token)
+        _finish(root)
+        exporter = _exporter
+        if exporter is not None:
+            exporter.export(root.trace)
+
+
+def traced(name: str) -> Callable:
+    """装饰器：函数调用记为span"""
+    def decorator(func: Callable) -> Callable:
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _current.get() is None:
+                return func(*args, **kwargs)
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def trace_methods(cls, prefix: str, methods: Iterable[str] = None, exclude: Iterable[str] = ()):
+    """
+    类的方法调用记为span（名称为 前缀.方法名）
+
+    Args:
+        cls: 类
+        prefix: span名称前缀
+        methods: 要追踪的方法，默认为全部公开方法
+        exclude: 不追踪的方法
+    """
+    skipped = set(exclude)
+    names = list(methods) if methods is not None else [name for name in vars(cls) if not name.startswith('_')]
+    for name in names:
+        func = vars(cls).get(name)
+        if name in skipped or not callable(func) or isinstance(func, (staticmethod, classmethod)):
+            continue
+        setattr(cls, name, traced(f"{prefix}.{name}")(func))
+
+
+# ==================== 读取与分解 ====================
+
+def _plain_value(value: Dict):
+    if 'intValue' in value:
+        return int(value['intValue'])
+    for key in ('doubleValue', 'boolValue', 'stringValue'):
+        if key in value:
+            return value[key]
+    return None
+
+
+def parse_line(line: str) -> Optional[Dict]:
+    """
+    解析一行OTLP/JSON
+
+    Returns:
+        {'trace_id', 'name', 'start_ns', 'duration_ms', 'spans': [...]}，无法解析时返回None
+    """
+    try:
+        data = json.loads(line)
+        spans = []
+        for resource_spans in data['resourceSpans']:
+            for scope_spans in resource_spans['scopeSpans']:
+                for raw in scope_spans['spans']:
+                    spans.append({
+                        'name': raw['name'],
+                        'span_id': raw['spanId'],
+                        'parent_id': raw.get('parentSpanId'),
+                        'start_ns': int(raw['startTimeUnixNano']),
+                        'end_ns': int(raw['endTimeUnixNano']),
+                        'attributes': {a['key']: _plain_value(a['value']) for a in raw.get('attributes', [])},
+                        'error': (raw.get('status') or {}).get('message'),
+                    })
+    except (ValueError, KeyError, TypeError):
+        return None
+    root = next((s for s in spans if not s['parent_id']), None)
+    if root is None:
+        return None
+    return {
+        'trace_id': data['resourceSpans'][0]['scopeSpans'][0]['spans'][0]['traceId'],
+        'name': root['name'],
+        'start_ns': root['start_ns'],
+        'duration_ms': (root['end_ns'] - root['start_ns']) / 1e6,
+        'spans': spans,
+    }
+
+
+def load_traces(path: str = None, limit: int = 20, tail_bytes: int = 2 * 1024 * 1024) -> List[Dict]:
+    """
+    读取最近的链路（只读取文件末尾，新的在前）
+
+    Args:
+        path: 链路文件，默认为当前输出文件
+        limit: 最多返回条数
+        tail_bytes: 从文件末尾读取的字节数
+    """
+    path = path or trace_file()
+    if not path or not os.path.exists(path):
+        return []
+    with open(path, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        f.seek(max(0, size - tail_bytes))
+        content = f.read().decode('utf-8', errors='ignore')
+    lines = content.splitlines()
+    if size > tail_bytes:
+        lines = lines[1:]  # 第一行可能不完整
+    traces = []
+    for line in reversed(lines):
+        parsed = parse_line(line)
+        if parsed:
+            traces.append(parsed)
+            if len(traces) >= limit:
+                break
+    return traces
+
+
+def _children(spans: List[Dict]) -> Dict[Optional[str], List[Dict]]:
+    children: Dict[Optional[str], List[Dict]] = {}
+    for s in sorted(spans, key=lambda s: s['start_ns']):
+        children.setdefault(s['parent_id'], []).append(s)
+    return children
+
+
+def breakdown(trace: Dict, width: int = 24, min_ms: float = 0.0) -> str:
+    """
+    火焰式耗时分解：按调用层级缩进，显示耗时、占比、自身耗时和比例条；同名的兄弟span合并显示
+
+    Args:
+        trace: load_traces 返回的链路
+        width: 比例条宽度
+        min_ms: 低于该耗时的节点不显示
+    """
+    children = _children(trace['spans'])
+    total = max(trace['duration_ms'], 1e-9)
+    lines = []
+
+    def walk(parent_id: Optional[str], depth: int):
+        groups: Dict[str, List[Dict]] = {}
+        for s in children.get(parent_id, []):
+            groups.setdefault(s['name'], []).append(s)
+        for name, group in groups.items():
+            ms = sum((s['end_ns'] - s['start_ns']) / 1e6 for s in group)
+            if ms < min_ms:
+                continue
+            child_ms = sum((c['end_ns'] - c['start_ns']) / 1e6
+                           for s in group for c in children.get(s['span_id'], []))
+            label = ('  ' * depth + name + (f" ×{len(group)}" if len(group) > 1 else ''))
+            if any(s['error'] for s in group):
+                label += ' ✗'
+            bar = '█' * max(1, round(width * ms / total))
+            lines.append(f"{label:<40} {ms:>9.1f}ms {ms / total:>5.0%}  自身 {max(ms - child_ms, 0):>8.1f}ms  {bar}")
+            if len(group) == 1:
+                walk(group[0]['span_id'], depth + 1)
+            else:
+                # 合并显示的span，子节点按名称汇总
+                merged = [c for s in group for c in children.get(s['span_id'], [])]
+                if merged:
+                    key = f"merged:{group[0]['span_id']}"
+                    children[key] = merged
+                    walk(key, depth + 1)
+
+    walk(None, 0)
+    return '\n'.join(lines)
+
+
+def collapsed(traces: List[Dict]) -> List[str]:
+    """
+    折叠栈（每行“根;子;孙 自身耗时微秒”，相同栈合并）
+    """
+    totals: Dict[str, int] = {}
+    for trace in traces:
+        children = _children(trace['spans'])
+
+        def walk(s: Dict, stack: str):
+            path = f"{stack};{s['name']}" if stack else s['name']
+            kids = children.get(s['span_id'], [])
+            own = (s['end_ns'] - s['start_ns']) - sum(c['end_ns'] - c['start_ns'] for c in kids)
+            totals[path] = totals.get(path, 0) + max(own, 0) // 1000
+            for c in kids:
+                walk(c, path)
+
+        for root in children.get(None, []):
+            walk(root, '')
+    return [f"{path.replace(' ', '_')} {us}" for path, us in totals.items() if us > 0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="链路追踪")
+    parser.add_argument('--file', default=os.getenv('HIKE_TRACE_FILE', 'data/traces.jsonl'), help="链路文件")
+    parser.add_argument('--last', type=int, default=5, help="显示最近几条链路")
+    parser.add_argument('--name', help="只看指定操作")
+    parser.add_argument('--min-ms', type=float, default=0.1, help="隐藏耗时低于该值的节点")
+    parser.add_argument('--collapsed', metavar='PATH', help="把最近的链路输出为折叠栈文件")
+    args = parser.parse_args()
+
+    traces = load_traces(args.file, limit=10000 if args.name else args.last)
+    if args.name:
+        traces = [t for t in traces if t['name'] == args.name][:args.last]
+    if not traces:
+        print(f"没有链路记录：{args.file}")
+        return
+
+    if args.collapsed:
+        with open(args.collapsed, 'w', encoding='utf-8') as f:
+            f.write('\n'.join(collapsed(traces)) + '\n')
+        print(f"已输出 {len(traces)} 条链路的折叠栈：{args.collapsed}")
+        return
+
+    for t in traces:
+        started = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(t['start_ns'] / 1e9))
+        print(f"== {t['name']}  {started}  {t['duration_ms']:.1f}ms  trace={t['trace_id']}")
+        print(breakdown(t, min_ms=args.min_ms))
+        print()
+
+
+if __name__ == '__main__':
+    main()
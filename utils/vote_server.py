@@ -0,0 +1,448 @@
+"""
+投票服务
+海报二维码指向的投票页面：GET /vote/{活动ID} 显示选项，POST 投票；
+投票人以服务端签发的Cookie标识（打开投票页面时签发，HMAC签名，没有有效Cookie的投票被拒绝），
+选票写入 ballots 表（每人每活动一票），票数原子累加；
+GET /tally/{活动ID}?since=版本号&wait=秒 增量获取票数（可长轮询等待变化）
+
+运行（签名密钥取 HIKE_VOTE_SECRET，未设置时在数据库目录下生成 vote_secret 文件）：
+    python -m utils.vote_server --port 8082
+压测（本地启动服务和模拟投票人）：
+    python -m utils.vote_server --bench 500 --concurrency 50
+"""
+
+import argparse
+import asyncio
+import hashlib
+import hmac
+import html
+import json
+import os
+import re
+import secrets
+import signal
+import tempfile
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from http.cookies import SimpleCookie
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qs
+
+from utils.async_http import AsyncHTTPClient, AsyncHTTPServer, Request, Response, metrics_handler, wait_for_server
+from utils.database import Database
+
+VOTER_COOKIE = 'hike_voter'
+VOTER_COOKIE_MAX_AGE = 90 * 24 * 3600
+# 服务端签发的投票人Cookie：uuid4 十六进制标识.HMAC签名，格式不符或签名错误的Cookie视为没有
+VOTER_COOKIE_PATTERN = re.compile(r'([0-9a-f]{32})\.([0-9a-f]{64})')
+
+RESULT_MESSAGES = {
+    'ok': '投票成功，感谢参与！',
+    'duplicate': '你已经投过票了，每人只能投一次',
+    'invalid': '投票选项无效',
+    'closed': '投票未开放或已截止',
+}
+
+_PAGE_STYLE = """<style>
+body{font-family:-apple-system,"PingFang SC","Microsoft YaHei",sans-serif;max-width:560px;margin:0 auto;padding:16px;background:#f5f7f5}
+h1{font-size:22px;color:#2e7d32}.option{display:block;background:#fff;border-radius:10px;padding:14px;margin:10px 0}
+.weather{color:#777;font-size:14px}.count{float:right;color:#2e7d32}
+button{width:100%;padding:14px;font-size:18px;border:0;border-radius:10px;background:#2e7d32;color:#fff}
+.notice{background:#fff;border-radius:10px;padding:14px;margin:10px 0}
+</style>"""
+
+
+def vote_url_for(base_url: str, activity_id: int) -> str:
+    """活动的投票地址"""
+    return f"{base_url.rstrip('/')}/vote/{activity_id}"
+
+
+def _page(title: str, body: str) -> str:
+    return (f'<!DOCTYPE html><html lang="zh-CN"><head><meta charset="utf-8">'
+            f'<meta name="viewport" content="width=device-width,initial-scale=1">'
+            f'<title>{html.escape(title)}</title>{_PAGE_STYLE}</head><body>{body}</body></html>')
+
+
+def _load_secret(db: Database) -> str:
+    """数据库目录下的签名密钥文件（不存在时生成），重启后已签发的Cookie仍然有效"""
+    path = os.path.join(os.path.dirname(os.path.abspath(db.db_path)), 'vote_secret')
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        pass
+    secret = secrets.token_hex(32)
+    try:
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    except FileExistsError:
+        return _load_secret(db)  # 另一个进程刚生成
+    with os.fdopen(fd, 'w', encoding='utf-8') as f:
+        f.write(secret)
+    return secret
+
+
+class VoteServer:
+    """投票服务"""
+
+    def __init__(self, db: Database, cache_ttl: float = 5, secret: Optional[str] = None):
+        """
+        Args:
+            db: 数据库
+            cache_ttl: 活动和选项的缓存时间（秒），票数每次实时读取
+            secret: 投票人Cookie的签名密钥，默认取 HIKE_VOTE_SECRET，未设置时使用数据库目录下的 vote_secret 文件
+        """
+        self.db = db
+        self.cache_ttl = cache_ttl
+        self._secret = (secret or os.getenv('HIKE_VOTE_SECRET') or _load_secret(db)).encode('utf-8')
+        self._activities: Dict[int, Tuple[float, Optional[Dict]]] = {}
+        # 写入在单线程中串行执行，避免并发写事务争抢数据库锁；读取使用独立线程池
+        self._write_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="vote-writer")
+        self._pending: List[Tuple[Tuple[int, int, str], asyncio.Future]] = []
+        self._writing = False
+        # 长轮询等待中的活动：活动ID -> 事件、等待数，最后一个等待者结束时删除
+        self._tally_events: Dict[int, asyncio.Event] = {}
+        self._tally_waiters: Dict[int, int] = {}
+        self._read_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="vote-reader")
+
+        self.http = AsyncHTTPServer()
+        self.http.route('GET', '/vote/', self.handle_page)
+        self.http.route('POST', '/vote/', self.handle_vote)
+        self.http.route('GET', '/tally/', self.handle_tally)
+        self.http.route('GET', '/healthz', self.handle_health)
+        self.http.route('GET', '/metrics', metrics_handler)
+
+    async def _read(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._read_executor, func, *args)
+
+    async def _cast(self, activity_id: int, vote_id: int, voter_id: str) -> str:
+        """
+        投票（合并提交：写入进行中到达的选票攒成一批，在下一个事务中一起提交）
+        """
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append(((activity_id, vote_id, voter_id), future))
+        if not self._writing:
+            self._writing = True
+            asyncio.get_running_loop().create_task(self._write_pending())
+        return await future
+
+    async def _write_pending(self):
+        loop = asyncio.get_running_loop()
+        try:
+            while self._pending:
+                batch, self._pending = self._pending, []
+                try:
+                    results = await loop.run_in_executor(
+                        self._write_executor, self.db.cast_ballots, [ballot for ballot, _ in batch]
+                    )
+                except Exception as e:
+                    for _, future in batch:
+                        future.set_exception(e)
+                    continue
+                for (_, future), result in zip(batch, results):
+                    future.set_result(result)
+                self._notify_tally({ballot[0] for (ballot, _), result in zip(batch, results) if result == 'ok'})
+        finally:
+            self._writing = False
+
+    def _notify_tally(self, activity_ids):
+        """唤醒等待这些活动票数变化的长轮询请求"""
+        for activity_id in activity_ids:
+            event = self._tally_events.pop(activity_id, None)
+            if event is not None:
+                event.set()
+
+    async def _activity(self, activity_id: int) -> Optional[Dict]:
+        """获取活动（短时间缓存，投票高峰时不必每次查询）"""
+        cached = self._activities.get(activity_id)
+        if cached and cached[0] > time.monotonic():
+            return cached[1]
+        activity = await self._read(self.db.get_activity, activity_id)
+        if activity:
+            # 不存在的活动不缓存，任意ID的请求不会让缓存无限增长
+            self._activities[activity_id] = (time.monotonic() + self.cache_ttl, activity)
+        return activity
+
+    @staticmethod
+    def _activity_id(request: Request) -> int:
+        return int(request.path.rstrip('/').rsplit('/', 1)[-1])
+
+    def _sign(self, voter_id: str) -> str:
+        return hmac.new(self._secret, voter_id.encode('utf-8'), hashlib.sha256).hexdigest()
+
+    def _voter(self, request: Request) -> Optional[str]:
+        """从Cookie读取服务端签发的投票人标识，没有、格式不符或签名错误时返回None"""
+        cookie = SimpleCookie()
+        try:
+            cookie.load(request.headers.get('cookie', ''))
+        except Exception:
+            return None  # 格式错误的Cookie按没有处理
+        morsel = cookie.get(VOTER_COOKIE)
+        match = VOTER_COOKIE_PATTERN.fullmatch(morsel.value) if morsel else None
+        if match and hmac.compare_digest(match.group(2), self._sign(match.group(1))):
+            return match.group(1)
+        return None
+
+    def _cookie_header(self, voter_id: str) -> Dict[str, str]:
+        return {'Set-Cookie': f"{VOTER_COOKIE}={voter_id}.{self._sign(voter_id)}; Max-Age={VOTER_COOKIE_MAX_AGE}; "
+                              f"Path=/; HttpOnly; SameSite=Lax"}
+
+    def _render(self, activity: Dict, tally: Dict, ballot: Optional[Dict], notice: str = '') -> str:
+        voted_id = ballot['vote_id'] if ballot else None
+        rows = []
+        for option in tally['options']:
+            checked = ' checked' if option['id'] == voted_id else ''
+            disabled = ' disabled' if ballot else ''
+            rows.append(
+                f'<label class="option"><input type="radio" name="vote_id" value="{option["id"]}"'
+                f'{checked}{disabled} required> {html.escape(option["vote_date"] or "")}'
+                f'<span class="count">{option["vote_count"] or 0}票</span>'
+                f'<div class="weather">{html.escape(option["weather"] or "")}</div></label>'
+            )
+
+        body = [f'<h1>{html.escape(activity["name"])}</h1>']
+        if notice:
+            body.append(f'<div class="notice">{html.escape(notice)}</div>')
+        body.append(f'<form method="post">{"".join(rows)}')
+        if not ballot and activity['status'] == 'voting':
+            body.append('<button type="submit">投票</button>')
+        body.append(f'</form><p class="weather">共 {tally["total"]} 人参与投票</p>')
+        return _page(activity['name'], ''.join(body))
+
+    async def handle_page(self, request: Request) -> Response:
+        activity_id = self._activity_id(request)
+        activity = await self._activity(activity_id)
+        if not activity:
+            return Response.text(_page('投票不存在', '<h1>投票不存在</h1>'), 404, 'text/html; charset=utf-8')
+
+        voter_id = self._voter(request)
+        is_new = voter_id is None
+        if is_new:
+            voter_id = uuid.uuid4().hex
+        tally = await self._read(self.db.get_vote_tally, activity_id)
+        ballot = None if is_new else await self._read(self.db.get_ballot, activity_id, voter_id)
+        notice = '' if activity['status'] == 'voting' else RESULT_MESSAGES['closed']
+
+        response = Response.text(self._render(activity, tally, ballot, notice),
+                                 content_type='text/html; charset=utf-8')
+        if is_new:
+            response.headers.update(self._cookie_header(voter_id))
+        return response
+
+    async def handle_vote(self, request: Request) -> Response:
+        """投票：表单提交返回页面，JSON请求（{"vote_id": ...}）返回JSON；投票人只按投票页面签发的Cookie识别"""
+        activity_id = self._activity_id(request)
+        voter_id = self._voter(request)
+        is_json = request.headers.get('content-type', '').startswith('application/json')
+
+        if voter_id is None:
+            # 没有有效Cookie不能投票（丢弃Cookie不能重复投票），表单提交转回投票页面领取Cookie
+            if is_json:
+                return Response.json({'error': '请先打开投票页面'}, 403)
+            return Response(status=303, headers={'Location': request.path})
+
+        if is_json:
+            data = request.json()
+            vote_id = int(data['vote_id'])
+        else:
+            vote_id = int(parse_qs(request.body.decode('utf-8'))['vote_id'][0])
+
+        result = await self._cast(activity_id, vote_id, voter_id)
+
+        if is_json:
+            return Response.json({'result': result, 'message': RESULT_MESSAGES[result]},
+                                 200 if result in ('ok', 'duplicate') else 409)
+
+        activity = await self._activity(activity_id)
+        if not activity:
+            return Response.text(_page('投票不存在', '<h1>投票不存在</h1>'), 404, 'text/html; charset=utf-8')
+        tally = await self._read(self.db.get_vote_tally, activity_id)
+        ballot = await self._read(self.db.get_ballot, activity_id, voter_id)
+        return Response.text(self._render(activity, tally, ballot, RESULT_MESSAGES[result]),
+                             content_type='text/html; charset=utf-8')
+
+    async def handle_tally(self, request: Request) -> Response:
+        """增量票数：返回since之后变化的选项；没有变化且指定了wait时等待变化或超时"""
+        activity_id = self._activity_id(request)
+        since = int(request.query.get('since', -1))
+        wait = min(float(request.query.get('wait', 0)), 30)
+        if wait <= 0:
+            return Response.json(await self._read(self.db.get_tally_changes, activity_id, since))
+        if not await self._activity(activity_id):
+            return Response.json({'error': f"活动不存在：{activity_id}"}, 404)
+
+        # 先取等待事件再查询，避免查询后、等待前的变化被漏掉
+        event = self._tally_events.get(activity_id)
+        if event is None:
+            event = self._tally_events[activity_id] = asyncio.Event()
+        self._tally_waiters[activity_id] = self._tally_waiters.get(activity_id, 0) + 1
+        try:
+            result = await self._read(self.db.get_tally_changes, activity_id, since)
+            if not result['changes']:
+                try:
+                    await asyncio.wait_for(event.wait(), wait)
+                except asyncio.TimeoutError:
+                    return Response.json(result)
+                result = await self._read(self.db.get_tally_changes, activity_id, since)
+            return Response.json(result)
+        finally:
+            waiters = self._tally_waiters.pop(activity_id) - 1
+            if waiters:
+                self._tally_waiters[activity_id] = waiters
+            else:
+                self._tally_events.pop(activity_id, None)
+
+    async def handle_health(self, request: Request) -> Response:
+        return Response.json({'status': 'ok'})
+
+    async def serve(self, host: str = '0.0.0.0', port: int = 8082):
+        """启动服务并一直运行"""
+        loop = asyncio.get_running_loop()
+        server = await self.http.start(host, port)
+        try:
+            loop.add_signal_handler(signal.SIGTERM, server.close)
+        except (NotImplementedError, RuntimeError):
+            pass
+        print(f"投票服务已启动：http://{host}:{port}/vote/<活动ID>")
+        try:
+            async with server:
+                await server.serve_forever()
+        except asyncio.CancelledError:
+            pass
+        finally:
+            self._write_executor.shutdown()
+            self._read_executor.shutdown()
+
+
+# ==================== 模拟投票人压测 ====================
+
+def _percentile(sorted_values: List[float], p: float) -> float:
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * p))]
+
+
+async def run_bench(url: str, vote_ids: List[int], voters: int, concurrency: int,
+                    duplicate_ratio: float = 0.1) -> Dict:
+    """
+    模拟投票高峰：voters个投票人各投一票，其中一部分重复提交
+    每个投票人先打开投票页拿到服务端签发的Cookie（不计入耗时），投票时带上各自的Cookie
+
+    Returns:
+        压测结果（吞吐量、延迟分位数、各结果数量）
+    """
+    cookie_jars: Dict[int, str] = {}
+    opening = iter(range(voters))
+
+    async def open_page():
+        for voter in opening:
+            client = AsyncHTTPClient(timeout=30, max_idle_per_host=0)
+            try:
+                _, headers, _ = await client.request('GET', url)
+                cookie_jars[voter] = headers.get('set-cookie', '').split(';', 1)[0]
+            except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError):
+                pass
+            finally:
+                await client.close()
+
+    await asyncio.gather(*(open_page() for _ in range(concurrency)))
+
+    requests_plan = [(i, vote_ids[i % len(vote_ids)]) for i in range(voters)]
+    requests_plan += requests_plan[:int(voters * duplicate_ratio)]
+    latencies: List[float] = []
+    results: Dict[str, int] = {}
+    pending = iter(requests_plan)
+
+    async def worker():
+        # 每个投票人是独立的手机，使用独立连接
+        for voter, vote_id in pending:
+            client = AsyncHTTPClient(timeout=30, max_idle_per_host=0)
+            body = json.dumps({'vote_id': vote_id}).encode('utf-8')
+            headers = {'Content-Type': 'application/json', 'Cookie': cookie_jars.get(voter, '')}
+            start = time.perf_counter()
+            try:
+                _, _, content = await client.request('POST', url, body, headers)
+                result = json.loads(content)['result']
+            except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, ValueError, KeyError):
+                result = 'error'
+            finally:
+                await client.close()
+            latencies.append(time.perf_counter() - start)
+            results[result] = results.get(result, 0) + 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        'requests': len(requests_plan),
+        'concurrency': concurrency,
+        'elapsed': round(elapsed, 3),
+        'throughput': round(len(latencies) / elapsed, 1) if elapsed else 0,
+        'p50_ms': round(_percentile(latencies, 0.50) * 1000, 2),
+        'p99_ms': round(_percentile(latencies, 0.99) * 1000, 2),
+        'results': results,
+    }
+
+
+def _serve_process(db_path: str, host: str, port: int):
+    try:
+        asyncio.run(VoteServer(Database(db_path)).serve(host, port))
+    except KeyboardInterrupt:
+        pass
+
+
+def bench(voters: int, concurrency: int, host: str = '127.0.0.1', port: int = 18082) -> Dict:
+    """使用临时数据库启动服务并压测，最后核对票数"""
+    import multiprocessing
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db = Database(os.path.join(tmp, 'bench.db'))
+        activity_id = db.insert_activity({
+            'name': '压测活动',
+            'status': 'voting',
+            'vote_deadline': datetime.now() + timedelta(days=1),
+        })
+        db.insert_vote_options(activity_id, [
+            {'date': f'2026-11-{day:02d}（周六）', 'weather': '晴'} for day in (7, 14, 21, 28)
+        ])
+        vote_ids = [option['id'] for option in db.get_vote_options(activity_id)]
+
+        process = multiprocessing.Process(target=_serve_process, args=(db.db_path, host, port), daemon=True)
+        process.start()
+        try:
+            base_url = f'http://{host}:{port}'
+            asyncio.run(wait_for_server(base_url + '/healthz'))
+            result = asyncio.run(run_bench(vote_url_for(base_url, activity_id), vote_ids, voters, concurrency))
+        finally:
+            process.terminate()
+            process.join(5)
+
+        result['tally_total'] = db.get_vote_tally(activity_id)['total']
+        result['consistent'] = result['tally_total'] == voters
+        return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="投票服务")
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=8082)
+    parser.add_argument('--db', default='data/hike.db', help="数据库路径")
+    parser.add_argument('--bench', type=int, metavar='N', help="使用临时数据库压测，模拟N个投票人")
+    parser.add_argument('--concurrency', type=int, default=50, help="压测并发数")
+    args = parser.parse_args()
+
+    if args.bench:
+        print(json.dumps(bench(args.bench, args.concurrency), ensure_ascii=False, indent=2))
+        return
+
+    try:
+        asyncio.run(VoteServer(Database(args.db)).serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
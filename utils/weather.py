@@ -8,6 +8,8 @@ from typing import List, Dict, Optional
 from datetime import datetime, timedelta
 import calendar
 
+from utils import metrics, tracing
+
 class WeatherAPI:
     """天气API"""
 
@@ -43,7 +45,9 @@ class WeatherAPI:
                 'key': self.api_key
             }
 
-            response = requests.get(url, params=params, timeout=10)
+            with metrics.track_http('qweather') as call:
+                response = requests.get(url, params=params, timeout=10)
+                call['status'] = response.status_code
 
             if response.status_code == 200:
                 data = response.json()
@@ -121,3 +125,6 @@ class WeatherAPI:
             })
 
         return options
+
+
+tracing.trace_methods(WeatherAPI, 'weather', methods=('get_weather', 'generate_vote_options'))
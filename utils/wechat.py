@@ -3,62 +3,118 @@
 通过企业微信机器人发送消息到微信群
 """
 
-import requests
-import json
-from typing import Dict, List, Optional
+import contextvars
+import os
+import time
+import zlib
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, List, Optional, Union
+from urllib.parse import parse_qs, urlsplit
+
+from utils import tracing
+from utils.message_templates import (ACTIVITY_REMINDER, MEETING_REMINDER, VOTE_OPEN, VOTE_RESULT, WEATHER_REMINDER,
+                                     WELCOME, MessageTemplate, encode_content)
+from utils.wechat_media import MediaCache
+from utils.wechat_transport import SendQueue, WeChatTransport
+
+# 广播的消息：已序列化的消息体（超长消息拆成的多条），
+# 或按webhook生成消息体的函数（如需按机器人上传素材、按群填充模板变量）
+Payload = Union[bytes, List[bytes]]
+BroadcastMessage = Union[Payload, Callable[[str], Optional[Payload]]]
+
+
+def mask_webhook(webhook_url: str) -> str:
+    """隐藏webhook中的key，用于展示"""
+    parts = urlsplit(webhook_url)
+    key = parse_qs(parts.query).get('key', [''])[0]
+    return f"{parts.netloc}（key …{key[-6:]}）" if key else parts.netloc
 
 class WeChatBot:
     """企业微信机器人"""
 
-    def __init__(self, webhook_url: str):
+    def __init__(self, webhook_url: str, transport: Optional[WeChatTransport] = None,
+                 send_queue: Optional[SendQueue] = None, media_cache: Optional[MediaCache] = None):
         """
         初始化机器人
 
         Args:
             webhook_url: 企业微信机器人的webhook地址
+            transport: 发送通道（连接复用、限流、重试），默认新建
+            send_queue: 后台发送队列，默认新建
+            media_cache: 图片消息体和media_id缓存，默认新建
         """
         self.webhook_url = webhook_url
+        self.transport = transport or WeChatTransport()
+        self.send_queue = send_queue or SendQueue()
+        self.media_cache = media_cache or MediaCache()
 
-    def send_text(self, content: str) -> bool:
+    def _post_content(self, content: str, msgtype: str, label: str) -> bool:
         """
-        发送文本消息
+        通过发送通道投递文本/Markdown消息（超长时拆成多条）
 
         Args:
             content: 消息内容
+            msgtype: 消息类型
+            label: 消息类型名称（用于日志）
 
         Returns:
             是否发送成功
         """
+        return self._post_payloads(encode_content(content, msgtype), label)
+
+    def _post_payloads(self, payloads: List[bytes], label: str) -> bool:
+        """按顺序投递多条消息体，遇到失败即停止"""
         if not self.webhook_url:
             print("未配置企业微信Webhook地址")
             return False
+        return all(self._post_body(body, label) for body in payloads)
+
+    def _post_body(self, body: bytes, label: str) -> bool:
+        """投递已序列化的消息体"""
+        with tracing.span('wechat.post', label=label, bytes=len(body)) as span:
+            result = self.transport.post(self.webhook_url, body)
+            span.set('errcode', result.get('errcode', -1))
+        if result.get('errcode') == 0:
+            print(f"{label}发送成功")
+            return True
+        print(f"{label}发送失败：{result.get('errmsg')}")
+        return False
+
+    def for_webhook(self, webhook_url: str) -> 'WeChatBot':
+        """
+        创建发往另一个群的机器人（共享发送通道、后台队列和素材缓存）
 
-        data = {
-            "msgtype": "text",
-            "text": {
-                "content": content
-            }
-        }
+        Args:
+            webhook_url: 企业微信机器人的webhook地址
 
-        try:
-            response = requests.post(
-                self.webhook_url,
-                headers={'Content-Type': 'application/json'},
-                data=json.dumps(data, ensure_ascii=False).encode('utf-8'),
-                timeout=10
-            )
-
-            result = response.json()
-            if result.get('errcode') == 0:
-                print("文本消息发送成功")
-                return True
-            else:
-                print(f"文本消息发送失败：{result.get('errmsg')}")
-                return False
-
-        except Exception as e:
-            print(f"发送消息异常：{e}")
-            return False
+        Returns:
+            机器人实例
+        """
+        return WeChatBot(webhook_url, self.transport, self.send_queue, self.media_cache)
+
+    def send_in_background(self, func: Callable, *args, **kwargs) -> Future:
+        """
+        在后台发送队列中执行发送操作，立即返回
+
+        Args:
+            func: 本机器人的发送方法，如 bot.send_poster_with_qrcode
+
+        Returns:
+            发送结果的Future（结果为是否发送成功）
+        """
+        return self.send_queue.submit(self.webhook_url or '', func, *args, **kwargs)
+
+    def send_text(self, content: str) -> bool:
+        """
+        发送文本消息
+
+        Args:
+            content: 消息内容
+
+        Returns:
+            是否发送成功
+        """
+        return self._post_content(content, "text", "文本消息")
 
     def send_image(self, image_path: str) -> bool:
         """
@@ -74,38 +130,20 @@ class WeChatBot:
             print("未配置企业微信Webhook地址")
             return False
 
-        # 企业微信机器人发送图片需要先上传素材获取media_id
-        # 这里简化处理，使用Markdown格式的图片链接
-        # 实际使用时需要调用上传素材接口
+        if not os.path.isfile(image_path):
+            print(f"图片文件不存在：{image_path}")
+            return False
 
-        # 临时方案：发送图片的Markdown格式
-        # 注意：这需要图片可以被公开访问
-        data = {
-            "msgtype": "markdown",
-            "markdown": {
-                "content": f"![海报]({image_path})"
-            }
-        }
+        # 优先发送图片消息（base64+md5），同一张海报发往多个群只编码一次
+        body = self.media_cache.image_payload(image_path)
+        if body is not None:
+            return self._post_body(body, "图片消息")
 
-        try:
-            response = requests.post(
-                self.webhook_url,
-                headers={'Content-Type': 'application/json'},
-                data=json.dumps(data, ensure_ascii=False).encode('utf-8'),
-                timeout=10
-            )
-
-            result = response.json()
-            if result.get('errcode') == 0:
-                print("图片消息发送成功")
-                return True
-            else:
-                print(f"图片消息发送失败：{result.get('errmsg')}")
-                return False
-
-        except Exception as e:
-            print(f"发送图片异常：{e}")
+        # 无法作为图片消息发送时，上传素材后以文件消息发送
+        media_id = self.media_cache.upload(self.webhook_url, image_path)
+        if not media_id:
             return False
+        return self._post_body(self.media_cache.file_payload(media_id), "文件消息")
 
     def send_markdown(self, content: str) -> bool:
         """
@@ -117,36 +155,30 @@ class WeChatBot:
         Returns:
             是否发送成功
         """
-        if not self.webhook_url:
-            print("未配置企业微信Webhook地址")
-            return False
-
-        data = {
-            "msgtype": "markdown",
-            "markdown": {
-                "content": content
-            }
+        return self._post_content(content, "markdown", "Markdown消息")
+
+    @staticmethod
+    def _welcome_variables(route_info: Dict, activity_date: str) -> Dict:
+        return {
+            'name': route_info.get('name', ''),
+            'activity_date': activity_date,
+            'distance': route_info.get('distance', 0),
+            'elevation': route_info.get('elevation', 0),
+            'duration': route_info.get('duration', 0),
         }
 
-        try:
-            response = requests.post(
-                self.webhook_url,
-                headers={'Content-Type': 'application/json'},
-                data=json.dumps(data, ensure_ascii=False).encode('utf-8'),
-                timeout=10
-            )
-
-            result = response.json()
-            if result.get('errcode') == 0:
-                print("Markdown消息发送成功")
-                return True
-            else:
-                print(f"Markdown消息发送失败：{result.get('errmsg')}")
-                return False
-
-        except Exception as e:
-            print(f"发送消息异常：{e}")
-            return False
+    def welcome_message(self, route_info: Dict, activity_date: str) -> str:
+        """
+        生成活动群欢迎消息
+
+        Args:
+            route_info: 路线信息
+            activity_date: 活动日期
+
+        Returns:
+            Markdown内容
+        """
+        return WELCOME.render(**self._welcome_variables(route_info, activity_date))
 
     def send_welcome_message(self, route_info: Dict, activity_date: str) -> bool:
         """
@@ -159,29 +191,8 @@ class WeChatBot:
         Returns:
             是否发送成功
         """
-        message = f"""🎉 欢迎大家加入本次轻徒步活动群！
-
-本次活动信息：
-📍 <font color="warning">路线</font>：{route_info.get('name', '')}
-📅 <font color="info">时间</font>：{activity_date}
-🏃 里程：{route_info.get('distance', 0)}公里
-⛰️ 爬升：{route_info.get('elevation', 0)}米
-⏱️ 时长：{route_info.get('duration', 0)}小时
-💰 费用：公益免费（AA制交通费）
-
----
-
-📋 常见问题快速入口：
-1. 活动费用多少？
-2. 需要带什么装备？
-3. 集合时间和地点？
-4. 活动难度如何？
-5. 天气怎么样？
-6. 如何报名参加？
-
-<font color="comment">有任何问题请直接在群里提问，机器人小助手会自动回复～</font>"""
-
-        return self.send_markdown(message)
+        return self._post_payloads(WELCOME.payloads(**self._welcome_variables(route_info, activity_date)),
+                                   "Markdown消息")
 
     def send_poster_with_qrcode(self, poster_path: str, vote_url: str) -> bool:
         """
@@ -199,8 +210,120 @@ class WeChatBot:
             return False
 
         # 发送投票说明
-        message = f"📢 活动投票已开启！\n\n请扫描上方二维码或点击下方链接选择活动日期：\n{vote_url}"
-        return self.send_markdown(message)
+        return self._post_payloads(VOTE_OPEN.payloads(vote_url=vote_url), "Markdown消息")
+
+    def _deliver(self, webhook_url: str, messages: List[BroadcastMessage]) -> Dict:
+        """按顺序向单个群发送一组消息，遇到失败即停止"""
+        start = time.time()
+        report = {'success': True, 'sent': 0, 'errmsg': ''}
+        for message in messages:
+            payload = message(webhook_url) if callable(message) else message
+            if payload is None:
+                report.update(success=False, errmsg='消息生成失败')
+                break
+            for body in ([payload] if isinstance(payload, bytes) else payload):
+                with tracing.span('wechat.post', label='广播', bytes=len(body)) as span:
+                    result = self.transport.post(webhook_url, body)
+                    span.set('errcode', result.get('errcode', -1))
+                if result.get('errcode') != 0:
+                    report.update(success=False, errmsg=result.get('errmsg', ''))
+                    break
+                report['sent'] += 1
+            if not report['success']:
+                break
+        report['elapsed'] = round(time.time() - start, 3)
+        return report
+
+    def broadcast(self, targets: Iterable[str], messages: List[BroadcastMessage],
+                  max_workers: int = 16) -> Dict[str, Dict]:
+        """
+        向多个群并发发送同一组消息（每个webhook单独限流）
+
+        Args:
+            targets: webhook地址列表
+            messages: 按顺序发送的消息，消息体只序列化一次
+            max_workers: 并发发送的群数
+
+        Returns:
+            每个webhook的发送报告：success、sent（成功条数）、errmsg、elapsed（秒）
+        """
+        targets = list(dict.fromkeys(t for t in targets if t))
+        if not targets:
+            print("未配置企业微信Webhook地址")
+            return {}
+
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(targets))) as executor:
+            # 每个群各复制一份当前上下文，发送线程中的span记入调用方的链路
+            futures = [executor.submit(contextvars.copy_context().run, self._deliver, target, messages)
+                       for target in targets]
+            report = {target: future.result() for target, future in zip(targets, futures)}
+
+        succeeded = sum(1 for r in report.values() if r['success'])
+        print(f"广播完成：{succeeded}/{len(targets)} 个群发送成功")
+        return report
+
+    def broadcast_poster_with_qrcode(self, targets: Iterable[str], poster_path: str,
+                                     vote_url: str) -> Dict[str, Dict]:
+        """
+        向多个群发布海报和投票链接
+
+        Args:
+            targets: webhook地址列表
+            poster_path: 海报文件路径
+            vote_url: 投票链接
+
+        Returns:
+            每个webhook的发送报告
+        """
+        if not os.path.isfile(poster_path):
+            print(f"图片文件不存在：{poster_path}")
+            return {t: {'success': False, 'sent': 0, 'errmsg': '海报文件不存在', 'elapsed': 0}
+                    for t in targets}
+
+        poster = self.media_cache.image_payload(poster_path)
+        if poster is None:
+            # 无法作为图片消息时，素材需按机器人分别上传
+            def poster(webhook_url: str) -> Optional[bytes]:
+                media_id = self.media_cache.upload(webhook_url, poster_path)
+                return self.media_cache.file_payload(media_id) if media_id else None
+
+        return self.broadcast(targets, [poster, VOTE_OPEN.payloads(vote_url=vote_url)])
+
+    def broadcast_template(self, targets: Iterable[str], template: MessageTemplate, variables: Dict,
+                           per_target: Optional[Dict[str, Dict]] = None) -> Dict[str, Dict]:
+        """
+        向多个群广播模板消息
+
+        Args:
+            targets: webhook地址列表
+            template: 已编译的消息模板
+            variables: 公共模板变量
+            per_target: 各群单独的模板变量（webhook地址 -> 变量），覆盖公共变量
+
+        Returns:
+            每个webhook的发送报告
+        """
+        if not per_target:
+            # 各群内容相同，只渲染一次
+            return self.broadcast(targets, [template.payloads(**variables)])
+
+        def render(webhook_url: str) -> List[bytes]:
+            return template.payloads(**{**variables, **per_target.get(webhook_url, {})})
+
+        return self.broadcast(targets, [render])
+
+    def vote_result_message(self, selected_date: str, weather: str) -> str:
+        """
+        生成投票结果消息
+
+        Args:
+            selected_date: 选中的日期
+            weather: 天气情况
+
+        Returns:
+            Markdown内容
+        """
+        return VOTE_RESULT.render(selected_date=selected_date, weather=weather)
 
     def send_vote_result(self, selected_date: str, weather: str) -> bool:
         """
@@ -213,16 +336,21 @@ class WeChatBot:
         Returns:
             是否发送成功
         """
-        message = f"""🎉 投票结果公布！
+        return self._post_payloads(VOTE_RESULT.payloads(selected_date=selected_date, weather=weather),
+                                   "Markdown消息")
 
-活动日期已确定为：<font color="warning">{selected_date}</font>
-天气预报：<font color="info">{weather}</font>
-
-接下来请留意群内通知，我们会在活动前发布详细安排和集合信息。
+    def activity_reminder_message(self, activity_date: str, route_info: Dict) -> str:
+        """
+        生成活动提醒消息
 
-<font color="comment">期待与大家一起出发！🚶‍♂️🚶‍♀️</font>"""
+        Args:
+            activity_date: 活动日期
+            route_info: 路线信息
 
-        return self.send_markdown(message)
+        Returns:
+            Markdown内容
+        """
+        return ACTIVITY_REMINDER.render(activity_date=activity_date)
 
     def send_activity_reminder(self, activity_date: str, route_info: Dict) -> bool:
         """
@@ -235,22 +363,66 @@ class WeChatBot:
         Returns:
             是否发送成功
         """
-        message = f"""📢 活动前提醒！
+        return self._post_payloads(ACTIVITY_REMINDER.payloads(activity_date=activity_date), "Markdown消息")
+
+    def meeting_reminder_message(self, activity_date: str, activity: Dict, route_info: Dict) -> str:
+        """
+        生成活动前一天的集合提醒消息
+
+        Args:
+            activity_date: 活动日期
+            activity: 活动信息（meeting_time、meeting_place 未填写时显示待定或路线地点）
+            route_info: 路线信息
+
+        Returns:
+            Markdown内容
+        """
+        return MEETING_REMINDER.render(
+            name=route_info.get('name') or activity.get('name') or '',
+            activity_date=activity_date,
+            meeting_time=activity.get('meeting_time') or '待定，请留意群内通知',
+            meeting_place=activity.get('meeting_place') or route_info.get('location') or '待定，请留意群内通知',
+        )
+
+    def weather_reminder_message(self, activity_date: str, location: str, weather: str) -> str:
+        """
+        生成活动天气提醒消息
+
+        Args:
+            activity_date: 活动日期
+            location: 地点
+            weather: 天气预报
+
+        Returns:
+            Markdown内容
+        """
+        return WEATHER_REMINDER.render(activity_date=activity_date, location=location, weather=weather)
 
-活动时间：<font color="warning">{activity_date}</font>
+    def outbox_messages(self, content: str, idempotency_key: str) -> List[Dict]:
+        """
+        生成写入发件箱的Markdown消息（交给 Database.insert_activity / enqueue_outbox）
 
-<font color="info">集合信息</font>：
-- 时间：活动前一天晚上群内通知
-- 地点：待定
+        Args:
+            content: Markdown内容，超长时拆成多条，按顺序投递
+            idempotency_key: 幂等键，可包含 {activity_id} 占位符；会附加webhook标识，
+                同一消息发往不同群互不影响
 
-<font color="warning">装备清单</font>：
-✅ 徒步鞋（防滑耐磨）
-✅ 双肩背包
-✅ 饮用水（1.5-2L）
-✅ 午餐和零食
-✅ 防晒用品
-✅ 个人常用药品
+        Returns:
+            发件箱消息列表
+        """
+        key = f"{idempotency_key}:{zlib.crc32(self.webhook_url.encode('utf-8')):08x}"
+        return [
+            {
+                'webhook_url': self.webhook_url,
+                'payload': payload,
+                'idempotency_key': key if i == 0 else f"{key}:{i + 1}",
+            }
+            for i, payload in enumerate(encode_content(content, "markdown"))
+        ]
 
-<font color="comment">请提前做好准备，准时集合！</font>"""
 
-        return self.send_markdown(message)
+tracing.trace_methods(
+    WeChatBot, 'wechat',
+    methods=('send_text', 'send_image', 'send_markdown', 'send_welcome_message', 'send_poster_with_qrcode',
+             'broadcast', 'broadcast_poster_with_qrcode', 'broadcast_template'),
+)
@@ -0,0 +1,230 @@
+"""
+企业微信素材模块
+图片消息（base64+md5）按文件内容缓存消息体，大文件通过upload_media流式上传并缓存media_id
+"""
+
+import base64
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from io import BytesIO
+from typing import Dict, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+import requests
+
+from utils import metrics
+
+# 图片消息限制：jpg/png，不超过2M
+IMAGE_MAX_BYTES = 2 * 1024 * 1024
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+# media_id有效期3天，提前1小时视为过期
+MEDIA_TTL = 3 * 24 * 3600 - 3600
+
+CHUNK_SIZE = 64 * 1024
+
+
+def file_digests(path: str) -> Tuple[str, str]:
+    """
+    分块计算文件的sha256和md5（不把整个文件读入内存）
+
+    Returns:
+        (sha256, md5)
+    """
+    sha256 = hashlib.sha256()
+    md5 = hashlib.md5()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            sha256.update(chunk)
+            md5.update(chunk)
+    return sha256.hexdigest(), md5.hexdigest()
+
+
+def upload_url_for(webhook_url: str, media_type: str = 'file') -> Optional[str]:
+    """根据发送地址拼出上传素材地址"""
+    parts = urlsplit(webhook_url)
+    key = parse_qs(parts.query).get('key', [None])[0]
+    if not key:
+        return None
+    path = parts.path.rsplit('/', 1)[0] + '/upload_media'
+    return f"{parts.scheme}://{parts.netloc}{path}?key={key}&type={media_type}"
+
+
+class MultipartFileStream:
+    """multipart/form-data 请求体的流式读取器
+
+    提供 read() 和 len，requests 会据此设置 Content-Length 并分块发送文件内容
+    """
+
+    def __init__(self, path: str, field: str = 'media'):
+        self.boundary = uuid.uuid4().hex
+        filename = os.path.basename(path)
+        file_size = os.path.getsize(path)
+        self._head = (
+            f"--{self.boundary}\r\n"
+            f"Content-Disposition: form-data; name=\"{field}\"; filename=\"{filename}\"; filelength={file_size}\r\n"
+            f"Content-Type: application/octet-stream\r\n\r\n"
+        ).encode('utf-8')
+        self._tail = f"\r\n--{self.boundary}--\r\n".encode('utf-8')
+        self.len = len(self._head) + file_size + len(self._tail)
+        self._parts = [BytesIO(self._head), open(path, 'rb'), BytesIO(self._tail)]
+
+    @property
+    def content_type(self) -> str:
+        return f"multipart/form-data; boundary={self.boundary}"
+
+    def read(self, size: int = -1) -> bytes:
+        if size is None or size < 0:
+            size = CHUNK_SIZE
+        while self._parts:
+            data = self._parts[0].read(size)
+            if data:
+                return data
+            self._parts.pop(0).close()
+        return b''
+
+    def close(self):
+        for part in self._parts:
+            part.close()
+        self._parts = []
+
+
+class MediaCache:
+    """图片消息体与media_id缓存"""
+
+    def __init__(self, max_payloads: int = 8, upload_timeout: float = 60):
+        """
+        Args:
+            max_payloads: 最多缓存的图片消息体数量（每个约为图片大小的4/3）
+            upload_timeout: 上传素材超时（秒）
+        """
+        self.max_payloads = max_payloads
+        self.upload_timeout = upload_timeout
+        self._payloads: "OrderedDict[str, bytes]" = OrderedDict()
+        self._media_ids: Dict[Tuple[str, str], Tuple[str, float]] = {}
+        self._lock = threading.Lock()
+        self._session = requests.Session()
+
+    def image_payload(self, image_path: str) -> Optional[bytes]:
+        """
+        生成图片消息体（已序列化），同一内容的图片只编码一次
+
+        Args:
+            image_path: 图片路径（jpg/png，不超过2M）
+
+        Returns:
+            消息体，不满足图片消息限制时返回None
+        """
+        if not image_path.lower().endswith(IMAGE_EXTENSIONS):
+            return None
+
+        sha256, md5 = file_digests(image_path)
+        with self._lock:
+            payload = self._payloads.get(sha256)
+            if payload is not None:
+                self._payloads.move_to_end(sha256)
+                return payload
+
+        if os.path.getsize(image_path) <= IMAGE_MAX_BYTES:
+            # 按3字节的整数倍分块编码，拼接结果与整体编码一致
+            encoded = []
+            with open(image_path, 'rb') as f:
+                for chunk in iter(lambda: f.read(CHUNK_SIZE * 3), b''):
+                    encoded.append(base64.b64encode(chunk))
+            encoded = b''.join(encoded)
+        else:
+            # 超过2M的海报转成JPEG压缩后再发送
+            data = self._shrink(image_path)
+            if data is None:
+                return None
+            md5 = hashlib.md5(data).hexdigest()
+            encoded = base64.b64encode(data)
+
+        payload = (
+            b'{"msgtype":"image","image":{"base64":"' + encoded
+            + b'","md5":"' + md5.encode('ascii') + b'"}}'
+        )
+
+        with self._lock:
+            self._payloads[sha256] = payload
+            while len(self._payloads) > self.max_payloads:
+                self._payloads.popitem(last=False)
+        return payload
+
+    @staticmethod
+    def _shrink(image_path: str) -> Optional[bytes]:
+        """将图片压缩为不超过2M的JPEG"""
+        from PIL import Image
+
+        try:
+            with Image.open(image_path) as image:
+                image = image.convert('RGB')
+        except Exception as e:
+            print(f"读取图片失败：{e}")
+            return None
+
+        for quality in (90, 80, 70, 60, 50):
+            buffer = BytesIO()
+            image.save(buffer, format='JPEG', quality=quality, optimize=True)
+            if buffer.tell() <= IMAGE_MAX_BYTES:
+                return buffer.getvalue()
+        return None
+
+    def upload(self, webhook_url: str, file_path: str) -> Optional[str]:
+        """
+        上传文件素材，获取media_id（同一机器人、同一内容在有效期内只上传一次）
+
+        Args:
+            webhook_url: 机器人webhook地址
+            file_path: 文件路径
+
+        Returns:
+            media_id，失败返回None
+        """
+        upload_url = upload_url_for(webhook_url)
+        if not upload_url:
+            print("Webhook地址中缺少key，无法上传素材")
+            return None
+
+        sha256, _ = file_digests(file_path)
+        cache_key = (upload_url, sha256)
+        with self._lock:
+            cached = self._media_ids.get(cache_key)
+            if cached and cached[1] > time.time():
+                return cached[0]
+
+        stream = MultipartFileStream(file_path)
+        try:
+            with metrics.track_http('wecom_upload') as call:
+                response = self._session.post(
+                    upload_url,
+                    data=stream,
+                    headers={'Content-Type': stream.content_type},
+                    timeout=self.upload_timeout
+                )
+                call['status'] = response.status_code
+            result = response.json()
+        except (requests.RequestException, ValueError) as e:
+            print(f"上传素材异常：{e}")
+            return None
+        finally:
+            stream.close()
+
+        if result.get('errcode') != 0:
+            print(f"上传素材失败：{result.get('errmsg')}")
+            return None
+
+        media_id = result['media_id']
+        with self._lock:
+            self._media_ids[cache_key] = (media_id, time.time() + MEDIA_TTL)
+        return media_id
+
+    @staticmethod
+    def file_payload(media_id: str) -> bytes:
+        """文件消息体"""
+        return json.dumps({"msgtype": "file", "file": {"media_id": media_id}}).encode('utf-8')
@@ -0,0 +1,284 @@
+"""
+企业微信发送通道
+复用keep-alive连接、按webhook令牌桶限流（每个机器人20条/分钟）、失败抖动退避重试、后台发送队列
+"""
+
+import asyncio
+import json
+import queue
+import random
+import threading
+import time
+import zlib
+from concurrent.futures import Future
+from typing import Callable, Dict, List
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from utils import metrics
+from utils.async_http import AsyncHTTPClient
+
+# 企业微信接口调用频率超限
+ERRCODE_RATE_LIMITED = 45009
+
+# 每个机器人每分钟最多20条消息
+DEFAULT_RATE = 20 / 60
+DEFAULT_BURST = 20
+
+# 消息发送结果：ok / rate_limited（重试）/ failed（接口返回错误或网络异常）
+MESSAGES_TOTAL = metrics.counter('hike_wechat_messages_total', '企业微信消息发送结果', ('result',))
+
+
+def _count_result(result: Dict):
+    if result.get('errcode') == 0:
+        MESSAGES_TOTAL.inc(result='ok')
+    elif result.get('errcode') == ERRCODE_RATE_LIMITED:
+        MESSAGES_TOTAL.inc(result='rate_limited')
+    else:
+        MESSAGES_TOTAL.inc(result='failed')
+
+
+class TokenBucket:
+    """令牌桶限流器（线程安全）"""
+
+    def __init__(self, rate: float = DEFAULT_RATE, capacity: int = DEFAULT_BURST):
+        """
+        Args:
+            rate: 每秒补充的令牌数
+            capacity: 令牌桶容量（允许的突发数）
+        """
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def reserve(self) -> float:
+        """
+        预订一个令牌
+
+        Returns:
+            需要等待的秒数（0表示可立即发送）
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self._tokens -= 1
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens / self.rate
+
+    def acquire(self):
+        """阻塞直到取得令牌"""
+        wait = self.reserve()
+        if wait > 0:
+            time.sleep(wait)
+
+    def penalize(self):
+        """服务端返回限流时清空令牌，让后续请求一起等待"""
+        with self._lock:
+            self._refill(time.monotonic())
+            self._tokens = min(self._tokens, 0.0)
+
+
+def backoff_delay(attempt: int, base: float = 1.0, cap: float = 30.0) -> float:
+    """第attempt次重试前的等待时间（指数退避+随机抖动）"""
+    return min(cap, base * (2 ** attempt)) * random.uniform(0.5, 1.5)
+
+
+def encode_payload(data: Dict) -> bytes:
+    """序列化消息体"""
+    return json.dumps(data, ensure_ascii=False).encode('utf-8')
+
+
+class WeChatTransport:
+    """企业微信webhook发送通道（同步）"""
+
+    def __init__(self, timeout: float = 10, max_retries: int = 3,
+                 rate: float = DEFAULT_RATE, burst: int = DEFAULT_BURST, pool_size: int = 32):
+        """
+        Args:
+            timeout: 单次请求超时（秒）
+            max_retries: 限流或网络错误时的最大重试次数
+            rate: 每个webhook每秒允许的消息数
+            burst: 每个webhook允许的突发消息数
+            pool_size: 连接池大小
+        """
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.rate = rate
+        self.burst = burst
+
+        self.session = requests.Session()
+        self.session.headers.update({'Content-Type': 'application/json'})
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        self._buckets: Dict[str, TokenBucket] = {}
+        self._buckets_lock = threading.Lock()
+
+    def bucket(self, webhook_url: str) -> TokenBucket:
+        """获取webhook对应的令牌桶"""
+        with self._buckets_lock:
+            bucket = self._buckets.get(webhook_url)
+            if bucket is None:
+                bucket = TokenBucket(self.rate, self.burst)
+                self._buckets[webhook_url] = bucket
+            return bucket
+
+    def post(self, webhook_url: str, body: bytes) -> Dict:
+        """
+        发送消息（限流、重试）
+
+        Args:
+            webhook_url: 机器人webhook地址
+            body: 已序列化的JSON消息体
+
+        Returns:
+            接口返回结果，网络失败时errcode为-1
+        """
+        bucket = self.bucket(webhook_url)
+        result = {'errcode': -1, 'errmsg': '未发送'}
+
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                time.sleep(backoff_delay(attempt - 1))
+            bucket.acquire()
+            try:
+                with metrics.track_http('wecom') as call:
+                    response = self.session.post(webhook_url, data=body, timeout=self.timeout)
+                    call['status'] = response.status_code
+                result = response.json()
+            except (requests.RequestException, ValueError) as e:
+                result = {'errcode': -1, 'errmsg': f"网络异常：{e}"}
+                _count_result(result)
+                continue
+            _count_result(result)
+
+            if result.get('errcode') != ERRCODE_RATE_LIMITED:
+                return result
+            bucket.penalize()
+
+        return result
+
+
+class SendQueue:
+    """后台发送队列
+
+    同一webhook的任务固定分配给同一个工作线程，保证消息顺序；提交后立即返回Future
+    """
+
+    def __init__(self, workers: int = 2):
+        self._queues: List[queue.Queue] = []
+        for i in range(workers):
+            q = queue.Queue()
+            thread = threading.Thread(target=self._worker, args=(q,), name=f"wechat-send-{i}", daemon=True)
+            thread.start()
+            self._queues.append(q)
+
+    @staticmethod
+    def _worker(q: queue.Queue):
+        while True:
+            future, func, args, kwargs = q.get()
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(func(*args, **kwargs))
+            except Exception as e:
+                future.set_exception(e)
+
+    def submit(self, key: str, func: Callable, *args, **kwargs) -> Future:
+        """
+        提交发送任务
+
+        Args:
+            key: 分片键（通常是webhook地址）
+            func: 要执行的发送函数
+
+        Returns:
+            任务的Future
+        """
+        future = Future()
+        shard = zlib.crc32(key.encode('utf-8')) % len(self._queues)
+        self._queues[shard].put((future, func, args, kwargs))
+        return future
+
+
+class AsyncTokenBucket:
+    """令牌桶限流器（asyncio）"""
+
+    def __init__(self, rate: float = DEFAULT_RATE, capacity: int = DEFAULT_BURST):
+        self._bucket = TokenBucket(rate, capacity)
+
+    async def acquire(self):
+        wait = self._bucket.reserve()
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def penalize(self):
+        self._bucket.penalize()
+
+
+class AsyncWeChatTransport:
+    """企业微信webhook发送通道（asyncio）"""
+
+    def __init__(self, timeout: float = 10, max_retries: int = 3,
+                 rate: float = DEFAULT_RATE, burst: int = DEFAULT_BURST):
+        self.max_retries = max_retries
+        self.rate = rate
+        self.burst = burst
+        self.client = AsyncHTTPClient(timeout=timeout)
+        self._buckets: Dict[str, AsyncTokenBucket] = {}
+
+    def bucket(self, webhook_url: str) -> AsyncTokenBucket:
+        """获取webhook对应的令牌桶"""
+        bucket = self._buckets.get(webhook_url)
+        if bucket is None:
+            bucket = AsyncTokenBucket(self.rate, self.burst)
+            self._buckets[webhook_url] = bucket
+        return bucket
+
+    async def post(self, webhook_url: str, body: bytes) -> Dict:
+        """
+        发送消息（限流、重试）
+
+        Args:
+            webhook_url: 机器人webhook地址
+            body: 已序列化的JSON消息体
+
+        Returns:
+            接口返回结果，网络失败时errcode为-1
+        """
+        bucket = self.bucket(webhook_url)
+        result = {'errcode': -1, 'errmsg': '未发送'}
+
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                await asyncio.sleep(backoff_delay(attempt - 1))
+            await bucket.acquire()
+            try:
+                with metrics.track_http('wecom') as call:
+                    call['status'], _, content = await self.client.request(
+                        'POST', webhook_url, body, {'Content-Type': 'application/json'}
+                    )
+                result = json.loads(content)
+            except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, ValueError) as e:
+                result = {'errcode': -1, 'errmsg': f"网络异常：{e}"}
+                _count_result(result)
+                continue
+            _count_result(result)
+
+            if result.get('errcode') != ERRCODE_RATE_LIMITED:
+                return result
+            bucket.penalize()
+
+        return result
+
+    async def close(self):
+        await self.client.close()